@@ -0,0 +1,152 @@
+# 语义答案缓存
+# 以问题向量为键缓存回答，新问题与已缓存问题的余弦相似度超过阈值时直接返回缓存的回答和上下文
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    def __init__(self, threshold: float = 0.95, ttl: float = 3600, capacity: int = 1000):
+        """
+        threshold: 命中所需的最低余弦相似度
+        ttl: 缓存有效期（秒），0 表示不过期
+        capacity: 最大缓存条数，超出后淘汰最久未使用的条目
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.capacity = capacity
+
+        # 条目ID -> {"question", "result", "created"}，按最近使用排序
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._vectors: Dict[int, np.ndarray] = {}
+        self._next_id = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+        # 由条目向量堆叠成的矩阵，条目变化后延迟重建
+        self._matrix = None
+        self._matrix_ids: List[int] = []
+
+        self.stats = {
+            "lookups": 0,
+            "hits": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0
+        }
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self, version: Optional[str]):
+        """向量库版本变化（重新入库）后清空缓存"""
+        if version != self._version:
+            if self._entries:
+                self.stats["invalidations"] += 1
+            self._entries.clear()
+            self._vectors.clear()
+            self._matrix = None
+            self._version = version
+
+    def _remove(self, entry_id: int):
+        self._entries.pop(entry_id, None)
+        self._vectors.pop(entry_id, None)
+        self._matrix = None
+
+    def lookup(self, embedding: List[float], version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        查找相似问题的缓存回答
+
+        embedding: 问题向量
+        version: 当前向量库版本
+
+        returns: 命中时返回缓存的结果字典（附带 similarity 与 cached_question），否则返回 None
+        """
+        with self._lock:
+            self._check_version(version)
+            self.stats["lookups"] += 1
+            if not self._entries:
+                return None
+
+            # 清理过期条目
+            if self.ttl:
+                now = time.time()
+                expired = [i for i, entry in self._entries.items() if now - entry["created"] > self.ttl]
+                for entry_id in expired:
+                    self._remove(entry_id)
+                self.stats["expirations"] += len(expired)
+                if not self._entries:
+                    return None
+
+            if self._matrix is None:
+                self._matrix_ids = list(self._entries.keys())
+                self._matrix = np.stack([self._vectors[i] for i in self._matrix_ids])
+
+            scores = self._matrix @ self._normalize(embedding)
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                return None
+
+            entry_id = self._matrix_ids[best]
+            self._entries.move_to_end(entry_id)
+            self.stats["hits"] += 1
+
+            entry = self._entries[entry_id]
+            result = dict(entry["result"])
+            result["similarity"] = similarity
+            result["cached_question"] = entry["question"]
+            return result
+
+    def store(self, question: str, embedding: List[float], result: Dict[str, Any], version: Optional[str] = None):
+        """
+        缓存回答
+
+        question: 问题
+        embedding: 问题向量
+        result: 需要缓存的结果字典
+        version: 生成回答时的向量库版本
+        """
+        with self._lock:
+            self._check_version(version)
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "question": question,
+                "result": dict(result),
+                "created": time.time()
+            }
+            self._vectors[entry_id] = self._normalize(embedding)
+            self._matrix = None
+
+            while len(self._entries) > self.capacity:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._vectors.clear()
+            self._matrix = None
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        获取缓存统计
+
+        returns: 查找、命中、淘汰、过期、失效次数，当前条数及命中率
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self._entries)
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        return stats
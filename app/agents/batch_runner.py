@@ -0,0 +1,232 @@
+# 批量问答
+# 从 JSONL 文件读取问题，按轮次统一嵌入与检索，限制同时进行的生成数，结果逐行追加写入输出文件
+# 输出文件中已成功回答的问题ID会被跳过，中断后重新运行即可续跑，失败的问题会重新回答
+
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, IO, Iterator, List, Optional, Set
+
+from config import Config
+from app import tracing
+from app.agents.qa_agent import QAAgent
+
+
+def read_questions(input_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    逐行读取问题文件
+
+    input_path: JSONL 文件路径，每行形如 {"id": ..., "question": ...}，缺少 id 时使用行号
+
+    returns: {"id", "question", 以及原行中的其他字段} 的迭代器
+    """
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"跳过第 {line_number} 行，JSON 格式错误: {str(e)}")
+                continue
+            if not isinstance(row, dict) or not row.get("question"):
+                print(f"跳过第 {line_number} 行，缺少 question 字段")
+                continue
+            row["id"] = str(row.get("id", line_number))
+            yield row
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """
+    读取输出文件中已成功回答的问题ID，用于续跑；失败的问题不计入，续跑时重新回答（同一ID以最后一行为准）
+
+    output_path: 结果文件路径
+
+    returns: 已成功回答的问题ID集合
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+                if row.get("success"):
+                    done.add(str(row["id"]))
+                else:
+                    done.discard(str(row["id"]))
+            except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+                # 中断时可能留下写了一半的最后一行
+                continue
+    return done
+
+
+def repair_output(output_path: str):
+    """
+    续跑追加写入前修复输出文件的末尾：中断时写了一半的最后一行会与之后追加的第一行连在一起，
+    无法解析时截掉，能解析时补上换行
+
+    output_path: 结果文件路径
+    """
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if not size:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+
+        # 向前查找最后一个换行
+        end = size
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            position = f.read(end - start).rfind(b"\n")
+            if position >= 0:
+                end = start + position + 1
+                break
+            end = start
+        f.seek(end)
+        tail = f.read()
+        try:
+            json.loads(tail)
+            f.write(b"\n")
+        except ValueError:
+            print(f"输出文件最后一行不完整，已截掉 {len(tail)} 字节")
+            f.truncate(end)
+
+
+class BatchRunner:
+    def __init__(self, agent: QAAgent, chunk_size: Optional[int] = None, concurrency: Optional[int] = None):
+        """
+        agent: 问答代理
+        chunk_size: 每轮一起嵌入和检索的问题数，默认使用 Config.BATCH_CHUNK_SIZE
+        concurrency: 同时进行的回答生成数，默认使用 Config.BATCH_CONCURRENCY
+        """
+        self.agent = agent
+        self.chunk_size = max(1, chunk_size or Config.BATCH_CHUNK_SIZE)
+        self.concurrency = max(1, concurrency or Config.BATCH_CONCURRENCY)
+
+        self.stats = {
+            "questions": 0,
+            "skipped": 0,
+            "failed": 0,
+            "cache_hits": 0,
+            "total_tokens": 0,
+            "seconds": 0.0
+        }
+
+    def _prepare_chunk(self, rows: List[Dict[str, Any]]):
+        """统一嵌入并检索一轮问题，返回 (问题向量列表, 检索结果列表, 每题分摊的耗时)"""
+        start = time.perf_counter()
+        questions = [row["question"] for row in rows]
+        embeddings = [None] * len(rows)
+        retrievals = [None] * len(rows)
+
+        if self.agent.use_rag:
+            with tracing.trace("batch_retrieval", questions=len(rows)):
+                try:
+                    embeddings = self.agent.rag_chain.retriever.embed_queries(questions)
+                    retrievals = self.agent.rag_chain.retrieve_batch(questions, embeddings=embeddings)
+                except Exception as e:
+                    # 批量嵌入失败时退回到逐题嵌入和检索
+                    print(f"批量嵌入或检索失败: {str(e)}")
+
+        return embeddings, retrievals, (time.perf_counter() - start) / len(rows)
+
+    def _answer(self, row: Dict[str, Any], embedding, retrieval, retrieval_seconds: float) -> Dict[str, Any]:
+        """生成单个问题的回答并整理为输出行"""
+        start = time.perf_counter()
+        result = self.agent.invoke(row["question"], embedding=embedding, retrieval=retrieval)
+        latency = time.perf_counter() - start
+
+        usage = result.get("usage") or {}
+
+        output = {key: value for key, value in row.items() if key not in ("id", "question")}
+        output.update({
+            "id": row["id"],
+            "question": row["question"],
+            "success": result["success"],
+            "answer": result["answer"],
+            "cache_hit": bool(result.get("cache_hit")),
+            "latency": round(latency + retrieval_seconds, 4),
+            "retrieval_latency": round(retrieval_seconds, 4),
+            "input_tokens": usage.get("input_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0)
+        })
+        return output
+
+    def _drain(self, in_flight: Set[Future], out: IO[str], limit: int):
+        """写入已完成的回答，直到在途数不超过 limit；谁先完成谁先写入，每行写完立即落盘，中断后可续跑"""
+        while len(in_flight) > limit:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                in_flight.remove(future)
+                output = future.result()
+                out.write(json.dumps(output, ensure_ascii=False) + "\n")
+                out.flush()
+
+                self.stats["questions"] += 1
+                self.stats["failed"] += 0 if output["success"] else 1
+                self.stats["cache_hits"] += 1 if output["cache_hit"] else 0
+                self.stats["total_tokens"] += output["total_tokens"]
+
+    def run(self, input_path: str, output_path: str) -> Dict[str, Any]:
+        """
+        批量回答问题文件中的所有问题
+
+        input_path: 输入 JSONL 文件路径
+        output_path: 输出 JSONL 文件路径，已存在时追加写入并跳过已成功回答的问题
+
+        returns: 包含统计信息的字典
+        """
+        start = time.perf_counter()
+        repair_output(output_path)
+        done = completed_ids(output_path)
+        if done:
+            print(f"输出文件中已有 {len(done)} 个结果，将跳过这些问题")
+
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        def chunks():
+            chunk = []
+            for row in read_questions(input_path):
+                if row["id"] in done:
+                    self.stats["skipped"] += 1
+                    continue
+                # 输入中重复的ID只回答一次
+                done.add(row["id"])
+                chunk.append(row)
+                if len(chunk) >= self.chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+        with open(output_path, "a", encoding="utf-8") as out, \
+                ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch-qa") as executor:
+            in_flight: Set[Future] = set()
+            for rows in chunks():
+                # 上一轮的回答仍在生成时就检索下一轮，只等在途数降到并发数，保持生成线程一直有活可做
+                self._drain(in_flight, out, self.concurrency)
+                embeddings, retrievals, retrieval_seconds = self._prepare_chunk(rows)
+                in_flight.update(
+                    executor.submit(self._answer, row, embedding, retrieval, retrieval_seconds)
+                    for row, embedding, retrieval in zip(rows, embeddings, retrievals)
+                )
+                print(f"已完成 {self.stats['questions']} 个问题")
+            self._drain(in_flight, out, 0)
+
+        self.stats["seconds"] = time.perf_counter() - start
+        return {
+            "success": self.stats["failed"] == 0,
+            "output_path": output_path,
+            **self.stats
+        }
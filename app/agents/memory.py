@@ -0,0 +1,222 @@
+# 对话记忆
+# 按词元预算保留最近几轮原文，更早的轮次在后台增量合并为摘要；只保存用户原始问题与回答，从不重发旧的检索上下文
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from config import Config
+from app.rag.tokens import count_tokens
+
+_SUMMARY_PROMPT = """请把下面的新对话内容合并进已有的对话摘要，输出更新后的摘要。
+要求：保留事实、数字、名称和用户的偏好与约束，删除寒暄和重复内容，不超过{limit}个字。
+
+已有摘要：
+{summary}
+
+新对话：
+{dialogue}
+
+更新后的摘要："""
+
+
+def _message_tokens(message: BaseMessage) -> int:
+    """单条消息的词元数（含约 4 个词元的消息格式开销）"""
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return count_tokens(content) + 4
+
+
+def _turn_messages(question: str, answer: str) -> List[BaseMessage]:
+    return [HumanMessage(content=question), AIMessage(content=answer)]
+
+
+def trim_history(chat_history: List[tuple], token_budget: Optional[int] = None) -> List[BaseMessage]:
+    """
+    将[(role, message), ...]格式的聊天历史转换为消息列表，只保留预算内最新的消息
+
+    chat_history: 聊天历史
+    token_budget: 词元预算，默认使用 Config.MEMORY_TOKEN_BUDGET，0 表示不限制
+
+    returns: 消息列表
+    """
+    token_budget = Config.MEMORY_TOKEN_BUDGET if token_budget is None else token_budget
+    messages = []
+    for role, message in chat_history or []:
+        if role == "user":
+            messages.append(HumanMessage(content=message))
+        elif role == "assistant":
+            messages.append(AIMessage(content=message))
+    if not token_budget:
+        return messages
+
+    kept, used = [], 0
+    for message in reversed(messages):
+        tokens = _message_tokens(message)
+        if used + tokens > token_budget:
+            break
+        kept.append(message)
+        used += tokens
+    return list(reversed(kept))
+
+
+class ConversationMemory:
+    def __init__(self, llm: Any = None, token_budget: Optional[int] = None, recent_turns: Optional[int] = None,
+                 summary_tokens: Optional[int] = None, background: bool = True):
+        """
+        llm: 用于生成摘要的聊天模型，默认使用共享的聊天模型
+        token_budget: 历史消息（摘要 + 原文轮次）的词元预算，默认使用 Config.MEMORY_TOKEN_BUDGET
+        recent_turns: 保留原文的最近轮数，默认使用 Config.MEMORY_RECENT_TURNS
+        summary_tokens: 摘要的词元上限，默认使用 Config.MEMORY_SUMMARY_TOKENS
+        background: 是否在后台线程中生成摘要
+        """
+        self._llm = llm
+        self.token_budget = Config.MEMORY_TOKEN_BUDGET if token_budget is None else token_budget
+        self.recent_turns = max(1, recent_turns or Config.MEMORY_RECENT_TURNS)
+        self.summary_tokens = summary_tokens or Config.MEMORY_SUMMARY_TOKENS
+        self.background = background
+
+        self.summary = ""
+        # 保留原文的轮次、等待合并进摘要的轮次，均为 (问题, 回答)
+        self.turns: List[Tuple[str, str]] = []
+        self._pending: List[Tuple[str, str]] = []
+        # 全部轮次，仅用于展示聊天历史
+        self.transcript: List[Tuple[str, str]] = []
+
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-summary") if background else None
+        self._future: Optional[Future] = None
+        self._summarizing = False
+
+        self.stats = {
+            "summaries": 0,
+            "summary_failures": 0
+        }
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            from app import resources
+            self._llm = resources.get_chat_model()
+        return self._llm
+
+    def __len__(self) -> int:
+        """记忆中的轮数"""
+        return len(self.transcript)
+
+    def add_turn(self, question: str, answer: str):
+        """
+        记录一轮对话，超出原文轮数或预算的旧轮次转入摘要
+
+        question: 用户原始问题（不含检索上下文）
+        answer: 助手回答
+        """
+        with self._lock:
+            self.turns.append((question, answer))
+            self.transcript.append((question, answer))
+
+            verbatim_budget = max(0, self.token_budget - self.summary_tokens) if self.token_budget else 0
+            while len(self.turns) > 1 and (
+                len(self.turns) > self.recent_turns or
+                (verbatim_budget and self._turns_tokens(self.turns) > verbatim_budget)
+            ):
+                self._pending.append(self.turns.pop(0))
+
+            if not self._pending:
+                return
+            if self._executor is not None:
+                # 后台任务会循环处理新加入的待合并轮次，运行中时无需重复提交
+                if not self._summarizing:
+                    self._summarizing = True
+                    self._future = self._executor.submit(self._summarize)
+                return
+
+        self._summarize()
+
+    @staticmethod
+    def _turns_tokens(turns: List[Tuple[str, str]]) -> int:
+        return sum(_message_tokens(message) for turn in turns for message in _turn_messages(*turn))
+
+    def _summarize(self):
+        """把待合并的轮次合并进摘要，直到没有待合并轮次"""
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._summarizing = False
+                    return
+                batch = list(self._pending)
+                summary = self.summary
+
+            dialogue = "\n".join(f"用户：{question}\n助手：{answer}" for question, answer in batch)
+            try:
+                response = self.llm.invoke(_SUMMARY_PROMPT.format(
+                    limit=self.summary_tokens, summary=summary or "（无）", dialogue=dialogue
+                ))
+                new_summary = response.content if hasattr(response, "content") else str(response)
+                self.stats["summaries"] += 1
+            except Exception as e:
+                # 摘要失败时退化为只保留最近几个问题的摘录，保证预算不被突破
+                print(f"生成对话摘要失败: {str(e)}")
+                new_summary = "\n".join([summary] + [f"用户问过：{question}" for question, _ in batch])
+                self.stats["summary_failures"] += 1
+
+            new_summary = self._truncate(new_summary.strip())
+            with self._lock:
+                self.summary = new_summary
+                del self._pending[:len(batch)]
+
+    def _truncate(self, text: str) -> str:
+        """摘要超出上限时保留末尾部分（较新的内容）"""
+        tokens = count_tokens(text)
+        if tokens <= self.summary_tokens:
+            return text
+        keep = int(len(text) * self.summary_tokens / tokens)
+        return text[-keep:] if keep else ""
+
+    def wait(self):
+        """等待后台摘要完成"""
+        future = self._future
+        if future is not None:
+            future.result()
+
+    def messages(self) -> List[BaseMessage]:
+        """
+        构造本轮要发送的历史消息：摘要 + 预算内最新的原文轮次；
+        后台摘要尚未完成时，待合并的轮次在预算允许时以原文补上
+
+        returns: 消息列表
+        """
+        with self._lock:
+            summary = self.summary
+            candidates = self._pending + self.turns
+
+        prefix = []
+        if summary:
+            prefix.append(SystemMessage(content=f"之前对话的摘要：\n{summary}"))
+        if not self.token_budget:
+            return prefix + [message for turn in candidates for message in _turn_messages(*turn)]
+
+        used = sum(_message_tokens(message) for message in prefix)
+        kept = []
+        for turn in reversed(candidates):
+            turn_messages = _turn_messages(*turn)
+            tokens = sum(_message_tokens(message) for message in turn_messages)
+            if used + tokens > self.token_budget:
+                break
+            kept = turn_messages + kept
+            used += tokens
+        return prefix + kept
+
+    def token_count(self) -> int:
+        """当前历史消息的词元数"""
+        return sum(_message_tokens(message) for message in self.messages())
+
+    def clear(self):
+        """清空记忆"""
+        self.wait()
+        with self._lock:
+            self.summary = ""
+            self.turns.clear()
+            self._pending.clear()
+            self.transcript.clear()
@@ -0,0 +1,236 @@
+# 交互模式的预取检索
+# 启动时在后台预热索引；每轮检索完成后、回答生成期间，以本轮问题中的实体（编号、名称等）为话题在后台检索一次，
+# 作为之后追问的候选；问题中没有实体时沿用上一话题的实体，以"实体 + 问题"改写查询。
+# 下一个问题没有引入新的实体、且其内容词项（按 BM25 的 idf 加权）大部分能在候选中找到时视为追问，把候选按"实体 + 追问"重排后
+# 直接进入检索后处理，省去追问的嵌入与检索；否则照常检索。追问带来候选中没有的词项时，以"实体 + 追问"刷新候选。
+# 内容词项为 BM25 的词项（英文词、数字与中文词或二元组），不用单字：常用字几乎总能在候选中找到，
+# 换了话题也会被误判为追问；按 idf 加权后，新话题特有的少见词项（如"双减"）比"政策""规定"这类常见词项更重，
+# 知识库中没有的词项检索不到任何内容，不参与判断。判断偏保守：宁可多检索一次，也不在不相关的候选上回答
+
+import math
+import re
+import threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from config import Config
+from app import tracing
+from app.rag.sparse_index import reciprocal_rank_fusion, tokenize
+
+_ENTITY_PATTERNS = [
+    # 引号、书名号中的名称
+    re.compile(r"[“「『《\"]([^”」』》\"\n]{1,30})[”」』》\"]"),
+    # 含数字的编号（R0014、GPT-4o、v2.1）与大写开头的英文名称（LangChain、API）
+    re.compile(r"(?<![A-Za-z0-9])(?:[A-Za-z][A-Za-z0-9._\-]*\d[A-Za-z0-9._\-]*|[A-Z][A-Za-z0-9]+)"),
+    # 带量词的序号（14路、3号线、第5章）
+    re.compile(r"\d+(?:号线|路|号|期|章|节|条|款|版)")
+]
+# 不表达内容的常用字（代词、助词、疑问词），含有这些字的中文词项不参与追问与候选的匹配
+_FUNCTION_CHARS = set("的了吗呢吧啊呀嘛么是在有和与及或那这它其该个些几多少什怎样哪谁请问还也都就要会能可以")
+
+
+def extract_entities(text: str) -> List[str]:
+    """
+    抽取问题中的实体：引号或书名号中的名称、编号、英文名称与带量词的序号
+
+    text: 问题
+
+    returns: 按出现顺序去重的实体列表
+    """
+    entities = []
+    for pattern in _ENTITY_PATTERNS:
+        for match in pattern.finditer(text):
+            entity = (match.group(1) if match.groups() else match.group(0)).strip()
+            if entity and entity not in entities:
+                entities.append(entity)
+    return entities
+
+
+def _content_terms(text: str) -> Set[str]:
+    """内容词项：tokenize 得到的英文词与数字，以及至少两个字、不含常用虚字的中文词（未安装 jieba 时为二元组）"""
+    return {term for term in tokenize(text)
+            if term.isascii() or (len(term) > 1 and not _FUNCTION_CHARS.intersection(term))}
+
+
+def _lexical_order(query: str, documents: List[Any]) -> List[Any]:
+    """按与查询共有词项的 IDF 加权数（只在候选内统计）排序候选"""
+    terms = set(tokenize(query))
+    doc_terms = [set(tokenize(doc.page_content)) & terms for doc in documents]
+    df = Counter(term for shared in doc_terms for term in shared)
+    scores = [sum(math.log(1 + len(documents) / df[term]) for term in shared) for shared in doc_terms]
+    return [documents[i] for i in sorted(range(len(documents)), key=lambda i: (-scores[i], i))]
+
+
+class RetrievalPrefetcher:
+    def __init__(self, rag_chain: Any = None, fetch_k: Optional[int] = None, match_ratio: Optional[float] = None):
+        """
+        rag_chain: 代理使用的 RAG 链，预取与检索后处理都通过它完成；不传时由 warm_up 在后台取得
+        fetch_k: 每次预取的候选数，默认使用 Config.PREFETCH_K
+        match_ratio: 追问的内容词项（按 idf 加权）在候选中出现的最低比例，默认使用 Config.PREFETCH_MATCH_RATIO
+        """
+        self.rag_chain = rag_chain
+        self.fetch_k = fetch_k or Config.PREFETCH_K
+        self.match_ratio = Config.PREFETCH_MATCH_RATIO if match_ratio is None else match_ratio
+
+        # 单线程执行：同一时间最多一个预热或预取任务，新的预取排在上一个之后
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._pending: Optional[Dict[str, Any]] = None
+        self._warm_up: Optional[Future] = None
+
+        self.stats = {
+            "speculations": 0,
+            "hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "waits": 0
+        }
+
+    def warm_up(self, load: Optional[Callable[[], Any]] = None) -> Future:
+        """
+        在后台预热：取得 RAG 链（连同检索器、代理图等首次使用时才创建的对象），再预热索引
+
+        load: 返回 RAG 链的函数，在后台线程中执行；不传时使用构造时传入的 RAG 链
+
+        returns: 预热任务，结果为 VectorRetriever.warm_up 的返回值
+        """
+        def run():
+            with tracing.trace("warm_up"):
+                if load is not None:
+                    self.rag_chain = load()
+                return self.rag_chain.retriever.warm_up()
+
+        self._warm_up = self._executor.submit(run)
+        return self._warm_up
+
+    def wait_warm_up(self):
+        """等待预热完成（检索器在预热期间不宜并发使用），预热失败不影响后续问答"""
+        if self._warm_up is not None:
+            try:
+                self._warm_up.result()
+            except Exception as e:
+                print(f"预热失败: {str(e)}")
+            self._warm_up = None
+
+    def _version(self) -> str:
+        retriever = self.rag_chain.retriever
+        return retriever.collection_version() + retriever.scope_key()
+
+    def _coverage(self, terms: Set[str], fetched_terms: Set[str]) -> float:
+        """问题的内容词项按 idf 加权后在候选中出现的比例；没有 BM25 索引时每个词项权重相同"""
+        sparse_index = self.rag_chain.retriever.sparse_index
+        weights = sparse_index.idf(terms) if sparse_index is not None else dict.fromkeys(terms, 1.0)
+        total = sum(weights.values())
+        if not total:
+            return 1.0
+        return sum(weight for term, weight in weights.items() if term in fetched_terms) / total
+
+    def _fetch(self, topic: str, previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """后台预取：检索话题并记录候选的内容词项；传入 previous 时与已有候选按排名融合，保留话题原有的候选"""
+        with tracing.trace("prefetch", query=topic):
+            candidates = self.rag_chain.retriever.search(topic, k=self.fetch_k)
+            if previous is not None:
+                candidates = reciprocal_rank_fusion([previous["candidates"], candidates],
+                                                    k=self.fetch_k, rrf_k=Config.RRF_K)
+            terms = set()
+            for doc in candidates:
+                terms |= _content_terms(doc.page_content)
+            return {"candidates": candidates, "terms": terms}
+
+    def speculate(self, question: str, followed: bool = False):
+        """
+        本轮检索完成后调用：为之后可能的追问在后台预取候选
+
+        本轮使用了预取结果时话题不变：追问的内容词项都在候选中则沿用已预取的候选，否则以"实体 + 追问"补充检索，
+        与已有候选融合；
+        其余情况以本轮问题中的实体为新话题重新预取，问题中没有实体时沿用上一话题的实体，以"实体 + 本轮问题"作为改写后的查询
+
+        question: 本轮问题
+        followed: 本轮是否使用了预取结果
+        """
+        if self.rag_chain is None:
+            return
+        with self._lock:
+            pending = self._pending
+            previous = None
+            if followed and pending is not None:
+                # take 已等待预取完成，这里直接取结果
+                previous = pending["future"].result()
+                if not _content_terms(question) - previous["terms"]:
+                    return
+                entities = pending["entities"]
+                topic = " ".join(entities + [question])
+            else:
+                entities = extract_entities(question)
+                if entities:
+                    topic = " ".join(entities)
+                else:
+                    entities = pending["entities"] if pending is not None else []
+                    topic = " ".join(entities + [question])
+            self._pending = {
+                "entities": entities,
+                "topic": topic,
+                "version": self._version(),
+                "future": self._executor.submit(self._fetch, topic, previous)
+            }
+            self.stats["speculations"] += 1
+
+    def take(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        问题是上一话题的追问时，在预取的候选上完成检索
+
+        question: 本轮问题
+
+        returns: 与 RAGChain.retrieve 格式相同的检索结果，不是追问或预取结果不可用时返回 None
+        """
+        self.wait_warm_up()
+        with self._lock:
+            pending = self._pending
+        if pending is None or self.rag_chain is None:
+            return None
+
+        known = {entity.lower() for entity in pending["entities"]}
+        if any(entity.lower() not in known for entity in extract_entities(question)):
+            # 引入了新的实体，是新话题
+            self.stats["misses"] += 1
+            return None
+
+        future = pending["future"]
+        if not future.done():
+            # 回答生成得比预取快（或用户输入很快），等待预取完成仍比重新嵌入和检索快
+            self.stats["waits"] += 1
+        try:
+            fetched = future.result()
+        except Exception as e:
+            print(f"预取检索失败: {str(e)}")
+            return None
+
+        if pending["version"] != self._version():
+            # 预取之后向量库有写入或检索范围变化，候选已过期
+            self.stats["stale"] += 1
+            return None
+
+        candidates = fetched["candidates"]
+        if not candidates or self._coverage(_content_terms(question), fetched["terms"]) < self.match_ratio:
+            self.stats["misses"] += 1
+            return None
+
+        # 以"实体 + 追问"作为改写后的问题，在候选内按词项重排，并与预取时的排名融合
+        rewritten = " ".join(pending["entities"] + [question])
+        ranked = reciprocal_rank_fusion([candidates, _lexical_order(rewritten, candidates)],
+                                        k=len(candidates), rrf_k=Config.RRF_K)
+        retrieval = self.rag_chain.retrieve_from(question, ranked)
+        if not retrieval["success"]:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return retrieval
+
+    def get_stats(self) -> Dict[str, Any]:
+        """预取统计：命中率为使用了预取结果的问题占尝试匹配的问题的比例"""
+        attempts = self.stats["hits"] + self.stats["misses"] + self.stats["stale"]
+        return {**self.stats, "hit_rate": self.stats["hits"] / attempts if attempts else 0.0}
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
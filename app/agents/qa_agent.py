@@ -1,24 +1,26 @@
 # 知识问答 Agent
 
-from typing import Dict, List, Any, Optional
-from langchain.agents import create_agent
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain_openai import ChatOpenAI
+import asyncio
+import threading
+import time
+from typing import Dict, Iterator, List, Any, Optional
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
 
 from config import Config
+from app import resources, tracing
+from app.agents.answer_cache import SemanticAnswerCache
+from app.agents.memory import ConversationMemory, trim_history
 from app.rag.chain import RAGChain
+from app.rag.retriever import VectorRetriever
 from app.tools.calculator import CalculatorTool
 
 class QAAgent:
-    def __init__(self, use_rag: bool = True):
-        """ use_rag: 是否使用RAG功能 """
+    def __init__(self, use_rag: bool = True, retriever: Optional[VectorRetriever] = None):
+        """
+        use_rag: 是否使用RAG功能
+        retriever: 共享的向量检索器，不传时由RAG链自行创建
+        """
         self.use_rag = use_rag
-        self.llm = ChatOpenAI(
-            model=Config.MODEL_NAME,
-            temperature=Config.TEMPERATURE,
-            api_key=Config.OPENAI_API_KEY,
-            base_url=Config.OPENAI_BASE_URL
-        )
         
         # 初始化工具
         self.calculator = CalculatorTool()
@@ -26,12 +28,46 @@ class QAAgent:
         
         # 初始化RAG链
         if use_rag:
-            self.rag_chain = RAGChain()
+            self.rag_chain = RAGChain(retriever=retriever)
+        
+        # 语义答案缓存：相似问题直接返回缓存的回答，不调用大模型
+        self.answer_cache = None
+        if use_rag and Config.ANSWER_CACHE_ENABLED:
+            self.answer_cache = SemanticAnswerCache(
+                threshold=Config.ANSWER_CACHE_THRESHOLD,
+                ttl=Config.ANSWER_CACHE_TTL,
+                capacity=Config.ANSWER_CACHE_CAPACITY
+            )
+        
+        # 代理图在首次回答问题时创建，导入 langchain.agents 与构建图的开销不计入启动时间
+        self._agent = None
+        self._agent_lock = threading.Lock()
         
-        self.agent = self._create_agent()
+        # 代理调用计数：agent_calls 为代理调用次数，llm_calls 为大模型生成的消息数
+        # HTTP 服务与批量模式会在多个线程中调用同一个代理，计数需加锁
+        self.stats = {
+            "agent_calls": 0,
+            "llm_calls": 0
+        }
+        self._stats_lock = threading.Lock()
+    
+    @property
+    def llm(self):
+        return resources.get_chat_model()
+    
+    @property
+    def agent(self):
+        """代理图，首次访问时创建"""
+        if self._agent is None:
+            with self._agent_lock:
+                if self._agent is None:
+                    self._agent = self._create_agent()
+        return self._agent
     
     def _create_agent(self):
         """ 创建代理 """
+        from langchain.agents import create_agent
+        
         # 定义系统提示
         system_prompt = """你是一个知识问答助手，能够回答问题、调用工具和执行任务。
             你有以下工具可以使用：
@@ -50,84 +86,381 @@ class QAAgent:
             请用中文回答问题。"""
         
         agent = create_agent(
-            model=f'{Config.MODEL_NAME}',
+            model=self.llm,
             tools=self.tools,
             system_prompt=system_prompt
         )
         
         return agent
     
-    def invoke(self, question: str, chat_history: Optional[List[tuple]] = None) -> Dict[str, Any]:
+    @staticmethod
+    def _format_history(chat_history) -> List[Any]:
         """
+        将聊天历史转换为消息列表：ConversationMemory 返回摘要加最近轮次，
+        [(role, message), ...] 列表只保留词元预算内最新的消息
+        """
+        with tracing.span("history") as span:
+            if isinstance(chat_history, ConversationMemory):
+                messages = chat_history.messages()
+            else:
+                messages = trim_history(chat_history)
+            span.set(messages=len(messages))
+            return messages
+    
+    def _lookup_cache(self, question: str, prepared: Dict[str, Any], embedding: List[float]) -> bool:
+        """
+        用问题向量查询语义答案缓存，命中时把结果写入 prepared["cached"]
+        
         question: 问题
-        chat_history: 聊天历史，格式为[(role, message), ...]   
-        returns: 包含答案和元数据的字典
+        prepared: _prepare 正在构建的字典
+        embedding: 问题向量
+        returns: 是否命中
         """
-        try:
-            # 准备聊天历史
-            formatted_history = []
-            if chat_history:
-                for role, message in chat_history:
-                    if role == "user":
-                        formatted_history.append(HumanMessage(content=message))
-                    elif role == "assistant":
-                        formatted_history.append(AIMessage(content=message))
-            
-            # 如果使用RAG，先检索相关文档
-            context = ""
-            if self.use_rag:
-                try:
-                    rag_result = self.rag_chain.invoke(question)
-                    if rag_result['success']:
-                        context = rag_result['context']
-                        print(f"检索到相关上下文: {context[:100]}...")
-                except Exception as e:
-                    print(f"RAG检索失败: {str(e)}")
-            
+        prepared["query_embedding"] = embedding
+        retriever = self.rag_chain.retriever
+        # 检索范围不同时上下文不同，范围作为缓存版本的一部分
+        prepared["cache_version"] = retriever.collection_version() + retriever.scope_key()
+        with tracing.span("answer_cache") as span:
+            cached = self.answer_cache.lookup(embedding, prepared["cache_version"])
+            span.set(cache_hit=cached is not None)
+        if cached is None:
+            return False
+        print(f"命中答案缓存 (相似度 {cached['similarity']:.3f}): {cached['cached_question']}")
+        cached["cache_hit"] = True
+        # 缓存命中没有调用大模型，不沿用原回答的词元用量
+        cached["usage"] = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+        prepared["cached"] = cached
+        return True
+    
+    @staticmethod
+    def _build_input(question: str, formatted_history: List[Any], context: str, prepared: Dict[str, Any]):
+        """根据检索到的上下文构造代理输入"""
+        with tracing.span("build_prompt") as span:
             # 如果有上下文，修改问题
             if context:
                 enhanced_question = f"""基于以下上下文回答问题：
-                    上下文：
-                    {context}
+                上下文：
+                {context}
 
-                    问题：{question}"""
+                问题：{question}"""
             else:
                 enhanced_question = question
             
             # 准备输入
-            agent_input = {
+            prepared["context"] = context
+            prepared["agent_input"] = {
                 "messages": formatted_history + [HumanMessage(content=enhanced_question)]
             }
+            for message in prepared["agent_input"]["messages"]:
+                span.set_tokens(message.content if isinstance(message.content, str) else str(message.content))
+    
+    @staticmethod
+    def _empty_prepared() -> Dict[str, Any]:
+        return {
+            "cached": None,
+            "agent_input": None,
+            "context": "",
+            "query_embedding": None,
+            "cache_version": None
+        }
+    
+    def _prepare(self, question: str, chat_history: Optional[List[tuple]] = None,
+                 embedding: Optional[List[float]] = None,
+                 retrieval: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        准备代理输入：格式化聊天历史、查询答案缓存、检索上下文
+        
+        question: 问题
+        chat_history: 聊天历史，ConversationMemory 或[(role, message), ...]
+        embedding: 已计算好的问题向量（批量模式），传入时不再重复嵌入
+        retrieval: 已完成的检索结果（批量模式、交互模式的预取），传入时不再重复检索
+        returns: 包含 cached（命中缓存时的结果）、agent_input、context 等字段的字典
+        """
+        formatted_history = self._format_history(chat_history)
+        prepared = self._empty_prepared()
+        
+        # 没有聊天历史时，回答只取决于问题本身，可以查询语义答案缓存
+        if self.answer_cache is not None and not chat_history:
+            try:
+                if embedding is None:
+                    embedding = self.rag_chain.retriever.embed_query(question)
+                if self._lookup_cache(question, prepared, embedding):
+                    return prepared
+            except Exception as e:
+                print(f"查询答案缓存失败: {str(e)}")
+        
+        # 如果使用RAG，先检索相关文档
+        context = ""
+        if self.use_rag:
+            try:
+                # 仅检索，不让RAG链额外生成回答；已计算的问题向量直接复用
+                rag_result = retrieval or self.rag_chain.retrieve(question, embedding=embedding)
+                if rag_result['success']:
+                    context = rag_result['context']
+                    print(f"检索到相关上下文: {context[:100]}...")
+            except Exception as e:
+                print(f"RAG检索失败: {str(e)}")
+        
+        self._build_input(question, formatted_history, context, prepared)
+        return prepared
+    
+    async def _aprepare(self, question: str, chat_history: Optional[List[tuple]] = None) -> Dict[str, Any]:
+        """
+        _prepare 的异步版本：问题嵌入在格式化聊天历史的同时发出，检索时关键词检索与向量检索并行
+        
+        question: 问题
+        chat_history: 聊天历史，ConversationMemory 或[(role, message), ...]
+        returns: 与 _prepare 相同的字典
+        """
+        embed_task = None
+        if self.answer_cache is not None and not chat_history:
+            embed_task = asyncio.ensure_future(self.rag_chain.retriever.aembed_query(question))
+        
+        formatted_history = self._format_history(chat_history)
+        prepared = self._empty_prepared()
+        
+        if embed_task is not None:
+            try:
+                embedding = await embed_task
+                if self._lookup_cache(question, prepared, embedding):
+                    return prepared
+            except Exception as e:
+                print(f"查询答案缓存失败: {str(e)}")
+        
+        context = ""
+        if self.use_rag:
+            try:
+                rag_result = await self.rag_chain.aretrieve(question, embedding=prepared["query_embedding"])
+                if rag_result['success']:
+                    context = rag_result['context']
+                    print(f"检索到相关上下文: {context[:100]}...")
+            except Exception as e:
+                print(f"RAG检索失败: {str(e)}")
+        
+        self._build_input(question, formatted_history, context, prepared)
+        return prepared
+    
+    def _finish(self, question: str, prepared: Dict[str, Any], new_messages: List[Any]) -> Dict[str, Any]:
+        """
+        根据代理新产生的消息整理回答并写入答案缓存
+        
+        question: 问题
+        prepared: _prepare 的返回值
+        new_messages: 本轮代理新产生的消息
+        returns: 包含答案和元数据的字典
+        """
+        with tracing.span("extract_answer"):
+            llm_calls = sum(1 for message in new_messages if isinstance(message, AIMessage))
+            with self._stats_lock:
+                self.stats["agent_calls"] += 1
+                self.stats["llm_calls"] += llm_calls
             
-            result = self.agent.invoke(agent_input)
-            
-            # 提取回答
+            # 从消息中提取最后一条AI消息
             answer = ""
-            if isinstance(result, dict) and "messages" in result:
-                # 从消息中提取最后一条AI消息
-                for message in reversed(result["messages"]):
-                    if isinstance(message, AIMessage):
-                        answer = message.content
-                        break
-            elif isinstance(result, str):
-                answer = result
-            elif hasattr(result, "content"):
-                answer = result.content
-            else:
-                answer = str(result)
+            for message in reversed(new_messages):
+                if isinstance(message, AIMessage):
+                    answer = message.content
+                    break
+            
+            # 汇总本轮各次模型调用的词元用量
+            usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+            for message in new_messages:
+                for key, value in (getattr(message, "usage_metadata", None) or {}).items():
+                    if key in usage:
+                        usage[key] += value
             
-            return {
+            response = {
                 "success": True,
                 "answer": answer,
-                "context": context,
-                "intermediate_steps": []
+                "context": prepared["context"],
+                "intermediate_steps": self._intermediate_steps(new_messages),
+                "cache_hit": False,
+                "usage": usage
             }
             
-        except Exception as e:
-            print(f"代理执行失败: {str(e)}")
-            return {
-                "success": False,
-                "answer": f"处理问题出错: {str(e)}",
-                "context": "",
-                "intermediate_steps": []
-            }
\ No newline at end of file
+            if prepared["query_embedding"] is not None and answer:
+                self.answer_cache.store(question, prepared["query_embedding"], response, prepared["cache_version"])
+            
+            return response
+    
+    @staticmethod
+    def _intermediate_steps(new_messages: List[Any]) -> List[Dict[str, Any]]:
+        """
+        从代理新产生的消息中整理工具调用步骤
+        
+        new_messages: 本轮代理新产生的消息
+        returns: [{"tool", "tool_input", "observation"}, ...]
+        """
+        observations = {
+            message.tool_call_id: message.content
+            for message in new_messages if isinstance(message, ToolMessage)
+        }
+        steps = []
+        for message in new_messages:
+            if isinstance(message, AIMessage):
+                for tool_call in message.tool_calls:
+                    steps.append({
+                        "tool": tool_call["name"],
+                        "tool_input": tool_call["args"],
+                        "observation": observations.get(tool_call["id"], "")
+                    })
+        return steps
+    
+    @staticmethod
+    def _error_result(error: Exception) -> Dict[str, Any]:
+        """代理执行失败时的返回值"""
+        print(f"代理执行失败: {str(error)}")
+        return {
+            "success": False,
+            "answer": f"处理问题出错: {str(error)}",
+            "context": "",
+            "intermediate_steps": [],
+            "cache_hit": False
+        }
+    
+    def invoke(self, question: str, chat_history: Optional[List[tuple]] = None,
+               embedding: Optional[List[float]] = None,
+               retrieval: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        question: 问题
+        chat_history: 聊天历史，ConversationMemory 或[(role, message), ...]   
+        embedding: 已计算好的问题向量，批量模式下由调用方统一嵌入
+        retrieval: 已完成的检索结果，批量模式下由调用方统一检索
+        returns: 包含答案和元数据的字典
+        """
+        with tracing.trace("qa", question=question):
+            try:
+                prepared = self._prepare(question, chat_history, embedding=embedding, retrieval=retrieval)
+                if prepared["cached"] is not None:
+                    return prepared["cached"]
+                
+                agent_input = prepared["agent_input"]
+                result = self.agent.invoke(agent_input, config=tracing.run_config())
+                
+                return self._finish(question, prepared, result["messages"][len(agent_input["messages"]):])
+                
+            except Exception as e:
+                return self._error_result(e)
+    
+    async def ainvoke(self, question: str, chat_history: Optional[List[tuple]] = None) -> Dict[str, Any]:
+        """
+        invoke 的异步版本，嵌入、检索和生成都不阻塞事件循环，可在同一事件循环上并发处理多个问题
+        
+        question: 问题
+        chat_history: 聊天历史，ConversationMemory 或[(role, message), ...]
+        returns: 包含答案和元数据的字典
+        """
+        with tracing.trace("qa", question=question):
+            try:
+                prepared = await self._aprepare(question, chat_history)
+                if prepared["cached"] is not None:
+                    return prepared["cached"]
+                
+                agent_input = prepared["agent_input"]
+                result = await self.agent.ainvoke(agent_input, config=tracing.run_config())
+                
+                return self._finish(question, prepared, result["messages"][len(agent_input["messages"]):])
+                
+            except Exception as e:
+                return self._error_result(e)
+    
+    def stream(self, question: str, chat_history: Optional[List[tuple]] = None,
+               retrieval: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        流式回答问题，逐个产出事件：
+            {"type": "retrieval", "context", "cache_hit", "elapsed"}  检索完成
+            {"type": "tool_call", "name", "args"}                     代理调用工具
+            {"type": "tool_result", "name", "content"}                工具返回结果
+            {"type": "token", "content"}                              回答的增量文本
+            {"type": "final", "result", "ttft", "total"}              最终结果、首字延迟与总耗时（秒）
+        
+        question: 问题
+        chat_history: 聊天历史，ConversationMemory 或[(role, message), ...]
+        retrieval: 已完成的检索结果（如交互模式预取的结果），传入时不再重复检索
+        returns: 事件迭代器
+        """
+        # 追踪不能跨 yield 绑定在上下文中：只在不 yield 的各阶段内激活，调用方的片段不会挂到这条追踪上
+        current = tracing.start_trace("qa", question=question)
+        start = time.perf_counter()
+        ttft = None
+        error = None
+        
+        try:
+            try:
+                with current.activate():
+                    prepared = self._prepare(question, chat_history, retrieval=retrieval)
+                cached = prepared["cached"]
+                yield {
+                    "type": "retrieval",
+                    "context": cached["context"] if cached else prepared["context"],
+                    "cache_hit": cached is not None,
+                    "elapsed": time.perf_counter() - start
+                }
+                
+                if cached is not None:
+                    ttft = time.perf_counter() - start
+                    yield {"type": "token", "content": cached["answer"]}
+                    result = cached
+                else:
+                    new_messages = []
+                    with current.activate():
+                        stream = self.agent.stream(prepared["agent_input"], stream_mode=["messages", "updates"],
+                                                   config=tracing.run_config())
+                    while True:
+                        # 代理图在 next() 中执行，每一步单独激活追踪
+                        with current.activate():
+                            item = next(stream, None)
+                        if item is None:
+                            break
+                        mode, payload = item
+                        if mode == "messages":
+                            chunk, metadata = payload
+                            # 只转发模型生成的文本（流式模型为增量块，非流式模型为整条消息），工具消息在 updates 中处理
+                            if isinstance(chunk, AIMessage) and isinstance(chunk.content, str) and chunk.content:
+                                if ttft is None:
+                                    ttft = time.perf_counter() - start
+                                yield {"type": "token", "content": chunk.content}
+                            continue
+                        
+                        # updates 模式：每个节点执行完后的完整消息
+                        for update in payload.values():
+                            for message in (update or {}).get("messages", []):
+                                new_messages.append(message)
+                                if isinstance(message, AIMessage):
+                                    for tool_call in message.tool_calls:
+                                        yield {"type": "tool_call", "name": tool_call["name"], "args": tool_call["args"]}
+                                elif isinstance(message, ToolMessage):
+                                    yield {"type": "tool_result", "name": message.name, "content": message.content}
+                    
+                    with current.activate():
+                        result = self._finish(question, prepared, new_messages)
+            except Exception as e:
+                error = e
+                result = self._error_result(e)
+            
+            total = time.perf_counter() - start
+        finally:
+            # 调用方提前关闭生成器时也结束追踪
+            current.finish(error)
+        
+        yield {
+            "type": "final",
+            "result": result,
+            "ttft": ttft if ttft is not None else total,
+            "total": total
+        }
+    
+    def get_stats(self) -> Dict[str, int]:
+        """
+        获取调用计数
+        
+        returns: 嵌入、检索和生成次数
+        """
+        with self._stats_lock:
+            stats = dict(self.stats)
+        if self.use_rag:
+            stats.update(self.rag_chain.retriever.get_stats())
+            stats["rag_generations"] = self.rag_chain.get_stats()["generations"]
+        if self.answer_cache is not None:
+            stats["answer_cache_hits"] = self.answer_cache.stats["hits"]
+        return stats
\ No newline at end of file
@@ -1,16 +1,31 @@
 """
 数据插入脚本，将docs目录下的所有文档加载并存储到向量数据库中
+根据入库清单增量处理：只加载新增或变更的文件，删除已移除文件的向量
+新增或变更的文件通过流式流水线按批写入，中断后重新运行可从检查点继续
 """
 
 import os
+import argparse
+
+from config import Config
 from app.data.loader import DocumentLoader
+from app.data.manifest import IngestManifest
+from app.data.pipeline import IngestPipeline
 from app.rag.retriever import VectorRetriever
 
 
 def main():
-    """主函数，直接处理docs目录下的所有文件"""
+    """主函数，增量处理docs目录下的所有文件"""
+    parser = argparse.ArgumentParser(description="将docs目录下的文档写入向量数据库")
+    parser.add_argument("--rebuild", action="store_true", help="清空向量数据库后全量重建")
+    parser.add_argument("--docs-dir", type=str, help="文档目录，默认为项目下的docs目录")
+    parser.add_argument("--workers", type=int, help="并行加载的进程数，默认使用 LOADER_WORKERS 配置")
+    parser.add_argument("--batch-size", type=int, help="每批写入的文本块数，默认使用 INGEST_BATCH_SIZE 配置")
+    parser.add_argument("--tag", action="append", default=[], help="为本次新增或变更的文件添加标签，检索时可用 --tag 过滤，可重复指定")
+    args = parser.parse_args()
+    
     # 设置docs目录路径
-    docs_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "docs")
+    docs_dir = args.docs_dir or os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "docs")
     
     print(f"正在处理目录: {docs_dir}")
     
@@ -19,27 +34,50 @@ def main():
         print(f"错误: docs目录不存在: {docs_dir}")
         return
     
-    # 初始化加载器和检索器
+    # 初始化加载器、检索器和入库清单
     loader = DocumentLoader()
     retriever = VectorRetriever()
+    manifest = IngestManifest(Config.INGEST_MANIFEST_PATH)
     
-    # 加载目录中的所有文档
-    documents = loader.load_directory(docs_dir)
+    if args.rebuild:
+        retriever.clear_collection()
+        manifest.clear()
+    elif manifest.files and retriever.get_collection_info()["count"] == 0:
+        # 集合被清空但清单仍在，清单已失效
+        print("向量数据库为空，忽略已有入库清单")
+        manifest.clear()
     
-    if not documents:
+    file_paths = loader.list_files(docs_dir)
+    if not file_paths and not manifest.files:
         print("目录中没有找到支持的文件")
         return
     
-    print(f"共加载了 {len(documents)} 个文档块")
+    changes = manifest.diff(docs_dir, file_paths)
+    print(f"新增或变更 {len(changes['changed'])} 个文件, "
+          f"未变化 {len(changes['unchanged'])} 个文件, "
+          f"已删除 {len(changes['removed'])} 个文件")
+    
+    # 删除已移除文件的向量
+    for key in changes["removed"]:
+        retriever.delete_documents(manifest.chunk_ids(key))
+        retriever.delete_parents(key)
+        manifest.remove(key)
+        print(f"已删除文件 {key} 的向量")
+    manifest.save()
+    
+    # 流式加载、分割并按批写入新增或变更的文件，每批写入后保存检查点
+    pipeline = IngestPipeline(loader, retriever, manifest, docs_dir,
+                              batch_size=args.batch_size, workers=args.workers, tags=args.tag)
+    stats = pipeline.run(changes["changed"])
     
-    # 存储到向量数据库
-    result = retriever.add_documents(documents)
+    print(f"共处理 {stats['chunks']} 个文档块（{stats['parents']} 个父段落）, 写入 {stats['written']} 个, "
+          f"跳过未变化的 {stats['skipped']} 个, 共 {stats['batches']} 批")
     
-    if result["success"]:
-        print(f"成功存储所有文档到向量数据库")
+    if stats["failed_files"]:
+        print(f"存储文档失败: {len(stats['failed_files'])} 个文件，重新运行将从检查点继续")
     else:
-        print(f"存储文档失败")
+        print("成功同步所有文档到向量数据库")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,6 +1,9 @@
 # 文档加载器 支持PDF, TXT, DOCX, Markdown
 
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from langchain_community.document_loaders import (
     PyPDFLoader,
     TextLoader,
@@ -9,22 +12,52 @@ from langchain_community.document_loaders import (
 )
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from config import Config
+from app.data.splitters import StructuredSplitter
+
+# 工作进程内复用的加载器实例
+_worker_loader = None
+
+
+def _load_in_worker(file_path: str, with_parents: bool = False):
+    """进程池任务：在工作进程中加载并分割单个文件"""
+    global _worker_loader
+    if _worker_loader is None:
+        _worker_loader = DocumentLoader()
+    return _worker_loader.load_single_document(file_path, with_parents=with_parents)
+
 
 class DocumentLoader:
+    # 支持的文件扩展名
+    supported_extensions = ['.txt', '.md', '.pdf', '.docx', '.doc',]
+    
     def __init__(self):
-        """初始化文档加载器"""
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=Config.CHUNK_SIZE,
-            chunk_overlap=Config.CHUNK_OVERLAP
-        )
+        """初始化文档加载器，分割方式由 Config.CHUNK_STRATEGY 决定"""
+        self.strategy = Config.CHUNK_STRATEGY
+        if self.strategy == "structured":
+            # 按标题、页与段落切出父段落，再切成用于检索的子块，均按词元计长
+            self.text_splitter = StructuredSplitter(
+                parent_tokens=Config.PARENT_CHUNK_TOKENS,
+                child_tokens=Config.CHILD_CHUNK_TOKENS,
+                child_overlap=Config.CHILD_CHUNK_OVERLAP
+            )
+        elif self.strategy == "recursive":
+            self.text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=Config.CHUNK_SIZE,
+                chunk_overlap=Config.CHUNK_OVERLAP,
+                add_start_index=True  # 记录文本块在原文中的起始位置，检索后据此合并相邻块
+            )
+        else:
+            raise ValueError(f"不支持的分割方式: {self.strategy}，可选 structured、recursive")
     
-    def load_single_document(self, file_path: str):
+    def load_single_document(self, file_path: str, with_parents: bool = False):
         """
         加载单个文档
         
         file_path: 文档路径
+        with_parents: 是否同时返回父段落
             
-        returns: 文档块列表
+        returns: 文档块列表；with_parents 为 True 时返回 (文档块列表, 父段落列表)，
+                 按字符递归分割时父段落列表为空，加载失败时文档块列表为 None（与空文件区分）
         """
         try:
             # 根据文件扩展名选择合适的加载器
@@ -36,46 +69,111 @@ class DocumentLoader:
                 loader = TextLoader(file_path, encoding='utf-8')
             elif file_ext in ['.docx', '.doc']:
                 loader = Docx2txtLoader(file_path)
+            elif file_ext in ['.md', '.markdown'] and self.strategy == "structured":
+                # 读取原文，保留标题标记用于分节
+                loader = TextLoader(file_path, encoding='utf-8')
             elif file_ext in ['.md', '.markdown']:
                 loader = UnstructuredMarkdownLoader(file_path, encoding='utf-8')
             else:
                 print(f"不支持的文件格式: {file_ext}")
-                return []
+                return ([], []) if with_parents else []
             
             # 加载文档
             documents = loader.load()
             
             # 分割文档
-            chunks = self.text_splitter.split_documents(documents)
-            print(f"文件 {os.path.basename(file_path)} 已加载并分割为 {len(chunks)} 个文本块")
+            if self.strategy == "structured":
+                parents, chunks = self.text_splitter.split(documents, file_ext)
+            else:
+                parents, chunks = [], self.text_splitter.split_documents(documents)
             
-            return chunks
+            # 记录文件类型，检索时可按类型过滤
+            for chunk in parents + chunks:
+                chunk.metadata["file_type"] = file_ext.lstrip(".")
+            print(f"文件 {os.path.basename(file_path)} 已加载并分割为 {len(chunks)} 个文本块"
+                  + (f"（{len(parents)} 个父段落）" if parents else ""))
+            
+            return (chunks, parents) if with_parents else chunks
             
         except Exception as e:
             print(f"加载文档失败 {file_path}: {str(e)}")
-            return []
+            return (None, []) if with_parents else []
     
-    def load_directory(self, directory_path: str):
+    def list_files(self, directory_path: str):
         """
-        加载目录中的所有文档
+        列出目录中所有支持的文件
         
         directory_path: 目录路径
             
-        returns: 所有文档的文本块列表
+        returns: 排序后的文件路径列表
         """
-        all_chunks = []
-        
-        # 支持的文件扩展名
-        supported_extensions = ['.txt', '.md', '.pdf', '.docx', '.doc',]
+        file_paths = []
         
         # 遍历目录中的文件
         for root, dirs, files in os.walk(directory_path):
             for file in files:
-                file_path = os.path.join(root, file)
                 file_ext = os.path.splitext(file)[1].lower()
                 
-                if file_ext in supported_extensions:
-                    chunks = self.load_single_document(file_path)
-                    all_chunks.extend(chunks)
+                if file_ext in self.supported_extensions:
+                    file_paths.append(os.path.join(root, file))
+        
+        return sorted(file_paths)
+    
+    def iter_files(self, file_paths, workers: int = None, with_parents: bool = False):
+        """
+        按输入顺序逐个返回文件的加载结果，workers 大于1时使用进程池并行加载和分割
+        
+        file_paths: 文件路径列表
+        workers: 工作进程数，默认使用 Config.LOADER_WORKERS，0 表示使用全部CPU核心
+        with_parents: 是否同时返回父段落
+            
+        returns: (文件路径, 文本块列表) 的迭代器，with_parents 为 True 时为 (文件路径, 文本块列表, 父段落列表)，
+                 其中加载失败的文件文本块列表为 None
+        """
+        workers = Config.LOADER_WORKERS if workers is None else workers
+        if workers == 0:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(file_paths))
+        
+        if workers <= 1:
+            for file_path in file_paths:
+                result = self.load_single_document(file_path, with_parents=with_parents)
+                yield (file_path, *result) if with_parents else (file_path, result)
+            return
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # 同时在途的文件数有上限，避免结果在内存中堆积
+            pending = deque()
+            paths = iter(file_paths)
+            for file_path in islice(paths, workers * 2):
+                pending.append((file_path, executor.submit(_load_in_worker, file_path, with_parents)))
+            
+            # 按提交顺序取结果，保证输出顺序确定；单个文件失败不影响其他文件
+            while pending:
+                file_path, future = pending.popleft()
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"加载文档失败 {file_path}: {str(e)}")
+                    result = (None, []) if with_parents else []
+                
+                for next_path in islice(paths, 1):
+                    pending.append((next_path, executor.submit(_load_in_worker, next_path, with_parents)))
+                
+                yield (file_path, *result) if with_parents else (file_path, result)
+    
+    def load_directory(self, directory_path: str, workers: int = None):
+        """
+        加载目录中的所有文档
+        
+        directory_path: 目录路径
+        workers: 工作进程数，默认使用 Config.LOADER_WORKERS
+            
+        returns: 所有文档的文本块列表
+        """
+        all_chunks = []
+        
+        for file_path, chunks in self.iter_files(self.list_files(directory_path), workers=workers):
+            all_chunks.extend(chunks)
         
         return all_chunks
\ No newline at end of file
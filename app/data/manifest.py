@@ -0,0 +1,163 @@
+# 增量入库清单
+# 记录每个已入库文件的路径、修改时间、大小、内容哈希及其文本块ID，用于判断新增、变更和删除的文件
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Any
+
+
+def file_hash(file_path: str) -> str:
+    """计算文件内容的 sha256"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(source_key: str, occurrence: int, content: str) -> str:
+    """
+    计算确定性的文本块ID，同一文件同一内容重复入库时ID不变
+
+    source_key: 文件相对路径
+    occurrence: 相同内容在文件中第几次出现（从0开始），使重复的文本块ID不同
+    content: 文本块内容
+
+    returns: 文本块ID
+    """
+    return hashlib.sha256(f"{source_key}\0{occurrence}\0{content}".encode("utf-8")).hexdigest()[:32]
+
+
+def chunk_ids(source_key: str, contents: List[str]) -> List[str]:
+    """
+    计算一个文件全部文本块的ID。ID只取决于内容及其出现次数，与位置无关，
+    文件中插入或删除段落时其余文本块的ID不变
+
+    source_key: 文件相对路径
+    contents: 按顺序排列的文本块内容
+
+    returns: 文本块ID列表，与 contents 一一对应
+    """
+    seen: Dict[str, int] = {}
+    ids = []
+    for content in contents:
+        occurrence = seen.get(content, 0)
+        seen[content] = occurrence + 1
+        ids.append(chunk_id(source_key, occurrence, content))
+    return ids
+
+
+class IngestManifest:
+    def __init__(self, manifest_path: str):
+        """
+        manifest_path: 清单文件路径（JSON）
+        """
+        self.manifest_path = manifest_path
+        self.files: Dict[str, Dict[str, Any]] = {}
+
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    self.files = json.load(f).get("files", {})
+            except (OSError, ValueError) as e:
+                print(f"读取入库清单失败，将重新全量入库: {str(e)}")
+                self.files = {}
+
+    def diff(self, root: str, file_paths: List[str]) -> Dict[str, List[str]]:
+        """
+        对比当前文件与清单
+
+        root: 文档根目录，清单中的路径相对于该目录
+        file_paths: 当前存在的文件路径列表
+
+        returns: {"changed": [...], "unchanged": [...], "removed": [...]}，
+                 changed 与 unchanged 为文件路径，removed 为清单中的相对路径
+        """
+        changed, unchanged = [], []
+        seen = set()
+
+        for file_path in file_paths:
+            key = self.key(root, file_path)
+            seen.add(key)
+            entry = self.files.get(key)
+
+            if entry is None or entry.get("partial"):
+                # 新文件，或上次入库中途中断
+                changed.append(file_path)
+                continue
+
+            stat = os.stat(file_path)
+            # 修改时间与大小均未变化时跳过哈希计算
+            if entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                unchanged.append(file_path)
+            elif entry["sha256"] == file_hash(file_path):
+                # 仅修改时间变化，内容相同
+                entry["mtime"] = stat.st_mtime
+                entry["size"] = stat.st_size
+                unchanged.append(file_path)
+            else:
+                changed.append(file_path)
+
+        removed = [key for key in self.files if key not in seen]
+
+        return {
+            "changed": changed,
+            "unchanged": unchanged,
+            "removed": removed
+        }
+
+    @staticmethod
+    def key(root: str, file_path: str) -> str:
+        """文件在清单中的键：相对于根目录的 posix 路径"""
+        return os.path.relpath(file_path, root).replace(os.sep, "/")
+
+    def chunk_ids(self, key: str) -> List[str]:
+        """获取文件已写入向量数据库的文本块ID（包括中断时已写入的部分）"""
+        entry = self.files.get(key)
+        return list(entry["chunk_ids"]) if entry else []
+
+    def update(self, root: str, file_path: str, chunk_ids: List[str]):
+        """记录文件入库结果"""
+        stat = os.stat(file_path)
+        self.files[self.key(root, file_path)] = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "sha256": file_hash(file_path),
+            "chunk_ids": chunk_ids
+        }
+
+    def mark_partial(self, root: str, file_path: str, chunk_ids: List[str]):
+        """
+        记录文件入库进度（检查点），下次运行时该文件仍视为变更，已写入的文本块不再重复写入
+
+        root: 文档根目录
+        file_path: 文件路径
+        chunk_ids: 当前已写入向量数据库的全部文本块ID
+        """
+        stat = os.stat(file_path)
+        self.files[self.key(root, file_path)] = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "sha256": "",
+            "chunk_ids": chunk_ids,
+            "partial": True
+        }
+
+    def remove(self, key: str):
+        """从清单中移除文件"""
+        self.files.pop(key, None)
+
+    def clear(self):
+        """清空清单"""
+        self.files = {}
+
+    def save(self):
+        """原子写入清单文件"""
+        directory = os.path.dirname(self.manifest_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "files": self.files}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.manifest_path)
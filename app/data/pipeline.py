@@ -0,0 +1,191 @@
+# 流式入库流水线
+# 文件发现 -> 加载与分割（后台线程，可多进程） -> 有界队列 -> 按批嵌入并写入向量数据库 -> 每批写入后保存检查点
+# 写入前为文本块补充用于检索过滤的元数据：source（相对于文档根目录的路径）、ingested_at（入库时间）与 tags（标签）
+# 结构感知分割产生的父段落先写入父段落存储，子块的 parent_id 指向所属父段落
+
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from config import Config
+from app.data.loader import DocumentLoader
+from app.data.manifest import IngestManifest, chunk_ids
+from app.rag.retriever import VectorRetriever
+
+# 加载线程结束标记
+_DONE = object()
+
+
+class IngestPipeline:
+    def __init__(self, loader: DocumentLoader, retriever: VectorRetriever, manifest: IngestManifest,
+                 root: str, batch_size: int = None, queue_size: int = None, workers: int = None,
+                 tags: Optional[List[str]] = None):
+        """
+        loader: 文档加载器
+        retriever: 向量检索器
+        manifest: 入库清单，同时作为检查点
+        root: 文档根目录
+        batch_size: 每批嵌入并写入的文本块数，默认使用 Config.INGEST_BATCH_SIZE
+        queue_size: 加载与写入之间队列可缓存的文件数，默认使用 Config.INGEST_QUEUE_SIZE
+        workers: 加载进程数，默认使用 Config.LOADER_WORKERS
+        tags: 为本次写入的文本块添加的标签
+        """
+        self.loader = loader
+        self.retriever = retriever
+        self.manifest = manifest
+        self.root = root
+        self.batch_size = batch_size or Config.INGEST_BATCH_SIZE
+        self.queue_size = queue_size or Config.INGEST_QUEUE_SIZE
+        self.workers = workers
+        self.tags = list(dict.fromkeys(tags or []))
+
+        # 写入批次缓冲：(文件路径, 文本块, 文本块ID)
+        self._buffer = []
+        # 正在写入的文件：文件路径 -> {"key", "ids", "parent_ids", "in_db", "remaining"}
+        self._files: Dict[str, Dict[str, Any]] = {}
+
+        self.stats = {
+            "files": 0,
+            "chunks": 0,
+            "parents": 0,
+            "written": 0,
+            "skipped": 0,
+            "batches": 0,
+            "failed_files": []
+        }
+
+    def _produce(self, file_paths: List[str], out: queue.Queue):
+        """加载线程：逐个加载文件放入有界队列，队列满时阻塞"""
+        try:
+            for item in self.loader.iter_files(file_paths, workers=self.workers, with_parents=True):
+                out.put(item)
+        except Exception as e:
+            print(f"加载线程异常: {str(e)}")
+        finally:
+            out.put(_DONE)
+
+    def run(self, file_paths: List[str]) -> Dict[str, Any]:
+        """
+        执行流水线
+
+        file_paths: 需要入库的文件路径列表（新增或变更的文件）
+
+        returns: 统计信息
+        """
+        items = queue.Queue(maxsize=self.queue_size)
+        producer = threading.Thread(target=self._produce, args=(file_paths, items), daemon=True)
+        producer.start()
+
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            self._accept(*item)
+
+        self._flush()
+        producer.join()
+        return self.stats
+
+    def _accept(self, file_path: str, chunks, parents=()):
+        """接收一个文件的文本块与父段落，已写入过的文本块直接跳过"""
+        if chunks is None:
+            # 加载失败（可能只是暂时的），不删除该文件已入库的内容，清单保持原样，下次运行时重试
+            self.stats["files"] += 1
+            self.stats["failed_files"].append(file_path)
+            return
+
+        key = IngestManifest.key(self.root, file_path)
+        parent_ids = chunk_ids(f"{key}#parent", [parent.page_content for parent in parents])
+
+        ingested_at = int(time.time())
+        for chunk in list(parents) + chunks:
+            chunk.metadata["source"] = key
+            chunk.metadata["ingested_at"] = ingested_at
+            if self.tags:
+                chunk.metadata["tags"] = self.tags
+        for chunk in chunks:
+            if "parent_index" in chunk.metadata:
+                chunk.metadata["parent_id"] = parent_ids[chunk.metadata.pop("parent_index")]
+
+        # 父段落变化时子块需要重新写入以更新 parent_id，因此 parent_id 参与文本块ID的计算；
+        # 标签同理，变更的文件以不同标签入库时，内容未变的文本块也要重写，整个文件的标签保持一致
+        tag_key = "".join(f"\0{tag}" for tag in sorted(self.tags))
+        ids = chunk_ids(key, [chunk.page_content + chunk.metadata.get("parent_id", "") + tag_key
+                              for chunk in chunks])
+        in_db = set(self.manifest.chunk_ids(key))
+
+        # 内容未变的文本块（或中断前已写入）无需重新嵌入
+        pending = [(chunk, cid) for chunk, cid in zip(chunks, ids) if cid not in in_db]
+
+        state = {"key": key, "ids": ids, "parent_ids": parent_ids, "in_db": in_db, "remaining": len(pending)}
+        self._files[file_path] = state
+        self.stats["files"] += 1
+        self.stats["chunks"] += len(chunks)
+        self.stats["parents"] += len(parent_ids)
+        self.stats["skipped"] += len(chunks) - len(pending)
+
+        # 父段落不需要嵌入，在子块之前写入，保证检索到的子块总能找到父段落
+        if parent_ids and not self.retriever.add_parents(list(parents), parent_ids)["success"]:
+            self.stats["failed_files"].append(file_path)
+
+        for chunk, cid in pending:
+            self._buffer.append((file_path, chunk, cid))
+            if len(self._buffer) >= self.batch_size:
+                self._flush()
+
+        if not pending:
+            self._finalize(file_path)
+            self.manifest.save()
+
+    def _flush(self):
+        """嵌入并写入当前批次，然后保存检查点"""
+        if not self._buffer:
+            return
+
+        batch, self._buffer = self._buffer, []
+        result = self.retriever.add_documents(
+            [chunk for _, chunk, _ in batch],
+            ids=[cid for _, _, cid in batch]
+        )
+        self.stats["batches"] += 1
+
+        touched = []
+        for file_path, _, cid in batch:
+            state = self._files[file_path]
+            if result["success"]:
+                state["in_db"].add(cid)
+                self.stats["written"] += 1
+            elif file_path not in self.stats["failed_files"]:
+                self.stats["failed_files"].append(file_path)
+            state["remaining"] -= 1
+            if file_path not in touched:
+                touched.append(file_path)
+
+        for file_path in touched:
+            state = self._files[file_path]
+            if state["remaining"] == 0:
+                self._finalize(file_path)
+            else:
+                self.manifest.mark_partial(self.root, file_path, sorted(state["in_db"]))
+        self.manifest.save()
+
+    def _finalize(self, file_path: str):
+        """文件全部写入后删除旧版本残留的文本块并记录到清单"""
+        state = self._files.pop(file_path)
+
+        if file_path in self.stats["failed_files"]:
+            # 保留已写入部分的检查点，下次运行时重试
+            if state["in_db"]:
+                self.manifest.mark_partial(self.root, file_path, sorted(state["in_db"]))
+            return
+
+        stale_ids = sorted(state["in_db"] - set(state["ids"]))
+        self.retriever.delete_documents(stale_ids)
+        self.retriever.delete_parents(state["key"], keep=state["parent_ids"])
+
+        if state["ids"]:
+            self.manifest.update(self.root, file_path, state["ids"])
+        else:
+            # 空文件，不记录，下次重新尝试
+            self.manifest.remove(state["key"])
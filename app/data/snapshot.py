@@ -0,0 +1,465 @@
+# 向量库快照
+# 把集合（向量、文本、元数据）、父段落与入库清单导出为单个带校验的二进制文件，
+# 在新节点上导入时直接写入向量库，不重新加载分割文档，也不调用嵌入模型
+#
+# 文件格式（小端）：
+#     头部   魔数 RAGSNAP\0、格式版本（uint32）、保留（uint32）
+#     区段   各区段按 64 字节对齐依次存放：
+#            embeddings           (行数, 维度) 的 float32 或 int8 向量，连续存放
+#            scales               int8 时每行的缩放系数（float32）
+#            <列>.offsets/.data   ids、documents、metadatas 与父段落各列：uint64 偏移（行数+1 个）与拼接的 UTF-8 数据
+#            sparse_index         BM25 关键词索引（SQLite 文件），导入时分词方式相同则整体载入，否则按文本重建
+#            manifest             入库清单（JSON）
+#     目录   JSON：嵌入模型、行数、维度、编码与各区段的偏移、长度与 sha256
+#     尾部   目录长度（uint64）、目录的 sha256、魔数
+#
+# 用法:
+#     python -m app.data.snapshot export data/vector_db.snap [--dtype int8] [--no-sparse-index]
+#     python -m app.data.snapshot import data/vector_db.snap [--replace]
+#     python -m app.data.snapshot verify data/vector_db.snap
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from config import Config
+from app.rag.retriever import VectorRetriever
+from app.rag.sparse_index import TOKENIZER
+
+MAGIC = b"RAGSNAP\x00"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sII")
+_TRAILER = struct.Struct("<Q32s8s")
+_ALIGN = 64
+_COPY_CHUNK = 16 * 1024 * 1024
+# 导出时每次从向量库读取的行数（Chroma 单次读取的条数有上限）
+_PAGE_SIZE = 5000
+
+
+def _quantize(vectors: np.ndarray):
+    """按行对称量化为 int8，返回 (编码, 每行缩放系数)"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class _SnapshotWriter:
+    """区段先分别写入临时文件，完成后按顺序拷入快照并计算校验和，最后原子替换目标文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._tmp_path = path + ".tmp"
+        self._spool_dir = tempfile.mkdtemp(prefix="snapshot_", dir=directory)
+        self._spools: Dict[str, Any] = {}
+        self._offsets: Dict[str, List[int]] = {}
+
+    def write(self, name: str, data: bytes):
+        """向区段追加数据"""
+        spool = self._spools.get(name)
+        if spool is None:
+            spool = self._spools[name] = open(os.path.join(self._spool_dir, name), "w+b")
+        spool.write(data)
+
+    def write_file(self, name: str, path: str):
+        """以整个文件作为区段（文件需位于临时目录中，随之删除）"""
+        self._spools[name] = open(path, "rb")
+
+    def spool_path(self, name: str) -> str:
+        """临时目录中的文件路径"""
+        return os.path.join(self._spool_dir, name)
+
+    def write_strings(self, name: str, values: List[str]):
+        """向字符串列追加若干行"""
+        offsets = self._offsets.setdefault(name, [0])
+        chunks = []
+        for value in values:
+            data = value.encode("utf-8")
+            chunks.append(data)
+            offsets.append(offsets[-1] + len(data))
+        self.write(f"{name}.data", b"".join(chunks))
+
+    def finish(self, footer: Dict[str, Any]):
+        """写出全部区段、目录与尾部"""
+        for name, offsets in self._offsets.items():
+            self.write(f"{name}.offsets", np.asarray(offsets, dtype="<u8").tobytes())
+
+        sections = {}
+        with open(self._tmp_path, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0))
+            for name, spool in self._spools.items():
+                f.write(b"\0" * (-f.tell() % _ALIGN))
+                offset = f.tell()
+                digest = hashlib.sha256()
+                spool.seek(0)
+                while True:
+                    chunk = spool.read(_COPY_CHUNK)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+                sections[name] = {"offset": offset, "length": f.tell() - offset, "sha256": digest.hexdigest()}
+
+            footer = dict(footer, sections=sections)
+            data = json.dumps(footer, ensure_ascii=False).encode("utf-8")
+            f.write(data)
+            f.write(_TRAILER.pack(len(data), hashlib.sha256(data).digest(), MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self._tmp_path, self.path)
+        self.close()
+
+    def close(self):
+        """删除临时文件（写入失败时也会调用）"""
+        for spool in self._spools.values():
+            spool.close()
+        self._spools = {}
+        shutil.rmtree(self._spool_dir, ignore_errors=True)
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class SnapshotReader:
+    def __init__(self, path: str):
+        """
+        以内存映射打开快照，读取并校验目录；区段数据在 verify 时校验，读取时才从磁盘载入
+
+        path: 快照文件路径
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"快照文件为空: {path}")
+
+        try:
+            size = len(self._mmap)
+            if size < _HEADER.size + _TRAILER.size:
+                raise ValueError("文件过短")
+            magic, version, _ = _HEADER.unpack_from(self._mmap, 0)
+            length, digest, tail = _TRAILER.unpack_from(self._mmap, size - _TRAILER.size)
+            if magic != MAGIC or tail != MAGIC:
+                raise ValueError("不是快照文件或文件不完整")
+            if version != FORMAT_VERSION:
+                raise ValueError(f"不支持的快照格式版本 {version}")
+            start = size - _TRAILER.size - length
+            if start < _HEADER.size:
+                raise ValueError("目录长度无效")
+            data = self._mmap[start:size - _TRAILER.size]
+            if hashlib.sha256(data).digest() != digest:
+                raise ValueError("目录校验失败")
+            self.footer: Dict[str, Any] = json.loads(data)
+            for name, section in self.footer["sections"].items():
+                if section["offset"] < _HEADER.size or section["offset"] + section["length"] > start:
+                    raise ValueError(f"区段 {name} 超出文件范围")
+        except ValueError as e:
+            self.close()
+            raise ValueError(f"快照无效: {str(e)}")
+
+        self.count = self.footer["count"]
+        self.dim = self.footer["dim"]
+        self._offsets: Dict[str, np.ndarray] = {}
+
+    def verify(self):
+        """校验全部区段的 sha256，不一致时抛出 ValueError"""
+        for name, section in self.footer["sections"].items():
+            digest = hashlib.sha256()
+            end = section["offset"] + section["length"]
+            for start in range(section["offset"], end, _COPY_CHUNK):
+                digest.update(self._mmap[start:min(start + _COPY_CHUNK, end)])
+            if digest.hexdigest() != section["sha256"]:
+                raise ValueError(f"快照区段 {name} 校验失败，文件已损坏")
+
+    def _array(self, name: str, dtype: str, start: int, count: int, width: int = 1) -> np.ndarray:
+        """区段中从第 start 行起的 count 行（复制出来，关闭文件后仍可使用）"""
+        itemsize = np.dtype(dtype).itemsize * width
+        return np.frombuffer(self._mmap, dtype=dtype, count=count * width,
+                             offset=self.footer["sections"][name]["offset"] + start * itemsize).copy()
+
+    def vectors(self, start: int, end: int) -> np.ndarray:
+        """第 start 到 end 行的向量，int8 快照按缩放系数还原为 float32"""
+        if self.footer["dtype"] == "int8":
+            codes = self._array("embeddings", "i1", start, end - start, self.dim).reshape(-1, self.dim)
+            scales = self._array("scales", "<f4", start, end - start)
+            return codes.astype(np.float32) * scales[:, None]
+        return self._array("embeddings", "<f4", start, end - start, self.dim).reshape(-1, self.dim)
+
+    def strings(self, name: str, start: int, end: int) -> List[str]:
+        """字符串列第 start 到 end 行"""
+        offsets = self._offsets.get(name)
+        if offsets is None:
+            rows = self.footer["sections"][f"{name}.offsets"]["length"] // 8
+            offsets = self._offsets[name] = self._array(f"{name}.offsets", "<u8", 0, rows)
+        base = self.footer["sections"][f"{name}.data"]["offset"]
+        return [self._mmap[base + int(offsets[i]):base + int(offsets[i + 1])].decode("utf-8")
+                for i in range(start, end)]
+
+    def copy_section(self, name: str, path: str):
+        """把区段原样写入文件"""
+        section = self.footer["sections"][name]
+        with open(path, "wb") as f:
+            end = section["offset"] + section["length"]
+            for start in range(section["offset"], end, _COPY_CHUNK):
+                f.write(self._mmap[start:min(start + _COPY_CHUNK, end)])
+
+    def manifest(self) -> Optional[bytes]:
+        """快照中的入库清单（JSON），导出时没有清单则为 None"""
+        section = self.footer["sections"].get("manifest")
+        if section is None:
+            return None
+        return self._mmap[section["offset"]:section["offset"] + section["length"]]
+
+    def close(self):
+        self._offsets = {}
+        self._mmap.close()
+        self._file.close()
+
+
+def export_snapshot(retriever: VectorRetriever, path: str, dtype: str = "float32", sparse_index: bool = True,
+                    page_size: int = _PAGE_SIZE) -> Dict[str, Any]:
+    """
+    导出向量库快照
+
+    retriever: 向量检索器
+    path: 快照文件路径，写入完成后原子替换
+    dtype: 向量编码，float32（无损）或 int8（约 1/4 大小，按行量化）
+    sparse_index: 是否附带 BM25 关键词索引；不附带时文件更小，导入时按文本重建
+    page_size: 每次从向量库读取的行数
+
+    returns: 导出结果
+    """
+    if dtype not in ("float32", "int8"):
+        raise ValueError(f"不支持的向量编码: {dtype}")
+    if hasattr(retriever.db, "get_stats"):
+        stats = retriever.db.get_stats()
+        if stats["dim"] != stats["source_dim"] and not stats["full_vectors"]:
+            raise ValueError("本地向量库只保存了截断后的向量，无法导出完整向量，请重新入库")
+
+    start = time.perf_counter()
+    # 分页读取期间向量库有写入时，各页与入库清单可能不一致，导出前后比对版本标记
+    version = retriever.collection_version()
+    if retriever._is_chroma():
+        page_size = min(page_size, retriever.db._client.get_max_batch_size())
+    total = retriever.get_collection_info()["count"]
+    writer = _SnapshotWriter(path)
+    try:
+        count, dim = 0, None
+        for offset in range(0, total, page_size):
+            page = retriever.db.get(limit=page_size, offset=offset,
+                                    include=["documents", "metadatas", "embeddings"])
+            if not page["ids"]:
+                break
+            vectors = np.asarray(page["embeddings"], dtype=np.float32)
+            dim = dim or vectors.shape[1]
+            if dtype == "int8":
+                codes, scales = _quantize(vectors)
+                writer.write("embeddings", codes.tobytes())
+                writer.write("scales", scales.astype("<f4").tobytes())
+            else:
+                writer.write("embeddings", vectors.astype("<f4").tobytes())
+            writer.write_strings("ids", page["ids"])
+            writer.write_strings("documents", page["documents"])
+            writer.write_strings("metadatas", [json.dumps(metadata or {}, ensure_ascii=False)
+                                               for metadata in page["metadatas"]])
+            count += len(page["ids"])
+
+        parents = 0
+        batch = []
+        for parent_id, doc in retriever.docstore.scan(page_size):
+            batch.append((parent_id, doc))
+            if len(batch) >= page_size:
+                _write_parents(writer, batch)
+                parents += len(batch)
+                batch = []
+        if batch:
+            _write_parents(writer, batch)
+            parents += len(batch)
+
+        # 关键词索引与向量库行数一致时整体附带，导入时省去分词与建立倒排
+        sparse = sparse_index and retriever.sparse_index is not None and retriever.sparse_index.count() == count
+        if sparse:
+            retriever.sparse_index.dump(writer.spool_path("sparse_index"))
+            writer.write_file("sparse_index", writer.spool_path("sparse_index"))
+
+        if os.path.exists(Config.INGEST_MANIFEST_PATH):
+            with open(Config.INGEST_MANIFEST_PATH, "rb") as f:
+                writer.write("manifest", f.read())
+
+        if retriever.collection_version() != version:
+            raise RuntimeError("导出期间向量库有写入，快照可能不一致，请在入库完成后重新导出")
+
+        writer.finish({
+            "format": FORMAT_VERSION,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "embedding_model": Config.EMBEDDING_MODEL_NAME,
+            "vector_db_type": Config.VECTOR_DB_TYPE,
+            "chunk_strategy": Config.CHUNK_STRATEGY,
+            "count": count,
+            "dim": dim or 0,
+            "dtype": dtype,
+            "parents": parents,
+            "tokenizer": TOKENIZER if sparse else None
+        })
+    except BaseException:
+        writer.close()
+        raise
+
+    return {
+        "success": True,
+        "count": count,
+        "parents": parents,
+        "bytes": os.path.getsize(path),
+        "seconds": time.perf_counter() - start
+    }
+
+
+def _write_parents(writer: _SnapshotWriter, batch: List[Any]):
+    writer.write_strings("parent_ids", [parent_id for parent_id, _ in batch])
+    writer.write_strings("parent_documents", [doc.page_content for _, doc in batch])
+    writer.write_strings("parent_metadatas", [json.dumps(doc.metadata, ensure_ascii=False) for _, doc in batch])
+
+
+def verify_snapshot(path: str) -> Dict[str, Any]:
+    """
+    校验快照文件
+
+    path: 快照文件路径
+
+    returns: 快照目录信息，校验失败时抛出 ValueError
+    """
+    reader = SnapshotReader(path)
+    try:
+        reader.verify()
+        return {key: value for key, value in reader.footer.items() if key != "sections"}
+    finally:
+        reader.close()
+
+
+def import_snapshot(retriever: VectorRetriever, path: str, replace: bool = False, force: bool = False,
+                    batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    导入向量库快照：先校验整个文件，再按批直接写入向量库，不调用嵌入模型；
+    BM25 关键词索引在分词方式相同时整体载入，否则随写入从文本重建；入库清单随快照恢复，之后可照常增量入库
+
+    retriever: 向量检索器
+    path: 快照文件路径
+    replace: 向量库不为空时先清空；否则拒绝导入
+    force: 快照的嵌入模型与当前配置不同时仍然导入
+    batch_size: 每批写入的行数，默认使用 INGEST_BATCH_SIZE 配置的 16 倍
+
+    returns: 导入结果
+    """
+    start = time.perf_counter()
+    batch_size = batch_size or Config.INGEST_BATCH_SIZE * 16
+    reader = SnapshotReader(path)
+    try:
+        # 写入前校验全部区段，损坏的快照不会留下写了一半的向量库
+        reader.verify()
+        footer = reader.footer
+        if footer["embedding_model"] != Config.EMBEDDING_MODEL_NAME and not force:
+            raise ValueError(f"快照的嵌入模型 {footer['embedding_model']} 与当前配置 "
+                             f"{Config.EMBEDDING_MODEL_NAME} 不同，检索结果将不可用；确需导入请使用 --force")
+        if retriever.get_collection_info()["count"] or retriever.docstore.count():
+            if not replace:
+                raise ValueError("向量数据库不为空，请使用 --replace 清空后导入")
+            retriever.clear_collection()
+
+        load_sparse = (retriever.sparse_index is not None and "sparse_index" in footer["sections"]
+                       and footer.get("tokenizer") == TOKENIZER)
+        for begin in range(0, reader.count, batch_size):
+            end = min(begin + batch_size, reader.count)
+            documents = [Document(page_content=text, metadata=json.loads(metadata))
+                         for text, metadata in zip(reader.strings("documents", begin, end),
+                                                   reader.strings("metadatas", begin, end))]
+            result = retriever.add_embeddings(documents, reader.vectors(begin, end), reader.strings("ids", begin, end),
+                                              index_sparse=not load_sparse)
+            if not result["success"]:
+                raise RuntimeError(f"写入第 {begin}-{end} 行失败: {result['error']}")
+            print(f"已导入 {end}/{reader.count} 个文本块")
+
+        if load_sparse:
+            tmp_path = retriever.sparse_index.index_path + ".snapshot"
+            try:
+                reader.copy_section("sparse_index", tmp_path)
+                retriever.sparse_index.load(tmp_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        for begin in range(0, footer["parents"], batch_size):
+            end = min(begin + batch_size, footer["parents"])
+            documents = [Document(page_content=text, metadata=json.loads(metadata))
+                         for text, metadata in zip(reader.strings("parent_documents", begin, end),
+                                                   reader.strings("parent_metadatas", begin, end))]
+            result = retriever.add_parents(documents, reader.strings("parent_ids", begin, end))
+            if not result["success"]:
+                raise RuntimeError(f"写入父段落失败: {result['error']}")
+
+        manifest = reader.manifest()
+        if manifest is not None:
+            directory = os.path.dirname(Config.INGEST_MANIFEST_PATH)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = Config.INGEST_MANIFEST_PATH + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(manifest)
+            os.replace(tmp_path, Config.INGEST_MANIFEST_PATH)
+
+        return {
+            "success": True,
+            "count": reader.count,
+            "parents": footer["parents"],
+            "seconds": time.perf_counter() - start
+        }
+    finally:
+        reader.close()
+
+
+def main():
+    """主函数，导出、导入或校验快照"""
+    parser = argparse.ArgumentParser(description="导出或导入向量数据库快照")
+    parser.add_argument("command", choices=["export", "import", "verify"], help="操作")
+    parser.add_argument("path", type=str, help="快照文件路径")
+    parser.add_argument("--dtype", type=str, default="float32", choices=["float32", "int8"],
+                        help="导出的向量编码，int8 约为 float32 的 1/4 大小（有损）")
+    parser.add_argument("--no-sparse-index", action="store_true", help="导出时不附带关键词索引，文件更小，导入时按文本重建")
+    parser.add_argument("--replace", action="store_true", help="导入前清空已有的向量数据库")
+    parser.add_argument("--force", action="store_true", help="嵌入模型与当前配置不同时仍然导入")
+    parser.add_argument("--batch-size", type=int, help="导入时每批写入的行数")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "verify":
+            info = verify_snapshot(args.path)
+            print(f"快照完整: {info['count']} 个文本块（{info['dim']} 维 {info['dtype']}）, {info['parents']} 个父段落, "
+                  f"嵌入模型 {info['embedding_model']}, 导出于 {info['created_at']}")
+        elif args.command == "export":
+            stats = export_snapshot(VectorRetriever(), args.path, dtype=args.dtype,
+                                    sparse_index=not args.no_sparse_index)
+            print(f"已导出 {stats['count']} 个文本块、{stats['parents']} 个父段落到 {args.path} "
+                  f"({stats['bytes'] / 1024 / 1024:.1f} MB), 耗时 {stats['seconds']:.1f}s")
+        else:
+            stats = import_snapshot(VectorRetriever(), args.path, replace=args.replace, force=args.force,
+                                    batch_size=args.batch_size)
+            print(f"已导入 {stats['count']} 个文本块、{stats['parents']} 个父段落, 耗时 {stats['seconds']:.1f}s")
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"错误: {str(e)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# 结构感知的文档分割
+# 先按格式切出父段落：Markdown 按标题分节，PDF 按页，其余文本整篇；超过词元上限的父段落再依次按段落、行、句子切开，
+# 然后把每个父段落切成更小的子块。子块写入向量库用于检索，命中后以其所在的父段落作为上下文（见 app/rag/docstore.py）
+# 块大小按词元计算（app/rag/tokens.py），中英文混排时同样的上限对应相近的提示词开销
+
+import re
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.rag.tokens import count_tokens
+
+# 切分位置的优先级：段落 -> 行 -> 中英文句末标点 -> 逗号 -> 空格 -> 任意字符
+_SEPARATORS = ["\n\n", "\n", "。", "！", "？", "；", ". ", "! ", "? ", "; ", "，", ", ", " ", ""]
+_HEADER = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+
+
+def markdown_sections(text: str, max_level: int = 3) -> List[Tuple[int, str, str]]:
+    """
+    按标题把 Markdown 切分为若干节，每节从标题行开始，代码块中的 # 不视为标题
+
+    text: Markdown 原文
+    max_level: 作为分节依据的最深标题级别
+
+    returns: (起始位置, 标题路径, 节文本) 列表，标题路径形如 "安装 > 环境配置"
+    """
+    sections = []
+    headers: List[Tuple[int, str]] = []
+    path, start, offset = "", 0, 0
+    in_fence = False
+
+    for line in text.splitlines(keepends=True):
+        if _FENCE.match(line):
+            in_fence = not in_fence
+        elif not in_fence:
+            match = _HEADER.match(line.rstrip("\r\n"))
+            if match and len(match.group(1)) <= max_level:
+                if text[start:offset].strip():
+                    sections.append((start, path, text[start:offset]))
+                level = len(match.group(1))
+                headers = [header for header in headers if header[0] < level] + [(level, match.group(2).strip())]
+                path = " > ".join(title for _, title in headers)
+                start = offset
+        offset += len(line)
+
+    if text[start:].strip():
+        sections.append((start, path, text[start:]))
+    return sections
+
+
+def _token_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=_SEPARATORS,
+        keep_separator="end",  # 句末标点留在句子末尾
+        length_function=count_tokens,
+        add_start_index=True
+    )
+
+
+class StructuredSplitter:
+    def __init__(self, parent_tokens: int, child_tokens: int, child_overlap: int = 0):
+        """
+        parent_tokens: 父段落的词元上限
+        child_tokens: 子块的词元上限
+        child_overlap: 相邻子块重叠的词元数
+        """
+        self.parent_splitter = _token_splitter(parent_tokens, 0)
+        self.child_splitter = _token_splitter(child_tokens, child_overlap)
+        # 短于此词元数的子块（如单独的标题行）并入下一个子块，避免产生大量只有几个词元的向量
+        self.min_child_tokens = child_tokens // 4
+
+    def _sections(self, documents: List[Document], file_ext: str) -> List[Tuple[int, str, Dict[str, Any]]]:
+        """按格式切出的原始段落：(起始位置, 文本, 元数据)"""
+        sections = []
+        for document in documents:
+            if file_ext in (".md", ".markdown"):
+                for start, path, text in markdown_sections(document.page_content):
+                    metadata = dict(document.metadata)
+                    if path:
+                        metadata["section"] = path
+                    sections.append((start, text, metadata))
+            else:
+                # PDF 的每页是一个文档，分割不跨页
+                sections.append((0, document.page_content, dict(document.metadata)))
+        return sections
+
+    def split(self, documents: List[Document], file_ext: str) -> Tuple[List[Document], List[Document]]:
+        """
+        分割文档
+
+        documents: 加载器返回的文档（PDF 每页一个）
+        file_ext: 文件扩展名（小写，含点）
+
+        returns: (父段落列表, 子块列表)；子块的 metadata["parent_index"] 为所属父段落的序号，
+                 父段落与子块的 start_index 均为在原文（PDF 为所在页）中的位置
+        """
+        parents = []
+        for start, text, metadata in self._sections(documents, file_ext):
+            for parent in self.parent_splitter.create_documents([text], [metadata]):
+                parent.metadata["start_index"] += start
+                parents.append(parent)
+
+        children = []
+        for index, parent in enumerate(parents):
+            for child in self._children(parent):
+                child.metadata["start_index"] += parent.metadata["start_index"]
+                child.metadata["parent_index"] = index
+                children.append(child)
+        return parents, children
+
+    def _children(self, parent: Document) -> List[Document]:
+        """切分父段落，过短的子块与下一个子块合并为父段落中连续的一段"""
+        children = self.child_splitter.create_documents([parent.page_content], [parent.metadata])
+        merged = []
+        for child in children:
+            previous = merged[-1] if merged else None
+            if previous is not None and count_tokens(previous.page_content) < self.min_child_tokens:
+                start = previous.metadata["start_index"]
+                end = child.metadata["start_index"] + len(child.page_content)
+                if end > start:
+                    previous.page_content = parent.page_content[start:end]
+                    continue
+            merged.append(child)
+        return merged
@@ -1,29 +1,15 @@
 # RAG链
 
-from typing import Dict, Any
-
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_openai import ChatOpenAI
+import threading
+from typing import Dict, Any, List, Optional
 
 from config import Config
+from app import resources, tracing
+from .postprocess import postprocess
 from .retriever import VectorRetriever
 
-class RAGChain:
-    def __init__(self):
-        """初始化RAG链"""
-        self.llm = ChatOpenAI(
-            model=Config.OPENAI_MODEL,
-            temperature=0.5,
-            api_key=Config.OPENAI_API_KEY,
-            base_url=Config.OPENAI_BASE_URL
-        )
-        
-        self.retriever = VectorRetriever()
-        
-        # 定义提示模板
-        self.prompt = ChatPromptTemplate.from_template("""
+# 生成回答的提示模板
+_PROMPT_TEMPLATE = """
                 基于以下上下文回答问题。如果上下文中没有相关信息，请说"根据提供的上下文，我无法回答这个问题"。
 
                 上下文：
@@ -31,55 +17,264 @@ class RAGChain:
 
                 问题：{question}
 
-                回答：""")
+                回答："""
 
-        self.chain = (
-            {"context": self.retriever.as_retriever(), "question": RunnablePassthrough()}
-            | self.prompt
-            | self.llm
-            | StrOutputParser()
-        )
+class RAGChain:
+    def __init__(self, retriever: Optional[VectorRetriever] = None):
+        """
+        初始化RAG链
+        
+        retriever: 共享的向量检索器，不传时新建
+        """
+        self.retriever = retriever or VectorRetriever()
+        
+        # 聊天模型与生成链在首次生成回答时创建；仅检索时（如代理调用 retrieve）不需要
+        self._chain = None
+        
+        # 生成调用计数
+        self.stats = {
+            "generations": 0
+        }
+        self._stats_lock = threading.Lock()
     
-    def invoke(self, question: str) -> Dict[str, Any]:
+    def get_stats(self) -> Dict[str, int]:
         """
-        调用RAG链回答问题
+        获取生成调用计数
         
-        question: 问题
-
-        returns: 包含答案和上下文的字典
+        returns: 生成次数
         """
-        try:
-            # 检索相关文档
-            retriever = self.retriever.as_retriever()
-            docs = retriever.invoke(question)
+        with self._stats_lock:
+            return dict(self.stats)
+    
+    @property
+    def llm(self):
+        return resources.get_chat_model()
+    
+    @property
+    def chain(self):
+        """生成链：提示模板 | 聊天模型 | 文本解析，上下文由 retrieve() 预先检索后传入，链本身不再重复检索"""
+        if self._chain is None:
+            from langchain_core.prompts import ChatPromptTemplate
+            from langchain_core.output_parsers import StrOutputParser
+            self._chain = ChatPromptTemplate.from_template(_PROMPT_TEMPLATE) | self.llm | StrOutputParser()
+        return self._chain
+    
+    @staticmethod
+    def _search_k() -> int:
+        """检索数量：启用检索后处理时过量召回"""
+        if Config.RERANK_ENABLED:
+            return max(Config.RERANK_FETCH_K, Config.RETRIEVAL_K)
+        return Config.RETRIEVAL_K
+    
+    def _build_retrieval(self, question: str, candidates) -> Dict[str, Any]:
+        """对候选文档做检索后处理并拼接上下文"""
+        with tracing.span("rerank", candidates=len(candidates)) as span:
+            if Config.PARENT_RETRIEVAL:
+                # 子块用于精确匹配，上下文使用其所在的父段落，同一父段落只出现一次
+                candidates = self.retriever.parent_documents(candidates)
+                span.set(parents=len(candidates))
+            
+            if Config.RERANK_ENABLED:
+                # 合并重叠块、去冗余，并按词元预算打包
+                docs = postprocess(
+                    candidates,
+                    k=Config.RETRIEVAL_K,
+                    token_budget=Config.CONTEXT_TOKEN_BUDGET,
+                    lambda_mult=Config.MMR_LAMBDA,
+                    max_overlap=Config.CHUNK_OVERLAP
+                )
+            else:
+                docs = candidates
             
             if not docs:
                 print(f"未找到相关文档: {question}")
                 return {
                     "success": False,
-                    "answer": "未找到相关信息",
                     "context": "",
                     "source_documents": []
                 }
             
             # 提取上下文
             context = "\n\n".join([doc.page_content for doc in docs])
+            span.set(documents=len(docs))
+            span.set_tokens(context)
+        
+        return {
+            "success": True,
+            "context": context,
+            "source_documents": docs
+        }
+    
+    def retrieve(self, question: str, embedding: Optional[List[float]] = None) -> Dict[str, Any]:
+        """
+        仅检索模式：嵌入并检索一次，不调用大模型生成回答
+        
+        question: 问题
+        embedding: 已计算好的问题向量，传入时不再重复嵌入
+
+        returns: 包含上下文和来源文档的字典
+        """
+        try:
+            candidates = self.retriever.search(question, k=self._search_k(), embedding=embedding)
+            return self._build_retrieval(question, candidates)
             
-            # 生成回答
-            answer = self.chain.invoke(question)
+        except Exception as e:
+            print(f"RAG检索失败: {str(e)}")
+            return {
+                "success": False,
+                "context": "",
+                "source_documents": []
+            }
+    
+    async def aretrieve(self, question: str, embedding: Optional[List[float]] = None) -> Dict[str, Any]:
+        """
+        retrieve 的异步版本
+        
+        question: 问题
+        embedding: 已计算好的问题向量，传入时不再重复嵌入
+
+        returns: 包含上下文和来源文档的字典
+        """
+        try:
+            candidates = await self.retriever.asearch(question, k=self._search_k(), embedding=embedding)
+            return self._build_retrieval(question, candidates)
             
+        except Exception as e:
+            print(f"RAG检索失败: {str(e)}")
             return {
-                "success": True,
-                "answer": answer,
-                "context": context,
-                "source_documents": docs
+                "success": False,
+                "context": "",
+                "source_documents": []
             }
+    
+    def retrieve_from(self, question: str, candidates: List[Any]) -> Dict[str, Any]:
+        """
+        在已检索到的候选文档上完成检索：不嵌入、不检索，只做检索后处理并拼接上下文（如交互模式的预取结果）
+        
+        question: 问题
+        candidates: 按相关度降序的候选文档
+
+        returns: 包含上下文和来源文档的字典，格式与 retrieve 相同
+        """
+        try:
+            return self._build_retrieval(question, candidates)
             
         except Exception as e:
-            print(f"RAG链执行失败: {str(e)}")
+            print(f"RAG检索失败: {str(e)}")
             return {
                 "success": False,
-                "answer": f"处理问题时出错: {str(e)}",
                 "context": "",
                 "source_documents": []
-            }
\ No newline at end of file
+            }
+    
+    def retrieve_batch(self, questions: List[str],
+                       embeddings: Optional[List[List[float]]] = None) -> List[Dict[str, Any]]:
+        """
+        批量检索模式：所有问题一起嵌入和检索，不调用大模型
+        
+        questions: 问题列表
+        embeddings: 已计算好的问题向量，传入时不再重复嵌入
+
+        returns: 每个问题的检索结果字典，格式与 retrieve 相同
+        """
+        candidate_lists = self.retriever.search_batch(questions, k=self._search_k(), embeddings=embeddings)
+        results = []
+        for question, candidates in zip(questions, candidate_lists):
+            try:
+                results.append(self._build_retrieval(question, candidates))
+            except Exception as e:
+                print(f"RAG检索失败: {str(e)}")
+                results.append({
+                    "success": False,
+                    "context": "",
+                    "source_documents": []
+                })
+        return results
+    
+    def invoke(self, question: str) -> Dict[str, Any]:
+        """
+        调用RAG链回答问题
+        
+        question: 问题
+
+        returns: 包含答案和上下文的字典
+        """
+        with tracing.trace("rag_chain", question=question):
+            try:
+                # 检索相关文档
+                retrieval = self.retrieve(question)
+                
+                if not retrieval["success"]:
+                    return {
+                        "success": False,
+                        "answer": "未找到相关信息",
+                        "context": "",
+                        "source_documents": []
+                    }
+                
+                # 生成回答
+                with self._stats_lock:
+                    self.stats["generations"] += 1
+                answer = self.chain.invoke({
+                    "context": retrieval["context"],
+                    "question": question
+                }, config=tracing.run_config())
+                
+                return {
+                    "success": True,
+                    "answer": answer,
+                    "context": retrieval["context"],
+                    "source_documents": retrieval["source_documents"]
+                }
+                
+            except Exception as e:
+                print(f"RAG链执行失败: {str(e)}")
+                return {
+                    "success": False,
+                    "answer": f"处理问题时出错: {str(e)}",
+                    "context": "",
+                    "source_documents": []
+                }
+    
+    async def ainvoke(self, question: str) -> Dict[str, Any]:
+        """
+        invoke 的异步版本
+        
+        question: 问题
+
+        returns: 包含答案和上下文的字典
+        """
+        with tracing.trace("rag_chain", question=question):
+            try:
+                retrieval = await self.aretrieve(question)
+                
+                if not retrieval["success"]:
+                    return {
+                        "success": False,
+                        "answer": "未找到相关信息",
+                        "context": "",
+                        "source_documents": []
+                    }
+                
+                with self._stats_lock:
+                    self.stats["generations"] += 1
+                answer = await self.chain.ainvoke({
+                    "context": retrieval["context"],
+                    "question": question
+                }, config=tracing.run_config())
+                
+                return {
+                    "success": True,
+                    "answer": answer,
+                    "context": retrieval["context"],
+                    "source_documents": retrieval["source_documents"]
+                }
+                
+            except Exception as e:
+                print(f"RAG链执行失败: {str(e)}")
+                return {
+                    "success": False,
+                    "answer": f"处理问题时出错: {str(e)}",
+                    "context": "",
+                    "source_documents": []
+                }
\ No newline at end of file
@@ -0,0 +1,129 @@
+# 父段落存储
+# 结构感知分割时向量库只保存用于检索的子块，子块的 metadata["parent_id"] 指向这里的父段落，检索后据此取回上下文；
+# 父段落不参与嵌入，以 SQLite 持久化，并按来源文件记录，文件变更或删除时清理不再被引用的父段落
+
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from langchain_core.documents import Document
+
+
+class DocStore:
+    def __init__(self, index_path: str):
+        """
+        index_path: SQLite 文件路径
+        """
+        self.index_path = index_path
+
+        directory = os.path.dirname(index_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(index_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS parents (
+                id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_parents_source ON parents(source);
+            """
+        )
+        self._conn.commit()
+
+    def count(self) -> int:
+        """父段落数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM parents").fetchone()[0]
+
+    def add(self, ids: List[str], documents: List[Document]):
+        """
+        添加或覆盖父段落
+
+        ids: 父段落ID列表
+        documents: 父段落列表，metadata["source"] 为所属文件
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO parents VALUES (?, ?, ?, ?)",
+                [(doc_id, doc.metadata.get("source", ""), doc.page_content,
+                  json.dumps(doc.metadata, ensure_ascii=False)) for doc_id, doc in zip(ids, documents)]
+            )
+            self._conn.commit()
+
+    def get(self, ids: Iterable[str]) -> Dict[str, Document]:
+        """
+        按ID取回父段落
+
+        ids: 父段落ID
+
+        returns: 父段落ID -> 文档，不存在的ID不出现在结果中
+        """
+        ids = list(dict.fromkeys(ids))
+        results = {}
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                batch = ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT id, content, metadata FROM parents WHERE id IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for doc_id, content, metadata in rows:
+                    results[doc_id] = Document(page_content=content, metadata=json.loads(metadata), id=doc_id)
+        return results
+
+    def scan(self, page_size: int = 1000) -> Iterator[Tuple[str, Document]]:
+        """
+        按写入顺序分页遍历全部父段落（如导出快照）
+
+        page_size: 每次查询读取的条数
+
+        returns: (父段落ID, 文档) 迭代器
+        """
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT rowid, id, content, metadata FROM parents WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last, page_size)
+                ).fetchall()
+            if not rows:
+                return
+            for _, doc_id, content, metadata in rows:
+                yield doc_id, Document(page_content=content, metadata=json.loads(metadata), id=doc_id)
+            last = rows[-1][0]
+
+    def delete_source(self, source: str, keep: Iterable[str] = ()) -> int:
+        """
+        删除某个文件的父段落
+
+        source: 文件（相对于文档目录的路径）
+        keep: 保留的父段落ID（文件当前版本仍在使用的）
+
+        returns: 删除的条数
+        """
+        keep = set(keep)
+        with self._lock:
+            stale = [row[0] for row in self._conn.execute("SELECT id FROM parents WHERE source = ?", (source,))
+                     if row[0] not in keep]
+            for i in range(0, len(stale), 500):
+                batch = stale[i:i + 500]
+                self._conn.execute(f"DELETE FROM parents WHERE id IN ({','.join('?' * len(batch))})", batch)
+            self._conn.commit()
+        return len(stale)
+
+    def clear(self):
+        """清空存储"""
+        with self._lock:
+            self._conn.execute("DELETE FROM parents")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,208 @@
+# 持久化嵌入缓存
+# 以 (模型名, 文本哈希) 为键，将向量以 float32 二进制存入 SQLite，命中时不再请求嵌入API
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+from app import tracing
+
+# SQLite 单条语句中参数数量上限较低，批量查询时分段
+_SQL_BATCH = 500
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, model_name: str, cache_path: str, max_entries: int = 200000):
+        """
+        embeddings: 被包装的嵌入模型
+        model_name: 模型名称，参与缓存键计算，切换模型时不会误命中
+        cache_path: SQLite 缓存文件路径
+        max_entries: 最大缓存条数，超出后按最近访问时间淘汰
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+
+        # 命中统计
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "api_calls": 0,
+            "evictions": 0
+        }
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # 计数单独加锁：异步调用在事件循环线程中累加，不与后台线程中的 SQLite 读写争用同一把锁
+        self._stats_lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        # 条数上界：写入时累加（覆盖写会高估），超过上限时才精确统计
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _key(self, text: str) -> str:
+        """计算缓存键"""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        """批量查询缓存并刷新访问时间"""
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, items: Dict[str, List[float]]):
+        """写入缓存，必要时淘汰最久未访问的条目"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+            )
+            self._count += len(items)
+            if self._count > self.max_entries:
+                self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                overflow = self._count - self.max_entries
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                        (overflow,)
+                    )
+                    self._count -= overflow
+                    with self._stats_lock:
+                        self.stats["evictions"] += overflow
+            self._conn.commit()
+
+    def _partition(self, keys: List[str], texts: List[str], cached: Dict[str, List[float]]) -> Dict[str, str]:
+        """
+        统计命中情况，找出需要请求嵌入API的文本，同步与异步调用共用
+
+        keys: 与文本一一对应的缓存键
+        texts: 文本列表
+        cached: 已命中的缓存，键为缓存键
+
+        returns: 未命中的文本（去重），键为缓存键
+        """
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        misses = sum(1 for key in keys if key in missing)
+        with self._stats_lock:
+            self.stats["hits"] += len(texts) - misses
+            self.stats["misses"] += misses
+            if missing:
+                self.stats["api_calls"] += 1
+        tracing.annotate(cache_hit=not missing, cache_hits=len(texts) - misses)
+        return missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量嵌入文档，仅对未命中的文本请求嵌入API
+
+        texts: 文本列表
+
+        returns: 向量列表，顺序与输入一致
+        """
+        keys = [self._key(text) for text in texts]
+        cached = self._lookup(list(set(keys)))
+        missing = self._partition(keys, texts, cached)
+
+        if missing:
+            fresh = dict(zip(missing, self.embeddings.embed_documents(list(missing.values()))))
+            self._store(fresh)
+            cached.update(fresh)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        嵌入查询，命中缓存时不访问网络
+
+        text: 查询文本
+
+        returns: 查询向量
+        """
+        key = self._key(text)
+        cached = self._lookup([key])
+        if self._partition([key], [text], cached):
+            cached[key] = self.embeddings.embed_query(text)
+            self._store(cached)
+        return cached[key]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """异步批量嵌入文档，缓存读写在线程中执行，不阻塞事件循环"""
+        keys = [self._key(text) for text in texts]
+        cached = await asyncio.to_thread(self._lookup, list(set(keys)))
+        missing = self._partition(keys, texts, cached)
+
+        if missing:
+            fresh = dict(zip(missing, await self.embeddings.aembed_documents(list(missing.values()))))
+            await asyncio.to_thread(self._store, fresh)
+            cached.update(fresh)
+
+        return [cached[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """异步嵌入查询，缓存读写在线程中执行，不阻塞事件循环"""
+        key = self._key(text)
+        cached = await asyncio.to_thread(self._lookup, [key])
+        if self._partition([key], [text], cached):
+            cached[key] = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self._store, cached)
+        return cached[key]
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        获取缓存统计
+
+        returns: 命中、未命中、API调用、淘汰次数及命中率
+        """
+        with self._stats_lock:
+            stats = dict(self.stats)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        return stats
+
+    def close(self):
+        """关闭缓存数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,289 @@
+# 并发嵌入执行器
+# 将文本按词元预算切分为批次，多个请求同时在途；遇到限流或超时自动降低并发并带抖动重试
+
+import asyncio
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from app.rag.tokens import count_tokens
+
+
+def _is_retryable(error: Exception) -> bool:
+    """限流、超时、连接错误和服务端错误可以重试"""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (TimeoutError, ConnectionError)) or \
+        type(error).__name__ in ("APITimeoutError", "APIConnectionError")
+
+
+def _is_throttle(error: Exception) -> bool:
+    """限流或超时，说明上游已过载，需要降低并发"""
+    return getattr(error, "status_code", None) == 429 or \
+        isinstance(error, TimeoutError) or type(error).__name__ == "APITimeoutError"
+
+
+class _AdaptiveLimiter:
+    """
+    自适应并发限制（加性增、乘性减）：
+    被限流时并发减半，连续成功若干次后并发加一，不超过上限
+    """
+
+    def __init__(self, max_limit: int, increase_after: int = 4):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.increase_after = increase_after
+        self._in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+        self._async_conds = weakref.WeakKeyDictionary()
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+
+    def try_acquire(self) -> bool:
+        """非阻塞获取"""
+        with self._cond:
+            if self._in_flight >= self.limit:
+                return False
+            self._in_flight += 1
+            return True
+
+    def _async_condition(self) -> asyncio.Condition:
+        """当前事件循环上的条件变量，每个事件循环一个"""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            cond = self._async_conds.get(loop)
+            if cond is None:
+                cond = self._async_conds[loop] = asyncio.Condition()
+            return cond
+
+    async def aacquire(self):
+        cond = self._async_condition()
+        async with cond:
+            await cond.wait_for(self.try_acquire)
+
+    @staticmethod
+    async def _anotify(cond: asyncio.Condition):
+        async with cond:
+            cond.notify_all()
+
+    def _wake(self, cond: asyncio.Condition):
+        """在条件变量所属的事件循环中执行"""
+        asyncio.ensure_future(self._anotify(cond))
+
+    def _notify_async(self):
+        """并发上限或在途数变化后唤醒各事件循环上的等待者；release 可能在任意线程调用"""
+        with self._cond:
+            conds = list(self._async_conds.items())
+        for loop, cond in conds:
+            if loop.is_running():
+                loop.call_soon_threadsafe(self._wake, cond)
+
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self._in_flight -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.increase_after and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+        self._notify_async()
+
+
+class ConcurrentEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, max_concurrency: int = 4, batch_tokens: int = 8000,
+                 batch_size: int = 256, max_retries: int = 6, base_delay: float = 0.5, max_delay: float = 20.0):
+        """
+        embeddings: 被包装的嵌入模型（应关闭其自身的重试）
+        max_concurrency: 同时在途的最大请求数
+        batch_tokens: 每个请求的词元预算
+        batch_size: 每个请求的最大文本数
+        max_retries: 单个批次的最大重试次数
+        base_delay: 首次重试的基础等待秒数，按指数增长并加入随机抖动
+        max_delay: 单次等待的上限秒数
+        """
+        self.embeddings = embeddings
+        self.max_concurrency = max(1, max_concurrency)
+        self.batch_tokens = batch_tokens
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._limiter = _AdaptiveLimiter(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                            thread_name_prefix="embedding")
+        self._stats_lock = threading.Lock()
+
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "throttled": 0,
+            "texts": 0,
+            "seconds": 0.0
+        }
+
+    def _batches(self, texts: List[str]) -> List[List[int]]:
+        """按词元预算和条数上限切分批次，返回每批的文本下标"""
+        batches, current, current_tokens = [], [], 0
+        for i, text in enumerate(texts):
+            tokens = count_tokens(text)
+            if current and (current_tokens + tokens > self.batch_tokens or len(current) >= self.batch_size):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _finish(self, attempt: int, error: Optional[BaseException] = None) -> Optional[float]:
+        """
+        结束一次请求：释放并发名额并更新统计，同步与异步调用共用
+
+        attempt: 已重试次数
+        error: 请求抛出的异常，成功时为 None
+
+        returns: 需要重试时返回退避秒数，否则返回 None
+        """
+        retryable = isinstance(error, Exception) and _is_retryable(error)
+        throttled = isinstance(error, Exception) and _is_throttle(error)
+        self._limiter.release(throttled=throttled)
+
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            if not retryable or attempt >= self.max_retries:
+                return None
+            self.stats["retries"] += 1
+            if throttled:
+                self.stats["throttled"] += 1
+
+        # 指数退避 + 全抖动
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _call(self, func, *args):
+        """在并发限制下调用上游，失败时退避重试"""
+        attempt = 0
+        while True:
+            self._limiter.acquire()
+            try:
+                result = func(*args)
+            except BaseException as e:
+                delay = self._finish(attempt, e)
+                if delay is None:
+                    raise
+            else:
+                self._finish(attempt)
+                return result
+            time.sleep(delay)
+            attempt += 1
+
+    async def _acall(self, func, *args):
+        """_call 的异步版本：等待名额与退避期间不占用事件循环"""
+        attempt = 0
+        while True:
+            await self._limiter.aacquire()
+            try:
+                result = await func(*args)
+            except BaseException as e:
+                delay = self._finish(attempt, e)
+                if delay is None:
+                    raise
+            else:
+                self._finish(attempt)
+                return result
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        并发批量嵌入文档
+
+        texts: 文本列表
+
+        returns: 向量列表，顺序与输入一致
+        """
+        if not texts:
+            return []
+
+        start = time.perf_counter()
+        batches = self._batches(texts)
+
+        if len(batches) == 1:
+            vectors = self._call(self.embeddings.embed_documents, texts)
+        else:
+            futures = [
+                self._executor.submit(self._call, self.embeddings.embed_documents, [texts[i] for i in batch])
+                for batch in batches
+            ]
+            vectors = [None] * len(texts)
+            for batch, future in zip(batches, futures):
+                for i, vector in zip(batch, future.result()):
+                    vectors[i] = vector
+
+        with self._stats_lock:
+            self.stats["texts"] += len(texts)
+            self.stats["seconds"] += time.perf_counter() - start
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        嵌入查询，失败时退避重试
+
+        text: 查询文本
+
+        returns: 查询向量
+        """
+        return self._call(self.embeddings.embed_query, text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """异步并发批量嵌入文档，批次之间在同一事件循环上并发"""
+        if not texts:
+            return []
+
+        start = time.perf_counter()
+        batches = self._batches(texts)
+        results = await asyncio.gather(*[
+            self._acall(self.embeddings.aembed_documents, [texts[i] for i in batch])
+            for batch in batches
+        ])
+
+        vectors = [None] * len(texts)
+        for batch, batch_vectors in zip(batches, results):
+            for i, vector in zip(batch, batch_vectors):
+                vectors[i] = vector
+
+        with self._stats_lock:
+            self.stats["texts"] += len(texts)
+            self.stats["seconds"] += time.perf_counter() - start
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """异步嵌入查询，失败时退避重试"""
+        return await self._acall(self.embeddings.aembed_query, text)
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        获取执行统计
+
+        returns: 请求数、重试数、限流次数、当前并发上限及每秒嵌入文本块数
+        """
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["concurrency"] = self._limiter.limit
+        stats["chunks_per_second"] = stats["texts"] / stats["seconds"] if stats["seconds"] else 0.0
+        return stats
@@ -0,0 +1,186 @@
+# 检索过滤条件
+# 过滤条件使用 Chroma 的 where 语法（的子集），Chroma 直接使用；本地向量库的元数据索引与 BM25 关键词索引按同样的语义解释：
+# {"字段": 值}、{"字段": {"$eq|$ne|$gt|$gte|$lt|$lte|$in|$nin|$contains": 值}}、{"$and": [...]}、{"$or": [...]}；
+# 字段值为列表（如 tags）时，只要有一个元素满足条件即视为满足，字段不存在时不满足任何条件
+
+import json
+import re
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+_COMPARISONS = ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte")
+_OPERATORS = _COMPARISONS + ("$in", "$nin", "$contains")
+_SQL_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+# 相对时间，如 30m、12h、7d
+_RELATIVE_TIME = re.compile(r"^(\d+(?:\.\d+)?)\s*([mhdw])$")
+_TIME_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+def parse(where: Dict[str, Any]) -> Tuple:
+    """
+    检查并解析过滤条件
+
+    where: 过滤条件
+
+    returns: 语法树：("and" | "or", [子条件]) 或 ("cmp", 字段, 运算符, 值)
+    """
+    if not isinstance(where, dict) or not where:
+        raise ValueError(f"过滤条件必须是非空字典: {where!r}")
+    if len(where) > 1:
+        # 多个字段并列时按 $and 处理
+        return ("and", [parse({key: value}) for key, value in where.items()])
+
+    key, value = next(iter(where.items()))
+    if key in ("$and", "$or"):
+        if not isinstance(value, list) or not value:
+            raise ValueError(f"{key} 需要非空的条件列表")
+        return (key[1:], [parse(item) for item in value])
+    if key.startswith("$"):
+        raise ValueError(f"不支持的逻辑运算符: {key}")
+
+    if not isinstance(value, dict):
+        return ("cmp", key, "$eq", value)
+    if len(value) != 1:
+        raise ValueError(f"字段 {key} 的条件只能包含一个运算符")
+    operator, operand = next(iter(value.items()))
+    if operator not in _OPERATORS:
+        raise ValueError(f"不支持的运算符: {operator}")
+    if operator in ("$in", "$nin"):
+        if not isinstance(operand, list) or not operand:
+            raise ValueError(f"{operator} 需要非空列表")
+    elif isinstance(operand, (list, dict)) or operand is None:
+        raise ValueError(f"{operator} 需要标量值")
+    return ("cmp", key, operator, operand)
+
+
+def fields(tree: Tuple) -> set:
+    """条件中引用的字段"""
+    if tree[0] == "cmp":
+        return {tree[1]}
+    return set().union(*(fields(child) for child in tree[1]))
+
+
+def _compare(actual: Any, operator: str, operand: Any) -> bool:
+    if operator in ("$eq", "$contains"):
+        return actual == operand
+    if operator == "$ne":
+        return actual != operand
+    if operator == "$in":
+        return actual in operand
+    if operator == "$nin":
+        return actual not in operand
+    # 大小比较只在数值之间或字符串之间进行
+    if isinstance(actual, str) != isinstance(operand, str):
+        return False
+    try:
+        if operator == "$gt":
+            return actual > operand
+        if operator == "$gte":
+            return actual >= operand
+        if operator == "$lt":
+            return actual < operand
+        return actual <= operand
+    except TypeError:
+        return False
+
+
+def matches(tree: Tuple, metadata: Dict[str, Any]) -> bool:
+    """
+    判断元数据是否满足条件
+
+    tree: parse 返回的语法树
+    metadata: 文档元数据
+
+    returns: 是否满足
+    """
+    kind = tree[0]
+    if kind == "and":
+        return all(matches(child, metadata) for child in tree[1])
+    if kind == "or":
+        return any(matches(child, metadata) for child in tree[1])
+
+    _, key, operator, operand = tree
+    if key not in metadata or metadata[key] is None:
+        return False
+    values = metadata[key] if isinstance(metadata[key], list) else [metadata[key]]
+    return any(_compare(value, operator, operand) for value in values)
+
+
+def to_sql(tree: Tuple, column: str) -> Tuple[str, List[Any]]:
+    """
+    转换为 SQLite 条件表达式，元数据以 JSON 文本存放在 column 列中
+
+    tree: parse 返回的语法树
+    column: 元数据列名
+
+    returns: (SQL 表达式, 参数列表)
+    """
+    kind = tree[0]
+    if kind in ("and", "or"):
+        parts = [to_sql(child, column) for child in tree[1]]
+        joiner = " AND " if kind == "and" else " OR "
+        return "(" + joiner.join(sql for sql, _ in parts) + ")", [p for _, params in parts for p in params]
+
+    _, key, operator, operand = tree
+    # 标量与列表字段统一展开为 json_each 的各个元素
+    path = "$." + json.dumps(key, ensure_ascii=False)
+    if operator in ("$in", "$nin"):
+        condition = f"value {'NOT ' if operator == '$nin' else ''}IN ({','.join('?' * len(operand))})"
+        params = list(operand)
+    else:
+        condition = f"value {_SQL_OPERATORS.get(operator, '=')} ?"
+        params = [operand]
+        if operator in ("$gt", "$gte", "$lt", "$lte"):
+            # 与 matches 一致：字符串只与字符串比较，数值只与数值比较
+            condition += " AND type IN " + ("('text')" if isinstance(operand, str) else "('integer', 'real')")
+    return f"EXISTS (SELECT 1 FROM json_each({column}, ?) WHERE {condition})", [path] + params
+
+
+def parse_time(text: str) -> float:
+    """
+    解析时间：日期（2024-05-01）、ISO 时间（2024-05-01T08:00:00）或相对时间（30m、12h、7d、2w，表示多久以前）
+
+    text: 时间文本
+
+    returns: Unix 时间戳（秒）
+    """
+    text = text.strip()
+    relative = _RELATIVE_TIME.match(text.lower())
+    if relative:
+        return time.time() - float(relative.group(1)) * _TIME_UNITS[relative.group(2)]
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise ValueError(f"无法解析的时间: {text}，可用 2024-05-01、2024-05-01T08:00:00 或 7d、12h 等格式")
+
+
+def build_filter(sources: Optional[List[str]] = None, file_types: Optional[List[str]] = None,
+                 tags: Optional[List[str]] = None, since: Optional[float] = None,
+                 until: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    按来源、文件类型、入库时间与标签构造过滤条件
+
+    sources: 来源文件（相对于文档目录的路径），满足其一即可
+    file_types: 文件类型（扩展名，如 pdf、md），满足其一即可
+    tags: 标签，需同时带有所有标签
+    since: 只检索此时间（Unix 时间戳）之后入库的文本块
+    until: 只检索此时间之前入库的文本块
+
+    returns: Chroma where 语法的过滤条件，没有任何条件时返回 None
+    """
+    clauses = []
+    if sources:
+        clauses.append({"source": {"$in": [source.replace("\\", "/") for source in sources]}})
+    if file_types:
+        clauses.append({"file_type": {"$in": [file_type.lower().lstrip(".") for file_type in file_types]}})
+    for tag in tags or []:
+        clauses.append({"tags": {"$contains": tag}})
+    if since is not None:
+        clauses.append({"ingested_at": {"$gte": since}})
+    if until is not None:
+        clauses.append({"ingested_at": {"$lt": until}})
+
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
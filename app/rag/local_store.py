@@ -0,0 +1,1035 @@
+# 本地向量库
+# 归一化后的向量以 float32、int8（逐行缩放）或 PQ 编码（乘积量化）存放在内存映射文件中，可先按 Matryoshka 方式截断维度，
+# ID、文本和元数据按列存放在旁路文件中（数据文件 + 每行结束偏移），加载时只需映射文件，不读入全部数据；
+# 检索用 NumPy 按块向量化计算压缩向量上的相似度：数据量小时精确搜索，数据量大时用 IVF（倒排聚类）只扫描最相近的若干个簇，
+# 建立 IVF 之后新写入的行在簇之外精确扫描，增量超过已索引行数的一半时重建；
+# 开启重排时另存一份全精度向量（只在重排候选时读取对应的页），用全精度相似度对前 k × rescore 个候选重新排序；
+# 带过滤条件的检索先由元数据索引查出满足条件的行，满足条件的行较少时只对这些行精确计算，较多时在 IVF 或精确扫描中排除其余的行
+import json
+import os
+import shutil
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from app.rag.filters import matches, parse
+from app.rag.payload_index import PayloadIndex
+
+_META_FILE = "index.json"
+_FORMAT_VERSION = 1
+_MIN_CAPACITY = 1024
+# 每次参与矩阵运算的元素数（行数 × 维度），限制临时内存在约 64MB
+_BLOCK_ELEMENTS = 1 << 24
+# int8 向量分段转换为 float32 的元素数，转换缓冲区（约 1MB）留在 CPU 缓存中
+_CAST_ELEMENTS = 1 << 18
+# PQ 每个子空间的码本大小（编码为 uint8），训练码本所需的最少行数与最多采样行数
+_PQ_CENTROIDS = 256
+_PQ_TRAIN_ROWS = 4096
+_PQ_SAMPLE_ROWS = 65536
+_COLUMNS = ("ids", "texts", "metadatas")
+_PAYLOAD_FILE = "payload.sqlite3"
+# 默认建立元数据索引的字段
+_INDEX_FIELDS = ("source", "file_type", "ingested_at", "tags")
+# 缓存的过滤结果（满足条件的行号）个数，同一检索范围下的后续查询不再查询元数据索引
+_FILTER_CACHE_SIZE = 16
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _open_array(path: str, dtype, shape: Tuple[int, ...]) -> np.memmap:
+    """打开（必要时创建或扩展）内存映射数组文件"""
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    with open(path, "ab") as f:
+        if f.tell() < nbytes:
+            f.truncate(nbytes)
+    return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+
+def _block_rows(dim: int) -> int:
+    return max(1024, _BLOCK_ELEMENTS // max(1, dim))
+
+
+def _kmeans(data: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """欧氏距离 k-means，返回 (k, 维度) 的簇中心"""
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(data @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        sizes = np.bincount(assign, minlength=k)
+        empty = sizes == 0
+        centroids = sums / np.maximum(sizes, 1)[:, None]
+        # 空簇重新随机取一个样本作为中心
+        centroids[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+    return centroids
+
+
+def _balanced_bounds(variance: np.ndarray, parts: int) -> np.ndarray:
+    """
+    把维度切分为 parts 段，使各段的方差之和尽量相等（每段至少 1 维）
+
+    Matryoshka 等嵌入的方差集中在前面的维度，等宽切分时前面的子向量量化误差大，按方差切分可显著提高召回
+    """
+    dim = len(variance)
+    cumulative = np.cumsum(variance) / max(float(variance.sum()), 1e-12)
+    bounds = [0]
+    for j in range(1, parts):
+        bound = int(np.searchsorted(cumulative, j / parts)) + 1
+        bounds.append(min(max(bound, bounds[-1] + 1), dim - (parts - j)))
+    bounds.append(dim)
+    return np.asarray(bounds, dtype=np.int64)
+
+
+def _top_k(scores: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    每个查询保留得分最高的 k 个候选
+
+    scores: (查询数, 候选数) 得分矩阵
+    rows: (查询数, 候选数) 或 (候选数,) 的行号
+
+    returns: 按得分降序排列的 (得分, 行号)，形状均为 (查询数, min(k, 候选数))
+    """
+    if rows.ndim == 1:
+        rows = np.broadcast_to(rows, scores.shape)
+    if scores.shape[1] > k:
+        index = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, index, axis=1)
+        rows = np.take_along_axis(rows, index, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(rows, order, axis=1)
+
+
+class _Column:
+    """变长列：数据文件顺序存放各行内容，偏移文件（uint64）记录每行的结束位置"""
+
+    def __init__(self, directory: str, name: str):
+        self.data_path = os.path.join(directory, f"{name}.data")
+        self.offsets_path = os.path.join(directory, f"{name}.offsets")
+        self.offsets: Optional[np.memmap] = None
+        self._file = open(self.data_path, "a+b")
+        self._lock = threading.Lock()
+
+    def open(self, capacity: int):
+        self.offsets = _open_array(self.offsets_path, np.uint64, (capacity,))
+
+    def _end(self, row: int) -> int:
+        return int(self.offsets[row - 1]) if row > 0 else 0
+
+    def append(self, start_row: int, values: List[bytes]):
+        with self._lock:
+            # 截掉上次中断时写入但未提交的内容
+            position = self._end(start_row)
+            self._file.truncate(position)
+            self._file.seek(0, os.SEEK_END)
+            for i, value in enumerate(values):
+                self._file.write(value)
+                position += len(value)
+                self.offsets[start_row + i] = position
+            self._file.flush()
+
+    def read(self, row: int) -> bytes:
+        start, end = self._end(row), int(self.offsets[row])
+        with self._lock:
+            self._file.seek(start)
+            return self._file.read(end - start)
+
+    def close(self):
+        self._file.close()
+
+
+class LocalVectorStore(VectorStore):
+    def __init__(self, persist_directory: str, embedding_function: Embeddings, dtype: str = "float32",
+                 index_type: str = "auto", nprobe: int = 16, ivf_min_rows: int = 50000, nlist: int = 0,
+                 dims: int = 0, pq_subvectors: int = 0, rescore: int = 0,
+                 index_fields: Sequence[str] = _INDEX_FIELDS, collection_name: str = "local"):
+        """
+        persist_directory: 索引文件目录
+        embedding_function: 嵌入模型
+        dtype: 检索用的向量编码，float32、int8（每行一个缩放系数，约为 float32 的 1/4）
+               或 pq（乘积量化，每个子向量 1 字节），已有索引时沿用索引的设置
+        index_type: exact（总是精确搜索）、ivf（总是使用 IVF）或 auto（行数达到 ivf_min_rows 后使用 IVF）
+        nprobe: IVF 每次查询扫描的簇数，越大召回越高、越慢
+        ivf_min_rows: auto 模式下建立 IVF 所需的最少行数
+        nlist: IVF 簇数，0 表示按行数的平方根自动确定
+        dims: 检索时只使用向量的前 dims 维（适用于 Matryoshka 训练的嵌入模型，如 text-embedding-3），0 表示不截断
+        pq_subvectors: PQ 子向量个数（每行编码的字节数），0 表示每 8 维一个子向量
+        rescore: 大于 0 时另存全精度向量，并用全精度相似度对前 k × rescore 个候选重新排序；
+                 float32 且不截断维度时无需重排，pq 总是另存全精度向量（用于训练码本）
+        index_fields: 建立元数据索引的字段，过滤条件只涉及这些字段时按索引查询，否则逐行读取元数据判断
+        collection_name: 集合名称
+        """
+        if dtype not in ("float32", "int8", "pq"):
+            raise ValueError(f"不支持的向量存储类型: {dtype}，可选 float32、int8、pq")
+        if index_type not in ("auto", "exact", "ivf"):
+            raise ValueError(f"不支持的索引类型: {index_type}，可选 auto、exact、ivf")
+
+        self.directory = persist_directory
+        self.name = collection_name
+        self.index_type = index_type
+        self.nprobe = max(1, nprobe)
+        self.ivf_min_rows = ivf_min_rows
+        self.nlist = nlist
+        self.rescore = max(0, rescore)
+        self._embedding = embedding_function
+
+        # 写入、删除与切换数组时持有；检索只在读取行数和数组引用时短暂持有
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        os.makedirs(persist_directory, exist_ok=True)
+
+        self._meta = self._read_meta() or self._new_meta(dtype, dims, pq_subvectors)
+        if self._meta["dtype"] != dtype:
+            print(f"本地向量库已按 {self._meta['dtype']} 存储，忽略配置的 {dtype}")
+
+        self._columns = {name: _Column(persist_directory, name) for name in _COLUMNS}
+        self._vectors: Optional[np.memmap] = None
+        self._scales: Optional[np.memmap] = None
+        self._full: Optional[np.memmap] = None
+        # 重排时按行读取全精度向量的文件句柄
+        self._full_file = None
+        self._full_lock = threading.Lock()
+        self._alive: Optional[np.memmap] = None
+        # ID -> 行号，首次写入、删除或按ID读取时从 ids 列加载
+        self._id_rows: Optional[Dict[str, int]] = None
+        self._ivf: Optional[Dict[str, Any]] = None
+        # PQ 码本与子向量边界：{"codebooks": (子向量数, 码本大小, 宽度), "bounds": (子向量数 + 1,)}
+        self._pq: Optional[Dict[str, np.ndarray]] = None
+        self._payload = PayloadIndex(self._path(_PAYLOAD_FILE), index_fields)
+        # 写入、删除或压缩时递增，过滤结果缓存按 (版本, 条件) 存放
+        self._version = 0
+        self._filter_cache: "OrderedDict[Tuple[int, str], np.ndarray]" = OrderedDict()
+
+        if self._meta["dim"]:
+            self._open_arrays(self._meta["capacity"])
+            self._ivf = self._load_ivf()
+            self._pq = self._load_pq()
+            self._sync_payload()
+        if self.rescore and self._meta["dim"] and not self._meta.get("full"):
+            print("本地向量库未保存全精度向量，忽略重排设置")
+
+    # ---------- 文件与元信息 ----------
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _read_meta(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(_META_FILE), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if meta.get("format") != _FORMAT_VERSION:
+            raise ValueError(f"本地向量库格式版本 {meta.get('format')} 与当前版本 {_FORMAT_VERSION} 不兼容")
+        return meta
+
+    def _new_meta(self, dtype: str, dims: int, pq_subvectors: int) -> Dict[str, Any]:
+        """新索引的元信息；维度相关的字段在首次写入、得知嵌入维度后确定"""
+        return {
+            "format": _FORMAT_VERSION,
+            "dim": None,
+            "source_dim": None,
+            "dtype": dtype,
+            "count": 0,
+            "capacity": 0,
+            "ivf": None,
+            "dims": dims,
+            "full": dtype == "pq" or (self.rescore > 0 and (dtype != "float32" or dims > 0)),
+            "pq": {"subvectors": pq_subvectors, "trained": 0} if dtype == "pq" else None
+        }
+
+    def _init_dims(self, source_dim: int):
+        """首次写入时按嵌入维度确定检索维度与 PQ 子向量数"""
+        dims = self._meta.get("dims") or 0
+        self._meta["source_dim"] = source_dim
+        self._meta["dim"] = min(dims, source_dim) if dims > 0 else source_dim
+        if self._meta["dim"] == source_dim and self.dtype == "float32":
+            # 检索用的向量本身就是全精度的
+            self._meta["full"] = False
+        if self.dtype == "pq":
+            subvectors = self._meta["pq"]["subvectors"] or max(1, self._meta["dim"] // 8)
+            self._meta["pq"]["subvectors"] = min(subvectors, self._meta["dim"])
+
+    def _write_meta(self):
+        """原子地写入元信息；行数以元信息为准，未提交的数据在下次写入时被覆盖"""
+        temp = self._path(_META_FILE + ".tmp")
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(self._meta, f)
+        os.replace(temp, self._path(_META_FILE))
+
+    @property
+    def dtype(self) -> str:
+        return self._meta["dtype"]
+
+    @property
+    def _source_dim(self) -> int:
+        return self._meta.get("source_dim") or self._meta["dim"]
+
+    def _open_arrays(self, capacity: int):
+        dim = self._meta["dim"]
+        if self.dtype == "pq":
+            self._vectors = _open_array(self._path("vectors.bin"), np.uint8,
+                                        (capacity, self._meta["pq"]["subvectors"]))
+        else:
+            vector_dtype = np.int8 if self.dtype == "int8" else np.float32
+            self._vectors = _open_array(self._path("vectors.bin"), vector_dtype, (capacity, dim))
+        if self.dtype == "int8":
+            self._scales = _open_array(self._path("scales.bin"), np.float32, (capacity,))
+        if self._meta.get("full"):
+            self._full = _open_array(self._path("full.bin"), np.float32, (capacity, self._source_dim))
+            if self._full_file is None:
+                self._full_file = open(self._path("full.bin"), "rb", buffering=0)
+        self._alive = _open_array(self._path("alive.bin"), np.uint8, (capacity,))
+        for column in self._columns.values():
+            column.open(capacity)
+        self._meta["capacity"] = capacity
+
+    def _ensure_capacity(self, rows: int):
+        if rows <= self._meta["capacity"]:
+            return
+        capacity = max(_MIN_CAPACITY, rows, self._meta["capacity"] * 2)
+        self._flush()
+        self._open_arrays(capacity)
+
+    def _load_ivf(self) -> Optional[Dict[str, Any]]:
+        info = self._meta.get("ivf")
+        if not info:
+            return None
+        try:
+            return {
+                "centroids": np.load(self._path("ivf_centroids.npy")),
+                "rows": np.load(self._path("ivf_rows.npy"), mmap_mode="r"),
+                "offsets": np.load(self._path("ivf_offsets.npy")),
+                "indexed": info["indexed"]
+            }
+        except OSError:
+            return None
+
+    def _load_pq(self) -> Optional[Dict[str, np.ndarray]]:
+        if self.dtype != "pq" or not self._meta["pq"]["trained"]:
+            return None
+        try:
+            return {
+                "codebooks": np.load(self._path("pq_codebooks.npy")),
+                "bounds": np.asarray(self._meta["pq"]["bounds"], dtype=np.int64)
+            }
+        except OSError:
+            return None
+
+    def _sync_payload(self):
+        """为尚未建立元数据索引的行（升级前写入的数据）补建索引"""
+        start, count = self._payload.rows, self._meta["count"]
+        if start >= count:
+            return
+        print(f"正在为本地向量库的 {count - start} 行建立元数据索引")
+        block = 10000
+        for offset in range(start, count, block):
+            end = min(count, offset + block)
+            self._payload.add(offset, [json.loads(self._columns["metadatas"].read(row)) for row in range(offset, end)])
+
+    def _load_id_rows(self) -> Dict[str, int]:
+        if self._id_rows is None:
+            count = self._meta["count"]
+            alive = np.flatnonzero(self._alive[:count]) if count else []
+            self._id_rows = {self._columns["ids"].read(int(row)).decode("utf-8"): int(row) for row in alive}
+        return self._id_rows
+
+    # ---------- 写入与删除 ----------
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def _quantize(self, vectors: np.ndarray):
+        """int8 对称量化：每行按最大绝对值缩放到 [-127, 127]"""
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def _truncate(self, vectors: np.ndarray) -> np.ndarray:
+        """全精度向量转换到检索空间：截断到前 dim 维并重新归一化"""
+        if vectors.shape[1] <= self._meta["dim"]:
+            return vectors
+        return _normalize(vectors[:, :self._meta["dim"]])
+
+    def _encode(self, start: int, vectors: np.ndarray):
+        """把检索空间的向量编码后写入 start 开始的行；PQ 码本训练之前不写编码，检索时改用全精度向量"""
+        end = start + len(vectors)
+        if self.dtype == "int8":
+            self._vectors[start:end], self._scales[start:end] = self._quantize(vectors)
+        elif self.dtype == "pq":
+            if self._pq is not None:
+                self._vectors[start:end] = self._pq_encode(vectors, self._pq["codebooks"], self._pq["bounds"])
+        else:
+            self._vectors[start:end] = vectors
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, *,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        """
+        嵌入并写入文本，已存在的ID按覆盖写入（旧行标记删除）
+
+        texts: 文本
+        metadatas: 元数据，与 texts 一一对应
+        ids: 文档ID，不传时自动生成
+
+        returns: 写入的ID列表
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_embeddings(texts, self._embedding.embed_documents(texts), metadatas, ids=ids)
+
+    def add_embeddings(self, texts: List[str], embeddings: Any, metadatas: Optional[List[dict]] = None, *,
+                       ids: Optional[List[str]] = None) -> List[str]:
+        """
+        写入已计算好向量的文本（如从快照导入），不调用嵌入模型；已存在的ID按覆盖写入
+
+        texts: 文本
+        embeddings: 与 texts 一一对应的向量（列表或 (n, dim) 数组）
+        metadatas: 元数据，与 texts 一一对应
+        ids: 文档ID，不传时自动生成
+
+        returns: 写入的ID列表
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        ids = [str(doc_id) for doc_id in ids] if ids else [uuid.uuid4().hex for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = _normalize(np.array(embeddings, dtype=np.float32))
+
+        with self._lock:
+            if self._meta["dim"] is None:
+                self._init_dims(int(vectors.shape[1]))
+                self._open_arrays(_MIN_CAPACITY)
+            elif vectors.shape[1] != self._source_dim:
+                raise ValueError(f"向量维度 {vectors.shape[1]} 与索引维度 {self._source_dim} 不一致")
+
+            id_rows = self._load_id_rows()
+            start = self._meta["count"]
+            end = start + len(texts)
+            self._ensure_capacity(end)
+
+            if self._full is not None:
+                self._full[start:end] = vectors
+            self._encode(start, self._truncate(vectors))
+            self._columns["ids"].append(start, [doc_id.encode("utf-8") for doc_id in ids])
+            self._columns["texts"].append(start, [text.encode("utf-8") for text in texts])
+            self._columns["metadatas"].append(start, [
+                json.dumps(metadata or {}, ensure_ascii=False, default=str).encode("utf-8")
+                for metadata in metadatas
+            ])
+            self._payload.add(start, metadatas)
+
+            # 同一ID在已有数据或本批中出现多次时只保留最后一次
+            self._alive[start:end] = 1
+            for offset, doc_id in enumerate(ids):
+                previous = id_rows.get(doc_id)
+                if previous is not None:
+                    self._alive[previous] = 0
+                id_rows[doc_id] = start + offset
+
+            self._flush()
+            self._meta["count"] = end
+            self._write_meta()
+            self._version += 1
+            self._maybe_compact()
+
+        self._maybe_train_pq()
+        self._maybe_build_ivf()
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """按ID删除（标记删除，删除行过半时压缩文件）"""
+        if not ids:
+            return True
+        with self._lock:
+            if self._meta["dim"] is None:
+                return True
+            id_rows = self._load_id_rows()
+            for doc_id in ids:
+                row = id_rows.pop(str(doc_id), None)
+                if row is not None:
+                    self._alive[row] = 0
+            self._flush()
+            self._version += 1
+            self._maybe_compact()
+        return True
+
+    def _flush(self):
+        for array in (self._vectors, self._scales, self._full, self._alive):
+            if array is not None:
+                array.flush()
+
+    def _maybe_compact(self):
+        count = self._meta["count"]
+        if count >= _MIN_CAPACITY and self.count() < count / 2:
+            self.compact()
+
+    def compact(self):
+        """重写索引文件，去掉已删除的行；已有的 IVF 会在压缩后重建"""
+        with self._lock:
+            count = self._meta["count"]
+            if not count:
+                return
+            alive = np.flatnonzero(self._alive[:count])
+            temp_dir = self._path("compact.tmp")
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            target = LocalVectorStore(temp_dir, self._embedding, dtype=self.dtype, index_type="exact",
+                                      index_fields=self._payload.fields)
+            target._meta.update({key: value for key, value in self._meta.items()
+                                 if key in ("dim", "source_dim", "dims", "full", "pq")})
+            target._open_arrays(max(_MIN_CAPACITY, len(alive)))
+
+            block = _block_rows(self._meta["dim"])
+            for start in range(0, len(alive), block):
+                rows = alive[start:start + block]
+                end = start + len(rows)
+                target._vectors[start:end] = self._vectors[rows]
+                if self.dtype == "int8":
+                    target._scales[start:end] = self._scales[rows]
+                if self._full is not None:
+                    target._full[start:end] = self._full[rows]
+                target._alive[start:end] = 1
+                for name, column in self._columns.items():
+                    values = [column.read(int(row)) for row in rows]
+                    target._columns[name].append(start, values)
+                    if name == "metadatas":
+                        target._payload.add(start, [json.loads(value) for value in values])
+            target._flush()
+            target._meta["count"] = len(alive)
+            if target._meta.get("pq"):
+                target._meta["pq"] = dict(target._meta["pq"], trained=min(self._meta["pq"]["trained"], len(alive)))
+            target._write_meta()
+            target._close()
+
+            rebuild = self._ivf is not None
+            self._close()
+            for name in os.listdir(temp_dir):
+                os.replace(os.path.join(temp_dir, name), self._path(name))
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            for name in ("ivf_centroids.npy", "ivf_rows.npy", "ivf_offsets.npy"):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+
+            self._meta = self._read_meta()
+            self._columns = {name: _Column(self.directory, name) for name in _COLUMNS}
+            self._payload = PayloadIndex(self._path(_PAYLOAD_FILE), self._payload.fields)
+            self._open_arrays(self._meta["capacity"])
+            self._id_rows = None
+            self._ivf = None
+            self._pq = self._load_pq()
+            self._version += 1
+            print(f"本地向量库已压缩: {count} 行 -> {len(alive)} 行")
+        if rebuild:
+            self.build_ivf()
+
+    def _close(self):
+        for column in self._columns.values():
+            column.close()
+        self._payload.close()
+        if self._full_file is not None:
+            self._full_file.close()
+            self._full_file = None
+        self._vectors = self._scales = self._full = self._alive = None
+
+    def delete_collection(self):
+        """删除全部索引文件"""
+        with self._lock:
+            self._close()
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
+            pq = self._meta.get("pq")
+            self._meta = self._new_meta(self.dtype, self._meta.get("dims") or 0, pq["subvectors"] if pq else 0)
+            self._columns = {name: _Column(self.directory, name) for name in _COLUMNS}
+            self._payload = PayloadIndex(self._path(_PAYLOAD_FILE), self._payload.fields)
+            self._id_rows = None
+            self._ivf = None
+            self._pq = None
+            self._version += 1
+
+    # ---------- IVF ----------
+
+    def _use_ivf(self) -> bool:
+        if self.index_type == "exact":
+            return False
+        if self.index_type == "ivf":
+            return True
+        return self.count() >= self.ivf_min_rows
+
+    def _maybe_build_ivf(self):
+        if not self._use_ivf():
+            return
+        count = self._meta["count"]
+        if self._ivf is None or count - self._ivf["indexed"] > self._ivf["indexed"] / 2:
+            self.build_ivf()
+
+    def _code_vectors(self, rows) -> np.ndarray:
+        """检索空间中的 float32 向量：有全精度向量时由其截断得到，否则反量化"""
+        if self._full is not None:
+            return self._truncate(np.asarray(self._full[rows]))
+        vectors = self._vectors[rows].astype(np.float32)
+        if self.dtype == "int8":
+            vectors *= self._scales[rows][:, None]
+        return vectors
+
+    def build_ivf(self, iterations: int = 10, seed: int = 0):
+        """
+        用球面 k-means 训练簇中心，并把所有未删除的行分配到最近的簇
+
+        iterations: k-means 迭代次数
+        seed: 随机种子
+        """
+        with self._build_lock:
+            with self._lock:
+                count = self._meta["count"]
+                alive = np.flatnonzero(self._alive[:count]) if count else np.array([], dtype=np.int64)
+            if not len(alive):
+                return
+
+            rng = np.random.default_rng(seed)
+            nlist = self.nlist or int(np.sqrt(len(alive)))
+            nlist = max(1, min(nlist, len(alive)))
+            # 每个簇约 64 个训练样本足以得到稳定的中心
+            sample = np.sort(rng.choice(alive, size=min(len(alive), nlist * 64), replace=False))
+            data = _normalize(self._code_vectors(sample))
+            centroids = data[rng.choice(len(data), size=nlist, replace=False)]
+
+            block = _block_rows(max(self._meta["dim"], nlist))
+            for _ in range(iterations):
+                assign = np.concatenate([
+                    np.argmax(data[i:i + block] @ centroids.T, axis=1)
+                    for i in range(0, len(data), block)
+                ])
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, data)
+                empty = np.bincount(assign, minlength=nlist) == 0
+                # 空簇重新随机取一个样本作为中心
+                sums[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+                centroids = _normalize(sums)
+
+            assign = np.concatenate([
+                np.argmax(self._code_vectors(alive[i:i + block]) @ centroids.T, axis=1)
+                for i in range(0, len(alive), block)
+            ])
+            order = np.argsort(assign, kind="stable")
+            rows = alive[order].astype(np.int64)
+            offsets = np.searchsorted(assign[order], np.arange(nlist + 1)).astype(np.int64)
+
+            for name, array in (("ivf_centroids.npy", centroids.astype(np.float32)),
+                                ("ivf_rows.npy", rows), ("ivf_offsets.npy", offsets)):
+                with open(self._path(name + ".tmp"), "wb") as f:
+                    np.save(f, array)
+                os.replace(self._path(name + ".tmp"), self._path(name))
+
+            with self._lock:
+                self._meta["ivf"] = {"nlist": nlist, "indexed": count}
+                self._write_meta()
+                self._ivf = self._load_ivf()
+            print(f"本地向量库已建立 IVF 索引: {len(alive)} 行, {nlist} 个簇")
+
+    # ---------- PQ ----------
+
+    @staticmethod
+    def _pq_encode(vectors: np.ndarray, codebooks: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+        """每个子向量（bounds 为各子向量的起止维度）编码为码本中最近的中心的下标"""
+        codes = np.empty((len(vectors), len(bounds) - 1), dtype=np.uint8)
+        for j, codebook in enumerate(codebooks):
+            codebook = codebook[:, :bounds[j + 1] - bounds[j]]
+            distances = vectors[:, bounds[j]:bounds[j + 1]] @ codebook.T - 0.5 * (codebook ** 2).sum(axis=1)
+            codes[:, j] = np.argmax(distances, axis=1)
+        return codes
+
+    @staticmethod
+    def _pq_tables(queries: np.ndarray, codebooks: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+        """查询的每个子向量与对应码本各中心的内积：(查询数, 子向量数, 码本大小)"""
+        return np.stack([
+            queries[:, bounds[j]:bounds[j + 1]] @ codebook[:, :bounds[j + 1] - bounds[j]].T
+            for j, codebook in enumerate(codebooks)
+        ], axis=1)
+
+    def _maybe_train_pq(self):
+        if self.dtype == "pq" and self._pq is None and self._meta["count"] >= _PQ_TRAIN_ROWS:
+            self.train_pq()
+
+    def train_pq(self, iterations: int = 10, seed: int = 0):
+        """
+        在全精度向量的采样上训练各子空间的码本（k-means），然后重新编码所有行
+
+        iterations: k-means 迭代次数
+        seed: 随机种子
+        """
+        if self.dtype != "pq":
+            return
+        with self._build_lock:
+            with self._lock:
+                count = self._meta["count"]
+                alive = np.flatnonzero(self._alive[:count]) if count else np.array([], dtype=np.int64)
+            if not len(alive):
+                return
+
+            rng = np.random.default_rng(seed)
+            # 采样数同时受临时内存限制（高维时减少采样）
+            limit = max(_PQ_CENTROIDS * 16, _BLOCK_ELEMENTS // self._meta["dim"])
+            sample = np.sort(rng.choice(alive, size=min(len(alive), _PQ_SAMPLE_ROWS, limit), replace=False))
+            data = self._code_vectors(sample)
+            bounds = _balanced_bounds(data.var(axis=0), self._meta["pq"]["subvectors"])
+            width = int(np.diff(bounds).max())
+            codebooks = np.zeros((len(bounds) - 1, _PQ_CENTROIDS, width), dtype=np.float32)
+            centroids = min(_PQ_CENTROIDS, len(sample))
+            for j in range(len(bounds) - 1):
+                codebooks[j, :centroids, :bounds[j + 1] - bounds[j]] = _kmeans(
+                    data[:, bounds[j]:bounds[j + 1]], centroids, iterations, rng)
+            with open(self._path("pq_codebooks.npy.tmp"), "wb") as f:
+                np.save(f, codebooks)
+
+            # 编码期间持锁，使并发写入的新行用新码本编码；首次训练时编码完成前检索使用全精度向量，
+            # 重新训练期间的检索可能短暂混用新旧编码
+            with self._lock:
+                count = self._meta["count"]
+                block = _block_rows(self._meta["dim"])
+                for start in range(0, count, block):
+                    end = min(count, start + block)
+                    self._vectors[start:end] = self._pq_encode(self._code_vectors(slice(start, end)),
+                                                               codebooks, bounds)
+                self._flush()
+                os.replace(self._path("pq_codebooks.npy.tmp"), self._path("pq_codebooks.npy"))
+                self._meta["pq"].update({"trained": count, "bounds": bounds.tolist()})
+                self._write_meta()
+                self._pq = {"codebooks": codebooks, "bounds": bounds}
+            print(f"本地向量库已训练 PQ 码本: {len(sample)} 个样本, {len(bounds) - 1} 个子向量")
+
+    # ---------- 检索 ----------
+
+    def _score_rows(self, queries: np.ndarray, rows) -> np.ndarray:
+        """计算查询与指定行（切片或行号数组）的余弦相似度，已删除的行得分为 -inf"""
+        vectors = self._vectors[rows]
+        if self.dtype == "int8":
+            # 整块转换会产生与块同样大小的临时数组，分段转换后再相乘快数倍
+            scores = np.empty((len(queries), len(vectors)), dtype=np.float32)
+            step = max(1, _CAST_ELEMENTS // vectors.shape[1])
+            buffer = np.empty((min(step, len(vectors)), vectors.shape[1]), dtype=np.float32)
+            for start in range(0, len(vectors), step):
+                part = buffer[:len(vectors[start:start + step])]
+                np.copyto(part, vectors[start:start + step], casting="unsafe")
+                scores[:, start:start + len(part)] = queries @ part.T
+            scores *= self._scales[rows]
+        elif self.dtype == "pq":
+            pq = self._pq
+            if pq is None:
+                scores = queries @ self._code_vectors(rows).T
+            else:
+                # 非对称距离：查询的每个子向量与码本中各中心的内积查表后按编码相加；
+                # 相邻两个子向量合并为 65536 项的表，按 uint16 读取编码，查表次数减半
+                tables = self._pq_tables(queries, pq["codebooks"], pq["bounds"])
+                codes = np.ascontiguousarray(vectors)
+                pairs = codes.shape[1] // 2
+                paired = codes[:, :pairs * 2].view(np.uint16)
+                scores = np.zeros((len(queries), len(codes)), dtype=np.float32)
+                for i, table in enumerate(tables):
+                    for j in range(pairs):
+                        low, high = table[2 * j], table[2 * j + 1]
+                        if sys.byteorder == "big":
+                            low, high = high, low
+                        scores[i] += np.take((low[None, :] + high[:, None]).ravel(), paired[:, j])
+                    if codes.shape[1] % 2:
+                        scores[i] += np.take(table[-1], codes[:, -1])
+        else:
+            scores = queries @ vectors.T
+        scores[:, self._alive[rows] == 0] = -np.inf
+        return scores
+
+    def _search_exact(self, queries: np.ndarray, k: int, count: int, mask: Optional[np.ndarray] = None):
+        """按块扫描全部行；mask 为满足过滤条件的行的布尔标记"""
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        block = _block_rows(self._meta["dim"])
+        for start in range(0, count, block):
+            end = min(count, start + block)
+            scores = self._score_rows(queries, slice(start, end))
+            if mask is not None:
+                scores[:, ~mask[start:end]] = -np.inf
+            scores, rows = _top_k(scores, np.arange(start, end), k)
+            best_scores, best_rows = _top_k(np.hstack([best_scores, scores]), np.hstack([best_rows, rows]), k)
+        return best_scores, best_rows
+
+    def _search_rows(self, queries: np.ndarray, rows: np.ndarray, k: int):
+        """只扫描指定的行（升序行号）"""
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        size = _block_rows(self._meta["dim"])
+        for start in range(0, len(rows), size):
+            block = rows[start:start + size]
+            scores, block_rows = _top_k(self._score_rows(queries, block), block, k)
+            best_scores, best_rows = _top_k(np.hstack([best_scores, scores]), np.hstack([best_rows, block_rows]), k)
+        return best_scores, best_rows
+
+    def _search_ivf(self, query: np.ndarray, k: int, count: int, ivf: Dict[str, Any],
+                    mask: Optional[np.ndarray] = None):
+        centroid_scores = ivf["centroids"] @ query
+        nprobe = min(self.nprobe, len(centroid_scores))
+        probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        offsets = ivf["offsets"]
+        parts = [ivf["rows"][offsets[c]:offsets[c + 1]] for c in probes]
+        # 建立 IVF 之后写入的行不在任何簇中，精确扫描
+        parts.append(np.arange(ivf["indexed"], count, dtype=np.int64))
+        rows = np.sort(np.concatenate(parts))
+        if mask is not None:
+            rows = rows[mask[rows]]
+        return self._search_rows(query[None, :], rows, k)
+
+    def _filter_rows(self, where: Dict[str, Any], count: int, version: int) -> np.ndarray:
+        """满足过滤条件且未删除的行号（升序），count 与 version 为检索开始时的行数与版本"""
+        key = (version, json.dumps(where, sort_keys=True, ensure_ascii=False, default=str))
+        with self._lock:
+            if key in self._filter_cache:
+                self._filter_cache.move_to_end(key)
+                return self._filter_cache[key]
+
+        tree = parse(where)
+        if self._payload.covers(tree):
+            rows = self._payload.search(tree)
+            rows = rows[rows < count]
+        else:
+            # 条件涉及未建立索引的字段，逐行读取元数据判断
+            rows = np.array([
+                row for row in range(count)
+                if self._alive[row] and matches(tree, json.loads(self._columns["metadatas"].read(row)))
+            ], dtype=np.int64)
+        rows = rows[self._alive[rows] != 0]
+
+        with self._lock:
+            self._filter_cache[key] = rows
+            while len(self._filter_cache) > _FILTER_CACHE_SIZE:
+                self._filter_cache.popitem(last=False)
+        return rows
+
+    def _search_filtered(self, queries: np.ndarray, k: int, count: int, ivf: Optional[Dict[str, Any]],
+                         allowed: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        只在满足过滤条件的行（allowed）中检索
+
+        满足条件的行不多于本来要扫描的行数（IVF 探测的簇的行数；精确检索时按 1/8 计，按行号读取比连续扫描慢数倍）时
+        直接对这些行精确计算，耗时只取决于满足条件的行数；否则在 IVF 探测的簇中排除不满足条件的行
+        （结果不足 k 个时改为精确计算），或在精确扫描中排除
+        """
+        if not len(allowed):
+            return [(np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)) for _ in queries]
+        if ivf is not None:
+            nlist = len(ivf["centroids"])
+            scanned = count * min(self.nprobe, nlist) / nlist
+        else:
+            scanned = count / 8
+        if len(allowed) <= scanned:
+            scores, rows = self._search_rows(queries, allowed, k)
+            return list(zip(scores, rows))
+
+        mask = np.zeros(count, dtype=bool)
+        mask[allowed] = True
+        if ivf is None:
+            scores, rows = self._search_exact(queries, k, count, mask)
+            return list(zip(scores, rows))
+
+        pairs = []
+        for query in queries:
+            scores, rows = self._search_ivf(query, k, count, ivf, mask)
+            if np.isfinite(scores[0]).sum() < min(k, len(allowed)):
+                scores, rows = self._search_rows(query[None, :], allowed, k)
+            pairs.append((scores[0], rows[0]))
+        return pairs
+
+    def _read_full(self, rows: np.ndarray) -> np.ndarray:
+        """
+        按行读取全精度向量
+
+        重排的候选行随机分布，通过内存映射读取时每次缺页会把相邻的页也映射进进程，常驻内存随之膨胀，
+        因此逐行读取文件，只有候选行进入内存
+        """
+        size = self._source_dim * 4
+        buffer = bytearray(size * len(rows))
+        view = memoryview(buffer)
+        with self._full_lock:
+            for i, row in enumerate(rows):
+                self._full_file.seek(int(row) * size)
+                self._full_file.readinto(view[i * size:(i + 1) * size])
+        return np.frombuffer(buffer, dtype=np.float32).reshape(len(rows), self._source_dim)
+
+    def _rescore(self, query: np.ndarray, scores: np.ndarray, rows: np.ndarray, k: int):
+        """用全精度向量重新计算候选的相似度，返回前 k 个 (得分, 行号)"""
+        rows = np.sort(rows[np.isfinite(scores)])
+        if not len(rows):
+            return scores[:0], rows
+        exact = self._read_full(rows) @ query
+        scores, rows = _top_k(exact[None, :], rows, k)
+        return scores[0], rows[0]
+
+    def _document(self, row: int) -> Document:
+        return Document(
+            id=self._columns["ids"].read(row).decode("utf-8"),
+            page_content=self._columns["texts"].read(row).decode("utf-8"),
+            metadata=json.loads(self._columns["metadatas"].read(row))
+        )
+
+    def search_by_vectors_with_score(self, embeddings: List[List[float]], k: int,
+                                     filter: Optional[Dict[str, Any]] = None) -> List[List[Tuple[Document, float]]]:
+        """
+        批量向量检索
+
+        embeddings: 查询向量列表
+        k: 每个查询返回的文档数量
+        filter: 元数据过滤条件（Chroma where 语法，见 app/rag/filters.py）
+
+        returns: 每个查询的 [(文档, 余弦相似度), ...]，按相似度降序
+        """
+        if not embeddings:
+            return []
+        with self._lock:
+            count = self._meta["count"]
+            version = self._version
+            ivf = self._ivf if self.index_type != "exact" else None
+        if not count or k <= 0:
+            return [[] for _ in embeddings]
+
+        full_queries = _normalize(np.asarray(embeddings, dtype=np.float32))
+        queries = self._truncate(full_queries)
+        rescore = self.rescore if self._full is not None else 0
+        candidates = k * rescore if rescore else k
+        if filter:
+            pairs = self._search_filtered(queries, candidates, count, ivf, self._filter_rows(filter, count, version))
+        elif ivf is not None:
+            results = [self._search_ivf(query, candidates, count, ivf) for query in queries]
+            pairs = [(scores[0], rows[0]) for scores, rows in results]
+        else:
+            scores, rows = self._search_exact(queries, candidates, count)
+            pairs = list(zip(scores, rows))
+        if rescore:
+            pairs = [self._rescore(query, scores, rows, k) for query, (scores, rows) in zip(full_queries, pairs)]
+
+        return [
+            [(self._document(int(row)), float(score)) for score, row in zip(scores, rows) if np.isfinite(score)]
+            for scores, rows in pairs
+        ]
+
+    def similarity_search_by_vectors(self, embeddings: List[List[float]], k: int = 4,
+                                     filter: Optional[Dict[str, Any]] = None) -> List[List[Document]]:
+        """批量向量检索，只返回文档"""
+        return [[doc for doc, _ in results] for results in self.search_by_vectors_with_score(embeddings, k, filter)]
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict[str, Any]] = None,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.search_by_vectors_with_score([embedding], k, filter)[0]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # 余弦相似度 [-1, 1] 映射到相关度 [0, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    # ---------- 读取与统计 ----------
+
+    def count(self) -> int:
+        """未删除的行数"""
+        with self._lock:
+            count = self._meta["count"]
+            return int(np.count_nonzero(self._alive[:count])) if count else 0
+
+    def get_by_ids(self, ids: List[str]) -> List[Document]:
+        with self._lock:
+            if self._meta["dim"] is None:
+                return []
+            id_rows = self._load_id_rows()
+            rows = [id_rows[doc_id] for doc_id in ids if doc_id in id_rows]
+        return [self._document(row) for row in rows]
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, offset: int = 0,
+            include: Optional[List[str]] = None, **kwargs: Any) -> Dict[str, Any]:
+        """
+        分页读取文档，返回格式与 Chroma.get 相同
+
+        ids: 只读取这些ID，不传时按写入顺序读取全部
+        where: 元数据过滤条件
+        limit: 最多返回的数量
+        offset: 跳过的数量
+        include: 返回的字段，可选 documents、metadatas、embeddings
+
+        returns: {"ids": [...], "documents": [...], "metadatas": [...], ...}
+        """
+        include = include or ["documents", "metadatas"]
+        with self._lock:
+            count = self._meta["count"]
+            if ids is not None:
+                id_rows = self._load_id_rows() if self._meta["dim"] is not None else {}
+                rows = [id_rows[doc_id] for doc_id in ids if doc_id in id_rows]
+            elif where:
+                rows = self._filter_rows(where, count, self._version).tolist() if count else []
+            else:
+                rows = np.flatnonzero(self._alive[:count]).tolist() if count else []
+        if ids is not None and where:
+            tree = parse(where)
+            rows = [row for row in rows if matches(tree, json.loads(self._columns["metadatas"].read(row)))]
+        rows = rows[offset:offset + limit if limit is not None else None]
+
+        result: Dict[str, Any] = {"ids": [self._columns["ids"].read(row).decode("utf-8") for row in rows]}
+        if "documents" in include:
+            result["documents"] = [self._columns["texts"].read(row).decode("utf-8") for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(self._columns["metadatas"].read(row)) for row in rows]
+        if "embeddings" in include:
+            rows = np.asarray(rows, dtype=np.int64)
+            vectors = self._full[rows] if self._full is not None else self._code_vectors(rows)
+            # 与 Chroma 一致，返回 (行数, 维度) 的数组
+            result["embeddings"] = np.asarray(vectors, dtype=np.float32)
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ivf = self._meta.get("ivf")
+            # 检索时扫描的每行字节数（int8 含缩放系数），不含只在重排时读取的全精度向量
+            code_bytes = self._vectors.itemsize * self._vectors.shape[1] if self._vectors is not None else 0
+            if self.dtype == "int8" and code_bytes:
+                code_bytes += 4
+            return {
+                "rows": self._meta["count"],
+                "count": self.count(),
+                "dim": self._meta["dim"],
+                "dtype": self.dtype,
+                "source_dim": self._source_dim,
+                "bytes_per_row": code_bytes,
+                "full_vectors": bool(self._meta.get("full")),
+                "pq_subvectors": self._meta["pq"]["subvectors"] if self._meta.get("pq") else 0,
+                "ivf_lists": ivf["nlist"] if ivf else 0,
+                "ivf_indexed": ivf["indexed"] if ivf else 0,
+                "index_fields": list(self._payload.fields)
+            }
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, *,
+                   ids: Optional[List[str]] = None, persist_directory: Optional[str] = None,
+                   **kwargs: Any) -> "LocalVectorStore":
+        if persist_directory is None:
+            raise ValueError("LocalVectorStore 需要指定 persist_directory")
+        store = cls(persist_directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
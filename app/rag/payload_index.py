@@ -0,0 +1,152 @@
+# 本地向量库的元数据索引
+# 把指定字段的 (字段, 值, 行号) 存入 SQLite 的 B 树（列表字段的每个元素各一条），过滤条件直接按索引查出满足条件的行号，
+# 查询耗时只与满足条件的行数有关，与集合大小无关；行号与向量文件一致，已删除的行由向量库的删除标记排除
+
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.rag.filters import fields as filter_fields
+
+_SQL_OPERATORS = {"$eq": "=", "$contains": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def _indexable(value: Any) -> bool:
+    return isinstance(value, (str, int, float, bool))
+
+
+def _sorted_unique(rows: np.ndarray) -> np.ndarray:
+    """排序去重；取回的行号大多已是有序的若干段，稳定排序（归并）几乎不耗时，比 np.unique 快得多"""
+    rows.sort(kind="stable")
+    if len(rows) > 1:
+        rows = rows[np.concatenate(([True], rows[1:] != rows[:-1]))]
+    return rows
+
+
+def _intersect(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """两个升序且无重复的行号数组的交集"""
+    if len(a) > len(b):
+        a, b = b, a
+    if not len(a):
+        return a
+    index = np.minimum(np.searchsorted(b, a), len(b) - 1)
+    return a[b[index] == a]
+
+
+class PayloadIndex:
+    def __init__(self, index_path: str, fields: Sequence[str]):
+        """
+        index_path: SQLite 索引文件路径
+        fields: 建立索引的元数据字段，已有索引时沿用索引的设置
+        """
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(index_path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS payload (
+                key TEXT NOT NULL,
+                value NOT NULL,
+                row INTEGER NOT NULL,
+                PRIMARY KEY (key, value, row)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS state (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+        stored = self._state("fields")
+        if stored is None:
+            self.fields = list(dict.fromkeys(fields))
+            self._conn.execute("INSERT INTO state VALUES ('fields', ?)", (",".join(self.fields),))
+            self._conn.execute("INSERT INTO state VALUES ('rows', '0')")
+            self._conn.commit()
+        else:
+            self.fields = [field for field in stored.split(",") if field]
+            if list(fields) != self.fields:
+                print(f"本地向量库的元数据索引已按字段 {self.fields} 建立，忽略配置的 {list(fields)}")
+
+    def _state(self, name: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    @property
+    def rows(self) -> int:
+        """已建立索引的行数"""
+        with self._lock:
+            return int(self._state("rows"))
+
+    def _entries(self, start_row: int, metadatas: List[Dict[str, Any]]):
+        for offset, metadata in enumerate(metadatas):
+            for field in self.fields:
+                value = (metadata or {}).get(field)
+                for item in (value if isinstance(value, list) else [value]):
+                    if _indexable(item):
+                        yield field, item, start_row + offset
+
+    def add(self, start_row: int, metadatas: List[Dict[str, Any]]):
+        """
+        为 start_row 开始的各行建立索引
+
+        start_row: 起始行号
+        metadatas: 各行的元数据
+        """
+        with self._lock:
+            if int(self._state("rows")) != start_row:
+                # 上次写入中断（或向量库回退了行数），清掉起始行之后的旧条目
+                self._conn.execute("DELETE FROM payload WHERE row >= ?", (start_row,))
+            self._conn.executemany("INSERT OR IGNORE INTO payload VALUES (?, ?, ?)",
+                                   self._entries(start_row, metadatas))
+            self._conn.execute("UPDATE state SET value = ? WHERE name = 'rows'", (str(start_row + len(metadatas)),))
+            self._conn.commit()
+
+    def covers(self, tree: Tuple) -> bool:
+        """条件中的字段是否都建立了索引"""
+        return filter_fields(tree) <= set(self.fields)
+
+    @staticmethod
+    def _compile(tree: Tuple) -> Tuple[str, List[Any]]:
+        """单个字段条件的 SQL"""
+        _, key, operator, operand = tree
+        if operator in ("$in", "$nin"):
+            condition = f"value {'NOT ' if operator == '$nin' else ''}IN ({','.join('?' * len(operand))})"
+            params = list(operand)
+        else:
+            condition = f"value {_SQL_OPERATORS[operator]} ?"
+            params = [operand]
+            if operator in ("$gt", "$gte", "$lt", "$lte"):
+                # 字符串只与字符串比较，数值只与数值比较
+                condition += " AND typeof(value) " + ("= 'text'" if isinstance(operand, str) else "IN ('integer', 'real')")
+        return f"SELECT row FROM payload WHERE key = ? AND {condition}", [key] + params
+
+    def search(self, tree: Tuple) -> np.ndarray:
+        """
+        查询满足条件的行号
+
+        tree: filters.parse 返回的语法树，字段须都已建立索引
+
+        returns: 升序排列的行号（含已删除的行）
+        """
+        kind = tree[0]
+        if kind in ("and", "or"):
+            # 各字段分别查询后在 NumPy 中求交集或并集，比 SQLite 的 INTERSECT/UNION 快
+            parts = [self.search(child) for child in tree[1]]
+            if kind == "or":
+                return _sorted_unique(np.concatenate(parts))
+            rows = parts[0]
+            for part in parts[1:]:
+                rows = _intersect(rows, part)
+            return rows
+
+        sql, params = self._compile(tree)
+        with self._lock:
+            # 在 SQLite 中拼接为一个字符串再整体解析，比逐行取回快数倍
+            text = self._conn.execute(f"SELECT group_concat(row) FROM ({sql})", params).fetchone()[0]
+        return _sorted_unique(np.fromstring(text or "", dtype=np.int64, sep=","))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
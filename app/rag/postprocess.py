@@ -0,0 +1,158 @@
+# 检索后处理
+# 合并同一来源中相邻或重叠的文本块 -> 最大边际相关性（MMR）去冗余 -> 按词元预算打包上下文
+# 不依赖交叉编码器：相关度取检索排名，冗余度取词项集合的 Jaccard 相似度
+
+from typing import List, Optional
+
+from langchain_core.documents import Document
+
+from app.rag.sparse_index import tokenize
+from app.rag.tokens import count_tokens
+
+
+def _text_overlap(left: str, right: str, max_overlap: int) -> int:
+    """left 的后缀与 right 的前缀重合的最大长度"""
+    for size in range(min(len(left), len(right), max_overlap), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def merge_adjacent(docs: List[Document], max_overlap: int = 400) -> List[Document]:
+    """
+    合并同一来源、同一页中相邻或重叠的文本块，合并结果占据其中排名最靠前的位置
+
+    docs: 按相关度降序的文档列表
+    max_overlap: 无 start_index 元数据时按文本检测重叠的最大长度
+
+    returns: 合并后的文档列表
+    """
+    merged: List[Optional[Document]] = list(docs)
+
+    for i in range(len(merged)):
+        if merged[i] is None:
+            continue
+        changed = True
+        while changed:
+            changed = False
+            current = merged[i]
+            for j in range(len(merged)):
+                other = merged[j]
+                if j == i or other is None:
+                    continue
+                if current.metadata.get("source") != other.metadata.get("source") or \
+                        current.metadata.get("page") != other.metadata.get("page"):
+                    continue
+
+                combined = _combine(current, other, max_overlap) or _combine(other, current, max_overlap)
+                if combined is not None:
+                    merged[i] = combined
+                    merged[j] = None
+                    changed = True
+                    break
+
+    return [doc for doc in merged if doc is not None]
+
+
+def _combine(first: Document, second: Document, max_overlap: int) -> Optional[Document]:
+    """second 紧接或重叠在 first 之后时返回拼接结果，否则返回 None"""
+    first_start = first.metadata.get("start_index")
+    second_start = second.metadata.get("start_index")
+
+    if first_start is not None and second_start is not None:
+        first_end = first_start + len(first.page_content)
+        if not first_start <= second_start <= first_end:
+            return None
+        skip = first_end - second_start
+        second_end = second_start + len(second.page_content)
+        if second_end <= first_end:
+            # second 完全包含在 first 中
+            return first
+        content = first.page_content + second.page_content[skip:]
+    else:
+        overlap = _text_overlap(first.page_content, second.page_content, max_overlap)
+        if overlap < 20:
+            return None
+        content = first.page_content + second.page_content[overlap:]
+
+    metadata = dict(first.metadata)
+    return Document(page_content=content, metadata=metadata, id=first.id)
+
+
+def mmr_select(docs: List[Document], k: int, lambda_mult: float = 0.7) -> List[Document]:
+    """
+    最大边际相关性选择：兼顾相关度（检索排名）与多样性（与已选文档的词项重合度）
+
+    docs: 按相关度降序的候选文档
+    k: 选择数量
+    lambda_mult: 相关度权重，1 表示只看相关度，0 表示只看多样性
+
+    returns: 选中的文档，保持选择顺序
+    """
+    if len(docs) <= 1:
+        return docs[:k]
+
+    term_sets = [set(tokenize(doc.page_content)) for doc in docs]
+    relevance = [1.0 - rank / len(docs) for rank in range(len(docs))]
+    selected: List[int] = []
+    remaining = list(range(len(docs)))
+
+    while remaining and len(selected) < k:
+        def score(i):
+            if not selected:
+                return relevance[i]
+            redundancy = max(
+                len(term_sets[i] & term_sets[j]) / (len(term_sets[i] | term_sets[j]) or 1)
+                for j in selected
+            )
+            return lambda_mult * relevance[i] - (1 - lambda_mult) * redundancy
+
+        best = max(remaining, key=score)
+        selected.append(best)
+        remaining.remove(best)
+
+    return [docs[i] for i in selected]
+
+
+def pack_context(docs: List[Document], token_budget: int) -> List[Document]:
+    """
+    按顺序放入文档直到用完词元预算；第一篇文档超出预算时截断
+
+    docs: 按优先级排序的文档
+    token_budget: 上下文词元预算，0 表示不限制
+
+    returns: 放入预算内的文档
+    """
+    if not token_budget:
+        return list(docs)
+
+    packed, used = [], 0
+    for doc in docs:
+        tokens = count_tokens(doc.page_content)
+        if used + tokens <= token_budget:
+            packed.append(doc)
+            used += tokens
+        elif not packed:
+            # 按比例截断，保证至少有一段上下文
+            keep = int(len(doc.page_content) * token_budget / tokens)
+            packed.append(Document(page_content=doc.page_content[:keep], metadata=doc.metadata, id=doc.id))
+            break
+    return packed
+
+
+def postprocess(docs: List[Document], k: int, token_budget: int = 0, lambda_mult: float = 0.7,
+                max_overlap: int = 400) -> List[Document]:
+    """
+    检索后处理：合并相邻重叠块、MMR 去冗余选出 k 篇、按词元预算打包
+
+    docs: 过量召回的候选文档，按相关度降序
+    k: 最终文档数量上限
+    token_budget: 上下文词元预算，0 表示不限制
+    lambda_mult: MMR 相关度权重
+    max_overlap: 按文本检测重叠的最大长度
+
+    returns: 处理后的文档列表
+    """
+    merged = merge_adjacent(docs, max_overlap=max_overlap)
+    selected = mmr_select(merged, k, lambda_mult=lambda_mult)
+    return pack_context(selected, token_budget)
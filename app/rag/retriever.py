@@ -1,22 +1,32 @@
 # 向量检索器
 
+import asyncio
+import json
 import os
-from typing import List, Dict, Any
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
 
 from langchain_core.documents import Document
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
 
 from config import Config
+from app import resources, tracing
+from app.rag.sparse_index import reciprocal_rank_fusion
 
 class VectorRetriever:
     def __init__(self):
-        """初始化向量检索器"""
-        self.embeddings = OpenAIEmbeddings(
-            model=Config.EMBEDDING_MODEL_NAME,
-            api_key=Config.OPENAI_API_KEY,
-            base_url=Config.OPENAI_BASE_URL
-        )
+        """初始化向量检索器，嵌入模型与数据库句柄从共享注册表获取"""
+        self.embeddings = resources.get_embeddings()
+        
+        # 调用计数，用于确认每个问题只嵌入、检索一次；服务与批量模式会在多个线程中检索，计数需加锁
+        self.stats = {
+            "embedding_calls": 0,
+            "searches": 0
+        }
+        self._stats_lock = threading.Lock()
+        
+        # 默认检索范围：未显式传入过滤条件的检索都限定在此范围内（Chroma where 语法，见 app/rag/filters.py）
+        self.scope: Optional[Dict[str, Any]] = None
         
         # 确保向量数据库目录存在
         os.makedirs(Config.VECTOR_DB_PATH, exist_ok=True)
@@ -28,32 +38,114 @@ class VectorRetriever:
         """初始化向量数据库"""
         try:
             # 检查是否已有数据库
-            if os.path.exists(os.path.join(Config.VECTOR_DB_PATH, "chroma.sqlite3")):
+            if resources.vector_store_exists():
                 print("加载已存在的向量数据库")
-                self.db = Chroma(
-                    persist_directory=Config.VECTOR_DB_PATH,
-                    embedding_function=self.embeddings
-                )
             else:
                 print("未找到已存在的向量数据库，将创建新的数据库")
-                self.db = Chroma(
-                    persist_directory=Config.VECTOR_DB_PATH,
-                    embedding_function=self.embeddings
-                )
+            self.db = resources.get_vector_store()
         except Exception as e:
             print(f"初始化向量数据库失败: {str(e)}")
             raise
+        
+        # 父段落存储：结构感知分割时检索命中子块，上下文取其父段落
+        self.docstore = resources.get_docstore()
+        
+        # 初始化BM25关键词索引
+        self.sparse_index = None
+        if Config.HYBRID_SEARCH:
+            self.sparse_index = resources.get_sparse_index()
+            self._backfill_sparse_index()
+    
+    def _backfill_sparse_index(self, page_size: int = 1000):
+        """关键词索引为空而向量库已有数据时（如升级前入库的数据），从向量库补建索引"""
+        if self.sparse_index.count() > 0:
+            return
+        
+        try:
+            total = self._count()
+            if total == 0:
+                return
+            
+            print(f"正在为已有的 {total} 个文档块建立关键词索引")
+            for offset in range(0, total, page_size):
+                page = self.db.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+                documents = [
+                    Document(page_content=content, metadata=metadata or {})
+                    for content, metadata in zip(page["documents"], page["metadatas"])
+                ]
+                self.sparse_index.add(page["ids"], documents)
+        except Exception as e:
+            print(f"建立关键词索引失败: {str(e)}")
+    
+    def _is_chroma(self) -> bool:
+        """Chroma 的计数与批量查询通过其底层集合完成，本地向量库直接提供对应方法"""
+        return hasattr(self.db, "_collection")
+    
+    def _count(self) -> int:
+        """向量库中的文档块数"""
+        if self._is_chroma():
+            return self.db._collection.count()
+        return self.db.count()
+    
+    def _record(self, name: str, count: int = 1):
+        """累加调用计数"""
+        with self._stats_lock:
+            self.stats[name] += count
+    
+    def get_stats(self) -> Dict[str, int]:
+        """
+        获取调用计数
+        
+        returns: 嵌入与检索次数
+        """
+        with self._stats_lock:
+            return dict(self.stats)
+    
+    def collection_version(self) -> str:
+        """
+        获取向量库版本标记，每次写入或删除后变化，用于使依赖检索结果的缓存失效
+        
+        returns: 版本标记，尚未写入过时为空字符串
+        """
+        try:
+            with open(os.path.join(Config.VECTOR_DB_PATH, "collection_version"), "r") as f:
+                return f.read().strip()
+        except OSError:
+            return ""
     
-    def add_documents(self, documents: List[Document]) -> Dict[str, Any]:
+    def scope_key(self) -> str:
         """
-        添加文档到向量数据库
+        当前检索范围的标记，与 collection_version 一起作为答案缓存的版本，不同范围下的回答互不命中
+
+        returns: 未限定范围时为空字符串
+        """
+        if not self.scope:
+            return ""
+        return "|" + json.dumps(self.scope, sort_keys=True, ensure_ascii=False)
+    
+    def _filter(self, filter: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """未传入过滤条件时使用默认检索范围"""
+        return filter if filter is not None else self.scope
+    
+    def _bump_version(self):
+        """更新向量库版本标记"""
+        with open(os.path.join(Config.VECTOR_DB_PATH, "collection_version"), "w") as f:
+            f.write(str(time.time_ns()))
+    
+    def add_documents(self, documents: List[Document], ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        添加文档到向量数据库，传入ids时按ID覆盖写入（upsert）
 
         documents: 文档列表
+        ids: 文档ID列表，与documents一一对应
         returns: 添加结果
         """
         try:
             # 添加文档
-            self.db.add_documents(documents)
+            ids = self.db.add_documents(documents, ids=ids)
+            if self.sparse_index is not None:
+                self.sparse_index.add(ids, documents)
+            self._bump_version()
             print(f"成功添加 {len(documents)} 个文档到向量数据库")
             
             return {
@@ -69,37 +161,353 @@ class VectorRetriever:
                 "count": 0
             }
     
-    def as_retriever(self, search_type: str = "similarity", k: int = Config.RETRIEVAL_K):
+    def add_embeddings(self, documents: List[Document], embeddings: Any, ids: List[str],
+                       index_sparse: bool = True) -> Dict[str, Any]:
+        """
+        写入已计算好向量的文档（如从快照导入），不调用嵌入模型，按ID覆盖写入
+        
+        documents: 文档列表
+        embeddings: 与documents一一对应的向量，列表或 (n, dim) 数组
+        ids: 文档ID列表
+        index_sparse: 是否同时写入 BM25 关键词索引，关键词索引另行整体载入时传 False
+        returns: 写入结果
+        """
+        try:
+            texts = [doc.page_content for doc in documents]
+            metadatas = [doc.metadata for doc in documents]
+            if self._is_chroma():
+                # Chroma 单次写入的条数有上限，且不接受空的元数据字典
+                batch_size = self.db._client.get_max_batch_size()
+                for start in range(0, len(documents), batch_size):
+                    end = start + batch_size
+                    self.db._collection.upsert(
+                        ids=ids[start:end],
+                        embeddings=embeddings[start:end],
+                        documents=texts[start:end],
+                        metadatas=[metadata or None for metadata in metadatas[start:end]]
+                    )
+            else:
+                self.db.add_embeddings(texts, embeddings, metadatas, ids=ids)
+            if self.sparse_index is not None and index_sparse:
+                self.sparse_index.add(ids, documents)
+            self._bump_version()
+            
+            return {
+                "success": True,
+                "count": len(documents)
+            }
+            
+        except Exception as e:
+            print(f"写入文档失败: {str(e)}")
+            return {
+                "success": False,
+                "error": str(e),
+                "count": 0
+            }
+    
+    def delete_documents(self, ids: List[str]) -> Dict[str, Any]:
+        """
+        按ID删除向量数据库中的文档
+
+        ids: 文档ID列表
+        returns: 删除结果
+        """
+        if not ids:
+            return {
+                "success": True,
+                "count": 0
+            }
+        
+        try:
+            self.db.delete(ids=ids)
+            if self.sparse_index is not None:
+                self.sparse_index.delete(ids)
+            self._bump_version()
+            return {
+                "success": True,
+                "count": len(ids)
+            }
+        except Exception as e:
+            print(f"删除文档失败: {str(e)}")
+            return {
+                "success": False,
+                "error": str(e),
+                "count": 0
+            }
+    
+    def add_parents(self, documents: List[Document], ids: List[str]) -> Dict[str, Any]:
+        """
+        写入父段落（不嵌入），应在引用它们的子块之前写入
+
+        documents: 父段落列表
+        ids: 父段落ID列表，与documents一一对应
+        returns: 写入结果
+        """
+        try:
+            self.docstore.add(ids, documents)
+            return {
+                "success": True,
+                "count": len(documents)
+            }
+        except Exception as e:
+            print(f"写入父段落失败: {str(e)}")
+            return {
+                "success": False,
+                "error": str(e),
+                "count": 0
+            }
+    
+    def delete_parents(self, source: str, keep: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        删除某个文件不再使用的父段落
+
+        source: 文件（相对于文档目录的路径）
+        keep: 文件当前版本的父段落ID，不传时删除该文件的全部父段落
+        returns: 删除结果
+        """
+        try:
+            return {
+                "success": True,
+                "count": self.docstore.delete_source(source, keep or [])
+            }
+        except Exception as e:
+            print(f"删除父段落失败: {str(e)}")
+            return {
+                "success": False,
+                "error": str(e),
+                "count": 0
+            }
+    
+    def parent_documents(self, docs: List[Document]) -> List[Document]:
+        """
+        把检索命中的子块替换为其父段落，同一父段落只保留排名最靠前的一次
+
+        docs: 按相关度降序的检索结果
+        returns: 父段落列表；没有父段落（按字符分割入库）或父段落缺失的文本块原样保留
+        """
+        parent_ids = [doc.metadata.get("parent_id") for doc in docs]
+        parents = self.docstore.get(parent_id for parent_id in parent_ids if parent_id)
+        
+        results, seen = [], set()
+        for doc, parent_id in zip(docs, parent_ids):
+            parent = parents.get(parent_id) if parent_id else None
+            if parent is None:
+                results.append(doc)
+            elif parent_id not in seen:
+                seen.add(parent_id)
+                results.append(parent)
+        return results
+    
+    def as_retriever(self, search_type: str = "similarity", k: int = Config.RETRIEVAL_K,
+                     filter: Optional[Dict[str, Any]] = None):
         """
         获取检索器
         
         search_type: 搜索类型
         k: 返回文档数量
+        filter: 元数据过滤条件，不传时使用默认检索范围
             
         returns: 检索器对象
         """
+        search_kwargs = {"k": k}
+        filter = self._filter(filter)
+        if filter:
+            search_kwargs["filter"] = filter
         return self.db.as_retriever(
             search_type=search_type,
-            search_kwargs={"k": k}
+            search_kwargs=search_kwargs
         )
     
-    def search(self, query: str, k: int = Config.RETRIEVAL_K) -> List[Document]:
+    def embed_query(self, query: str) -> List[float]:
+        """
+        计算查询向量
+
+        query: 查询字符串
+
+        returns: 查询向量
+        """
+        self._record("embedding_calls")
+        with tracing.span("embed_query") as span:
+            span.set_tokens(query)
+            return self.embeddings.embed_query(query)
+    
+    async def aembed_query(self, query: str) -> List[float]:
+        """异步计算查询向量"""
+        self._record("embedding_calls")
+        with tracing.span("embed_query") as span:
+            span.set_tokens(query)
+            return await self.embeddings.aembed_query(query)
+    
+    def _keyword_search(self, query: str, candidates: int, k: int,
+                        filter: Optional[Dict[str, Any]]) -> Tuple[List[Document], List[Document]]:
+        """
+        BM25关键词检索
+        
+        只被关键词检索命中的文档在等权融合中排名偏低；查询中的编号类词项（如线路号、型号）
+        只在检索范围内不超过 k 个文档中全部出现时，这些文档作为精确匹配排在融合结果之前（Config.HYBRID_EXACT_MATCH）
+        
+        returns: (关键词检索结果, 其中的精确匹配文档)
+        """
+        sparse = [doc for doc, _ in self.sparse_index.search(query, candidates, filter)]
+        exact = set(self.sparse_index.exact_matches(query, k, filter)) if Config.HYBRID_EXACT_MATCH else set()
+        return sparse, [doc for doc in sparse if doc.id in exact]
+    
+    @staticmethod
+    def _fuse(dense: List[Document], keyword: Tuple[List[Document], List[Document]], k: int) -> List[Document]:
+        """精确匹配在前，其余按倒数排名融合，关键词一路的权重为 Config.HYBRID_SPARSE_WEIGHT"""
+        sparse, exact = keyword
+        fused = reciprocal_rank_fusion([dense, sparse], k=k, rrf_k=Config.RRF_K,
+                                       weights=[1.0, Config.HYBRID_SPARSE_WEIGHT])
+        if not exact:
+            return fused
+        promoted = {doc.id for doc in exact}
+        return (exact + [doc for doc in fused if doc.id not in promoted])[:k]
+    
+    def search(self, query: str, k: int = Config.RETRIEVAL_K,
+               embedding: Optional[List[float]] = None,
+               filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """
+        搜索相关文档，启用混合检索时将向量检索与BM25关键词检索结果按倒数排名融合
+
+        query: 查询字符串
+        k: 返回文档数量
+        embedding: 已计算好的查询向量，传入时不再重复嵌入
+        filter: 元数据过滤条件（按来源、文件类型、入库时间、标签等，见 app/rag/filters.py），不传时使用默认检索范围
+            
+        returns: 相关文档列表
+        """
+        try:
+            filter = self._filter(filter)
+            if embedding is None:
+                embedding = self.embed_query(query)
+            self._record("searches")
+            
+            if self.sparse_index is None:
+                with tracing.span("vector_search", k=k):
+                    return self.db.similarity_search_by_vector(embedding, k=k, filter=filter)
+            
+            candidates = max(k, Config.HYBRID_CANDIDATES)
+            with tracing.span("vector_search", k=candidates):
+                dense = self.db.similarity_search_by_vector(embedding, k=candidates, filter=filter)
+            with tracing.span("keyword_search", k=candidates):
+                keyword = self._keyword_search(query, candidates, k, filter)
+            return self._fuse(dense, keyword, k)
+        except Exception as e:
+            print(f"搜索失败: {str(e)}")
+            return []
+    
+    async def asearch(self, query: str, k: int = Config.RETRIEVAL_K,
+                      embedding: Optional[List[float]] = None,
+                      filter: Optional[Dict[str, Any]] = None) -> List[Document]:
         """
-        搜索相关文档
+        异步搜索相关文档：BM25关键词检索不依赖查询向量，与查询嵌入同时进行
 
         query: 查询字符串
         k: 返回文档数量
+        embedding: 已计算好的查询向量，传入时不再重复嵌入
+        filter: 元数据过滤条件，不传时使用默认检索范围
             
         returns: 相关文档列表
         """
         try:
-            retriever = self.as_retriever(k=k)
-            docs = retriever.invoke(query)
-            return docs
+            filter = self._filter(filter)
+            candidates = max(k, Config.HYBRID_CANDIDATES)
+            sparse_task = None
+            if self.sparse_index is not None:
+                sparse_task = asyncio.ensure_future(
+                    asyncio.to_thread(self._keyword_search, query, candidates, k, filter)
+                )
+            
+            if embedding is None:
+                embedding = await self.aembed_query(query)
+            self._record("searches")
+            
+            if sparse_task is None:
+                with tracing.span("vector_search", k=k):
+                    return await self.db.asimilarity_search_by_vector(embedding, k=k, filter=filter)
+            
+            with tracing.span("vector_search", k=candidates):
+                dense = await self.db.asimilarity_search_by_vector(embedding, k=candidates, filter=filter)
+            # 关键词检索已与嵌入并行执行，这里只记录等待其结果的时间
+            with tracing.span("keyword_search", k=candidates):
+                keyword = await sparse_task
+            return self._fuse(dense, keyword, k)
         except Exception as e:
             print(f"搜索失败: {str(e)}")
             return []
     
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        批量计算查询向量，按词元预算合并为少量嵌入请求
+
+        queries: 查询字符串列表
+
+        returns: 查询向量列表，顺序与输入一致
+        """
+        self._record("embedding_calls")
+        with tracing.span("embed_query", batch=len(queries)) as span:
+            for query in queries:
+                span.set_tokens(query)
+            return self.embeddings.embed_documents(queries)
+    
+    def _dense_search_batch(self, embeddings: List[List[float]], k: int,
+                            filter: Optional[Dict[str, Any]] = None) -> List[List[Document]]:
+        """一次向量库查询完成多个查询向量的近邻检索"""
+        if not self._is_chroma():
+            return self.db.similarity_search_by_vectors(embeddings, k=k, filter=filter)
+        
+        result = self.db._collection.query(
+            query_embeddings=embeddings,
+            n_results=k,
+            where=filter,
+            include=["documents", "metadatas"]
+        )
+        return [
+            [
+                Document(page_content=content, metadata=metadata or {}, id=doc_id)
+                for doc_id, content, metadata in zip(ids, contents, metadatas)
+            ]
+            for ids, contents, metadatas in zip(result["ids"], result["documents"], result["metadatas"])
+        ]
+    
+    def search_batch(self, queries: List[str], k: int = Config.RETRIEVAL_K,
+                     embeddings: Optional[List[List[float]]] = None,
+                     filter: Optional[Dict[str, Any]] = None) -> List[List[Document]]:
+        """
+        批量搜索：所有查询一起嵌入，并在一次向量库查询中完成检索
+
+        queries: 查询字符串列表
+        k: 每个查询返回的文档数量
+        embeddings: 已计算好的查询向量，传入时不再重复嵌入
+        filter: 所有查询共用的元数据过滤条件，不传时使用默认检索范围
+
+        returns: 每个查询的相关文档列表
+        """
+        if not queries:
+            return []
+        try:
+            filter = self._filter(filter)
+            if embeddings is None:
+                embeddings = self.embed_queries(queries)
+            self._record("searches", len(queries))
+            
+            if self.sparse_index is None:
+                with tracing.span("vector_search", k=k, batch=len(queries)):
+                    return self._dense_search_batch(embeddings, k, filter)
+            
+            candidates = max(k, Config.HYBRID_CANDIDATES)
+            with tracing.span("vector_search", k=candidates, batch=len(queries)):
+                dense_lists = self._dense_search_batch(embeddings, candidates, filter)
+            with tracing.span("keyword_search", k=candidates, batch=len(queries)):
+                keyword_lists = [self._keyword_search(query, candidates, k, filter) for query in queries]
+            return [
+                self._fuse(dense, keyword, k)
+                for dense, keyword in zip(dense_lists, keyword_lists)
+            ]
+        except Exception as e:
+            print(f"批量搜索失败: {str(e)}")
+            return [[] for _ in queries]
+    
     def get_collection_info(self) -> Dict[str, Any]:
         """
         获取集合信息
@@ -107,11 +515,11 @@ class VectorRetriever:
         returns: 集合信息
         """
         try:
-            count = self.db._collection.count()
+            count = self._count()
             return {
                 "success": True,
                 "count": count,
-                "name": self.db._collection.name
+                "name": self.db._collection.name if self._is_chroma() else self.db.name
             }
         except Exception as e:
             print(f"获取集合信息失败: {str(e)}")
@@ -121,6 +529,37 @@ class VectorRetriever:
                 "count": 0
             }
     
+    def warm_up(self) -> Dict[str, Any]:
+        """
+        预热索引：用一条已存的向量在默认检索范围内检索一次，使 Chroma 把 HNSW 索引读入内存
+        （本地向量库读入向量文件与元数据索引），并让 BM25 关键词索引与父段落存储完成首次查询；不调用嵌入模型
+
+        returns: 预热结果，含耗时（秒）
+        """
+        start = time.perf_counter()
+        try:
+            with tracing.span("warm_up"):
+                count = self._count()
+                if count:
+                    embeddings = self.db.get(limit=1, include=["embeddings"]).get("embeddings")
+                    if embeddings is not None and len(embeddings):
+                        self.db.similarity_search_by_vector(list(embeddings[0]), k=1, filter=self.scope)
+                    if self.sparse_index is not None:
+                        self.sparse_index.search("warm up", 1, self.scope)
+                    self.docstore.count()
+            return {
+                "success": True,
+                "count": count,
+                "elapsed": time.perf_counter() - start
+            }
+        except Exception as e:
+            print(f"预热索引失败: {str(e)}")
+            return {
+                "success": False,
+                "error": str(e),
+                "elapsed": time.perf_counter() - start
+            }
+    
     def clear_collection(self) -> Dict[str, Any]:
         """
         清空集合
@@ -130,6 +569,11 @@ class VectorRetriever:
         try:
             # 删除集合
             self.db.delete_collection()
+            resources.discard_vector_store()
+            if self.sparse_index is not None:
+                self.sparse_index.clear()
+            self.docstore.clear()
+            self._bump_version()
             
             # 重新初始化
             self._init_db()
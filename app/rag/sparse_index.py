@@ -0,0 +1,278 @@
+# 稀疏关键词索引（BM25）
+# 入库时建立倒排索引并持久化到 SQLite，用于精确匹配编号、线路、人名等稠密检索容易遗漏的关键词
+
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from app.rag.filters import parse, to_sql
+
+# ASCII 单词与数字（允许中间带 . _ - ，如 3.14、K-12），以及连续的中日韩字符
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._\-][a-z0-9]+)*|[㐀-鿿豈-﫿]+")
+
+try:
+    import jieba
+    jieba.setLogLevel(60)
+except ImportError:
+    jieba = None
+
+
+# 当前的分词方式：倒排索引的词项由它决定，复制到别处的索引只能在分词方式相同时使用
+TOKENIZER = "jieba" if jieba is not None else "bigram"
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中文感知分词：安装了 jieba 时使用搜索引擎模式分词，否则中文按单字加二元组切分
+
+    text: 文本
+
+    returns: 词项列表
+    """
+    tokens = []
+    for match in _TOKEN_PATTERN.findall(text.lower()):
+        if match.isascii():
+            tokens.append(match)
+        elif jieba is not None:
+            tokens.extend(word for word in jieba.lcut_for_search(match) if word.strip())
+        else:
+            tokens.extend(match)
+            tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+    return tokens
+
+
+class SparseIndex:
+    def __init__(self, index_path: str, k1: float = 1.5, b: float = 0.75):
+        """
+        index_path: SQLite 索引文件路径
+        k1, b: BM25 参数
+        """
+        self.index_path = index_path
+        self.k1 = k1
+        self.b = b
+
+        directory = os.path.dirname(index_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(index_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS docs (
+                id TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings(doc_id);
+            """
+        )
+        self._conn.commit()
+
+    def count(self) -> int:
+        """索引中的文档数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def add(self, ids: List[str], documents: List[Document]):
+        """
+        添加或覆盖文档
+
+        ids: 文档ID列表
+        documents: 文档列表
+        """
+        with self._lock:
+            self._delete(ids)
+            doc_rows, posting_rows = [], []
+            for doc_id, doc in zip(ids, documents):
+                terms = Counter(tokenize(doc.page_content))
+                doc_rows.append((doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False),
+                                 sum(terms.values())))
+                posting_rows.extend((term, doc_id, tf) for term, tf in terms.items())
+            self._conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", doc_rows)
+            self._conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", posting_rows)
+            self._conn.commit()
+
+    def _delete(self, ids: List[str]):
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            self._conn.execute(f"DELETE FROM postings WHERE doc_id IN ({placeholders})", batch)
+            self._conn.execute(f"DELETE FROM docs WHERE id IN ({placeholders})", batch)
+
+    def delete(self, ids: List[str]):
+        """按ID删除文档"""
+        with self._lock:
+            self._delete(ids)
+            self._conn.commit()
+
+    def clear(self):
+        """清空索引"""
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM docs")
+            self._conn.commit()
+
+    def idf(self, terms: Iterable[str]) -> Dict[str, float]:
+        """
+        词项的 BM25 逆文档频率（与 search 的计分一致）
+
+        terms: 词项（tokenize 的结果）
+
+        returns: {词项: idf}，索引中没有的词项不返回
+        """
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+            weights = {}
+            for term in set(terms):
+                df = self._conn.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (term,)).fetchone()[0]
+                if df:
+                    weights[term] = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            return weights
+
+    def exact_matches(self, query: str, max_docs: int, where: Optional[Dict[str, Any]] = None) -> List[str]:
+        """
+        查询中的编号类词项（数字、型号、代码等 ASCII 词项）全部出现的文档
+
+        query: 查询字符串
+        max_docs: 文档数上限，匹配的文档更多时说明这些词项不足以区分文档，返回空列表
+        where: 元数据过滤条件（Chroma where 语法），只统计满足条件的文档
+
+        returns: 文档 id 列表，查询中没有编号类词项时为空
+        """
+        terms = sorted({term for term in tokenize(query) if term.isascii()})
+        if not terms:
+            return []
+
+        join, condition, params = "", "", []
+        if where:
+            sql, params = to_sql(parse(where), "d.metadata")
+            join, condition = " JOIN docs d ON d.id = p.doc_id", f" AND {sql}"
+
+        placeholders = ",".join("?" * len(terms))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT p.doc_id FROM postings p{join} WHERE p.term IN ({placeholders}){condition} "
+                "GROUP BY p.doc_id HAVING COUNT(*) = ? LIMIT ?",
+                terms + params + [len(terms), max_docs + 1]
+            ).fetchall()
+        return [] if len(rows) > max_docs else [doc_id for doc_id, in rows]
+
+    def dump(self, path: str):
+        """
+        把整个索引在线备份到另一个 SQLite 文件（如导出快照）
+
+        path: 目标文件路径
+        """
+        target = sqlite3.connect(path)
+        try:
+            with self._lock:
+                self._conn.backup(target)
+        finally:
+            target.close()
+
+    def load(self, path: str):
+        """
+        用 dump 得到的文件整体替换索引内容，按页复制，不重新分词和建立倒排
+
+        path: 源文件路径
+        """
+        source = sqlite3.connect(path)
+        try:
+            with self._lock:
+                source.backup(self._conn)
+        finally:
+            source.close()
+
+    def search(self, query: str, k: int, where: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """
+        BM25 检索
+
+        query: 查询字符串
+        k: 返回文档数量
+        where: 元数据过滤条件（Chroma where 语法），只对满足条件的文档计分
+
+        returns: (文档, 分数) 列表，按分数降序
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        condition, params = "", []
+        if where:
+            sql, params = to_sql(parse(where), "d.metadata")
+            condition = f" AND {sql}"
+
+        with self._lock:
+            total, total_length = self._conn.execute("SELECT COUNT(*), SUM(length) FROM docs").fetchone()
+            if not total:
+                return []
+            avg_length = total_length / total
+
+            scores: Dict[str, float] = {}
+            for term in terms:
+                rows = self._conn.execute(
+                    "SELECT p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.id = p.doc_id "
+                    f"WHERE p.term = ?{condition}",
+                    [term] + params
+                ).fetchall()
+                if not rows:
+                    continue
+                # 文档频率按全部文档统计，过滤不改变词项的权重
+                df = len(rows)
+                if where:
+                    df = self._conn.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (term,)).fetchone()[0]
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                for doc_id, tf, length in rows:
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+            top = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+            results = []
+            for doc_id, score in top:
+                content, metadata = self._conn.execute(
+                    "SELECT content, metadata FROM docs WHERE id = ?", (doc_id,)
+                ).fetchone()
+                results.append((Document(page_content=content, metadata=json.loads(metadata), id=doc_id), score))
+            return results
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Document]], k: int, rrf_k: int = 60,
+                           weights: Optional[List[float]] = None) -> List[Document]:
+    """
+    倒数排名融合：按 sum(weight / (rrf_k + rank)) 合并多路检索结果
+
+    result_lists: 各路检索结果，每路按相关度降序
+    k: 返回文档数量
+    rrf_k: 平滑常数
+    weights: 各路权重，默认均为1
+
+    returns: 融合后的文档列表
+    """
+    weights = weights or [1.0] * len(result_lists)
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+
+    for results, weight in zip(result_lists, weights):
+        for rank, doc in enumerate(results, start=1):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank)
+            docs.setdefault(key, doc)
+
+    ranked = sorted(scores, key=lambda key: -scores[key])[:k]
+    return [docs[key] for key in ranked]
@@ -0,0 +1,30 @@
+# 词元计数工具
+# 优先使用 tiktoken 精确计数，不可用时按字符估算（非ASCII字符约1个词元，ASCII字符约4个一个词元）
+
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """加载 tiktoken 编码器，失败时返回 None"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    计算文本的词元数
+
+    text: 文本
+
+    returns: 词元数
+    """
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
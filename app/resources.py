@@ -0,0 +1,218 @@
+# 共享资源注册表
+# HTTP 连接池、嵌入模型、向量数据库和聊天模型按配置作为键，在首次使用时创建，进程内共享同一实例
+
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from config import Config
+
+_lock = threading.RLock()
+_resources: Dict[Hashable, Any] = {}
+
+
+def _get_or_create(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """按键获取资源，不存在时调用 factory 创建"""
+    with _lock:
+        if key not in _resources:
+            _resources[key] = factory()
+        return _resources[key]
+
+
+def get_http_client():
+    """
+    获取共享的 HTTP 客户端：嵌入与聊天请求复用同一个保持长连接的连接池，避免每次请求重新握手
+
+    returns: httpx.Client 实例
+    """
+    def factory():
+        import httpx
+        return httpx.Client(
+            limits=httpx.Limits(
+                max_connections=Config.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(Config.HTTP_TIMEOUT, connect=10.0)
+        )
+
+    return _get_or_create(("http_client",), factory)
+
+
+def get_embeddings(model: Optional[str] = None):
+    """
+    获取共享的嵌入模型
+
+    model: 嵌入模型名称，默认使用 Config.EMBEDDING_MODEL_NAME
+
+    returns: 嵌入模型，OpenAIEmbeddings 外依次包装 ConcurrentEmbeddings（并发与重试）
+             和 CachedEmbeddings（启用嵌入缓存时）
+    """
+    model = model or Config.EMBEDDING_MODEL_NAME
+
+    def factory():
+        from langchain_openai import OpenAIEmbeddings
+        from app.rag.embedding_executor import ConcurrentEmbeddings
+        
+        # 重试由 ConcurrentEmbeddings 统一处理，以便根据限流调整并发
+        embeddings = OpenAIEmbeddings(
+            model=model,
+            api_key=Config.OPENAI_API_KEY,
+            base_url=Config.OPENAI_BASE_URL,
+            http_client=get_http_client(),
+            max_retries=0
+        )
+        embeddings = ConcurrentEmbeddings(
+            embeddings,
+            max_concurrency=Config.EMBEDDING_MAX_CONCURRENCY,
+            batch_tokens=Config.EMBEDDING_BATCH_TOKENS,
+            batch_size=Config.EMBEDDING_BATCH_SIZE,
+            max_retries=Config.EMBEDDING_MAX_RETRIES
+        )
+        if Config.EMBEDDING_CACHE_ENABLED:
+            from app.rag.embedding_cache import CachedEmbeddings
+            embeddings = CachedEmbeddings(
+                embeddings,
+                model_name=model,
+                cache_path=Config.EMBEDDING_CACHE_PATH,
+                max_entries=Config.EMBEDDING_CACHE_MAX_ENTRIES
+            )
+        return embeddings
+
+    return _get_or_create(("embeddings", model, Config.OPENAI_BASE_URL), factory)
+
+
+# 本地向量库的文件存放在 VECTOR_DB_PATH 下的子目录中
+LOCAL_INDEX_DIR = "local_index"
+
+
+def vector_store_exists(persist_directory: Optional[str] = None) -> bool:
+    """
+    检查向量数据库是否已创建（不加载数据库）
+
+    persist_directory: 持久化目录，默认使用 Config.VECTOR_DB_PATH
+
+    returns: 是否存在
+    """
+    persist_directory = persist_directory or Config.VECTOR_DB_PATH
+    if Config.VECTOR_DB_TYPE == "local":
+        return os.path.exists(os.path.join(persist_directory, LOCAL_INDEX_DIR, "index.json"))
+    return os.path.exists(os.path.join(persist_directory, "chroma.sqlite3"))
+
+
+def get_vector_store(persist_directory: Optional[str] = None):
+    """
+    获取共享的向量数据库句柄，类型由 Config.VECTOR_DB_TYPE 决定
+
+    persist_directory: 持久化目录，默认使用 Config.VECTOR_DB_PATH
+
+    returns: Chroma 或 LocalVectorStore 实例
+    """
+    persist_directory = persist_directory or Config.VECTOR_DB_PATH
+
+    def factory():
+        if Config.VECTOR_DB_TYPE == "local":
+            from app.rag.local_store import LocalVectorStore
+            return LocalVectorStore(
+                persist_directory=os.path.join(persist_directory, LOCAL_INDEX_DIR),
+                embedding_function=get_embeddings(),
+                dtype=Config.LOCAL_INDEX_DTYPE,
+                index_type=Config.LOCAL_INDEX_TYPE,
+                nprobe=Config.LOCAL_IVF_NPROBE,
+                ivf_min_rows=Config.LOCAL_IVF_MIN_ROWS,
+                nlist=Config.LOCAL_IVF_NLIST,
+                dims=Config.LOCAL_INDEX_DIMS,
+                pq_subvectors=Config.LOCAL_PQ_SUBVECTORS,
+                rescore=Config.LOCAL_INDEX_RESCORE,
+                index_fields=Config.LOCAL_INDEX_FIELDS
+            )
+        if Config.VECTOR_DB_TYPE != "chromadb":
+            raise ValueError(f"不支持的向量数据库类型: {Config.VECTOR_DB_TYPE}，可选 chromadb、local")
+        
+        from langchain_chroma import Chroma
+        return Chroma(
+            persist_directory=persist_directory,
+            embedding_function=get_embeddings()
+        )
+
+    return _get_or_create(_vector_store_key(persist_directory), factory)
+
+
+def _vector_store_key(persist_directory: str):
+    return ("vector_store", Config.VECTOR_DB_TYPE, persist_directory, Config.EMBEDDING_MODEL_NAME)
+
+
+def get_chat_model(model: Optional[str] = None, temperature: Optional[float] = None):
+    """
+    获取共享的聊天模型
+
+    model: 模型名称，默认使用 Config.MODEL_NAME
+    temperature: 采样温度，默认使用 Config.TEMPERATURE
+
+    returns: ChatOpenAI 实例
+    """
+    model = model or Config.MODEL_NAME
+    temperature = Config.TEMPERATURE if temperature is None else temperature
+
+    def factory():
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            api_key=Config.OPENAI_API_KEY,
+            base_url=Config.OPENAI_BASE_URL,
+            http_client=get_http_client()
+        )
+
+    return _get_or_create(("chat_model", model, temperature, Config.OPENAI_BASE_URL), factory)
+
+
+def get_sparse_index(index_path: Optional[str] = None):
+    """
+    获取共享的BM25关键词索引
+
+    index_path: 索引文件路径，默认使用 Config.SPARSE_INDEX_PATH
+
+    returns: SparseIndex 实例
+    """
+    index_path = index_path or Config.SPARSE_INDEX_PATH
+
+    def factory():
+        from app.rag.sparse_index import SparseIndex
+        return SparseIndex(index_path)
+
+    return _get_or_create(("sparse_index", index_path), factory)
+
+
+def get_docstore(index_path: Optional[str] = None):
+    """
+    获取共享的父段落存储
+
+    index_path: 存储文件路径，默认使用 Config.DOCSTORE_PATH
+
+    returns: DocStore 实例
+    """
+    index_path = index_path or Config.DOCSTORE_PATH
+
+    def factory():
+        from app.rag.docstore import DocStore
+        return DocStore(index_path)
+
+    return _get_or_create(("docstore", index_path), factory)
+
+
+def discard_vector_store(persist_directory: Optional[str] = None):
+    """
+    丢弃缓存的向量数据库句柄（例如删除集合后），下次获取时重新创建
+
+    persist_directory: 持久化目录，默认使用 Config.VECTOR_DB_PATH
+    """
+    persist_directory = persist_directory or Config.VECTOR_DB_PATH
+    with _lock:
+        _resources.pop(_vector_store_key(persist_directory), None)
+
+
+def clear():
+    """清空注册表中的全部资源"""
+    with _lock:
+        _resources.clear()
@@ -0,0 +1,340 @@
+# HTTP 问答服务
+# 常驻进程保持检索器与代理预热；相同的并发问题合并为一次上游调用；排队数有上限，过载时返回 503
+# 请求体超过 SERVER_MAX_BODY_BYTES 时返回 413，question 或 chat_history 格式错误时返回 400
+#
+# POST /ask      {"question": "...", "chat_history": [["user", "..."], ["assistant", "..."]]}
+# GET  /health   存活检查
+# GET  /metrics  请求数、合并数、拒绝数、排队深度与延迟分位数
+
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from config import Config
+from app import tracing
+from app.agents.qa_agent import QAAgent
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    计算分位数（最近秩法）
+
+    values: 数值列表
+    q: 分位，0~1
+
+    returns: 分位数，列表为空时返回 0
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def parse_chat_history(value) -> List[tuple]:
+    """
+    校验并转换请求中的聊天历史
+
+    value: 请求体中的 chat_history，应为 [[role, message], ...]，role 为 user 或 assistant
+
+    returns: [(role, message), ...]，格式错误时抛出 ValueError
+    """
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise ValueError("chat_history 应为列表")
+    history = []
+    for i, turn in enumerate(value):
+        if not isinstance(turn, (list, tuple)) or len(turn) != 2:
+            raise ValueError(f"chat_history[{i}] 应为 [role, message]")
+        role, message = turn
+        if role not in ("user", "assistant"):
+            raise ValueError(f"chat_history[{i}] 的 role 应为 user 或 assistant")
+        if not isinstance(message, str):
+            raise ValueError(f"chat_history[{i}] 的 message 应为字符串")
+        history.append((role, message))
+    return history
+
+
+class _Flight:
+    """一次正在进行的上游调用，相同问题的后续请求等待其结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[Exception] = None
+        self.waiters = 0
+
+
+class Overloaded(Exception):
+    """排队数已达上限"""
+
+
+class QAService:
+    def __init__(self, agent: QAAgent, concurrency: Optional[int] = None, queue_size: Optional[int] = None):
+        """
+        agent: 预热好的问答代理
+        concurrency: 同时处理的问题数，默认使用 Config.SERVER_CONCURRENCY
+        queue_size: 排队等待的问题数上限，默认使用 Config.SERVER_QUEUE_SIZE
+        """
+        self.agent = agent
+        self.concurrency = max(1, concurrency or Config.SERVER_CONCURRENCY)
+        self.queue_size = max(0, Config.SERVER_QUEUE_SIZE if queue_size is None else queue_size)
+
+        self._slots = threading.Semaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._running = 0
+        self._flights: Dict[str, _Flight] = {}
+        self._latencies = deque(maxlen=4096)
+        self._started = time.time()
+
+        self.stats = {
+            "requests": 0,
+            "completed": 0,
+            "coalesced": 0,
+            "rejected": 0,
+            "errors": 0
+        }
+
+    @staticmethod
+    def _flight_key(question: str, chat_history) -> Optional[str]:
+        """只有不带聊天历史的问题可以合并，键为规范化后的问题文本"""
+        if chat_history:
+            return None
+        return " ".join(question.split()).lower()
+
+    def _run(self, question: str, chat_history) -> Dict[str, Any]:
+        """在并发上限内调用代理；排队数超限时抛出 Overloaded"""
+        with self._lock:
+            if self._admitted >= self.concurrency + self.queue_size:
+                self.stats["rejected"] += 1
+                raise Overloaded()
+            self._admitted += 1
+
+        try:
+            with self._slots:
+                with self._lock:
+                    self._running += 1
+                try:
+                    return self.agent.invoke(question, chat_history)
+                finally:
+                    with self._lock:
+                        self._running -= 1
+        finally:
+            with self._lock:
+                self._admitted -= 1
+
+    def ask(self, question: str, chat_history=None) -> Dict[str, Any]:
+        """
+        回答问题，相同的并发问题只调用一次代理
+
+        question: 问题
+        chat_history: 聊天历史，格式为[(role, message), ...]
+
+        returns: 代理的结果字典，附带 coalesced 与 latency 字段
+        """
+        start = time.perf_counter()
+        key = self._flight_key(question, chat_history)
+
+        leader = True
+        with self._lock:
+            self.stats["requests"] += 1
+            flight = self._flights.get(key) if key is not None else None
+            if flight is not None:
+                leader = False
+                flight.waiters += 1
+                self.stats["coalesced"] += 1
+            else:
+                flight = _Flight()
+                if key is not None:
+                    self._flights[key] = flight
+
+        if leader:
+            try:
+                flight.result = self._run(question, chat_history)
+            except Exception as e:
+                flight.error = e
+                raise
+            finally:
+                if key is not None:
+                    with self._lock:
+                        self._flights.pop(key, None)
+                flight.done.set()
+        else:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+
+        result = dict(flight.result)
+        result["coalesced"] = not leader
+
+        latency = time.perf_counter() - start
+        result["latency"] = round(latency, 4)
+        with self._lock:
+            self.stats["completed"] += 1
+            if not result.get("success"):
+                self.stats["errors"] += 1
+            self._latencies.append(latency)
+        return result
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        获取服务指标
+
+        returns: 请求计数、在途与排队数、吞吐与延迟分位数（毫秒）以及代理调用统计
+        """
+        with self._lock:
+            metrics = dict(self.stats)
+            latencies = list(self._latencies)
+            metrics["running"] = self._running
+            metrics["queued"] = self._admitted - self._running
+            metrics["coalescing"] = len(self._flights)
+        uptime = time.time() - self._started
+        metrics["uptime"] = round(uptime, 1)
+        metrics["requests_per_second"] = round(metrics["completed"] / uptime, 2) if uptime else 0.0
+        metrics["p50_ms"] = round(percentile(latencies, 0.5) * 1000, 1)
+        metrics["p99_ms"] = round(percentile(latencies, 0.99) * 1000, 1)
+        metrics["agent"] = self.agent.get_stats()
+        if tracing.is_enabled():
+            metrics["profile"] = tracing.summary()
+        return metrics
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # 默认的监听队列只有 5，大量客户端同时建连时会被重置
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def _handler_class(service: QAService):
+    class Handler(BaseHTTPRequestHandler):
+        # HTTP/1.1 保持客户端长连接
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            if Config.DEBUG:
+                super().log_message(format, *args)
+
+        def _send(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+            data = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"status": "ok"})
+            elif self.path == "/metrics":
+                self._send(200, service.get_metrics())
+            else:
+                self._send(404, {"error": f"未知路径: {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/ask":
+                self._send(404, {"error": f"未知路径: {self.path}"})
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+            except ValueError:
+                length = -1
+            if length < 0:
+                self.close_connection = True
+                self._send(400, {"error": "Content-Length 无效"})
+                return
+            if length > Config.SERVER_MAX_BODY_BYTES:
+                # 未读取的请求体留在连接上，不能复用该连接
+                self.close_connection = True
+                self._send(413, {"error": f"请求体超过 {Config.SERVER_MAX_BODY_BYTES} 字节"})
+                return
+
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(body, dict):
+                    raise ValueError("请求体应为 JSON 对象")
+                question = body.get("question", "")
+                if not isinstance(question, str):
+                    raise ValueError("question 应为字符串")
+                question = question.strip()
+                chat_history = parse_chat_history(body.get("chat_history"))
+            except ValueError as e:
+                self._send(400, {"error": f"请求格式错误: {str(e)}"})
+                return
+            if not question:
+                self._send(400, {"error": "缺少 question 字段"})
+                return
+
+            try:
+                result = service.ask(question, chat_history)
+            except Overloaded:
+                self._send(503, {"error": "服务繁忙，请稍后重试"}, headers={"Retry-After": "1"})
+                return
+            except Exception as e:
+                self._send(500, {"error": str(e)})
+                return
+
+            self._send(200, {
+                "success": result["success"],
+                "answer": result["answer"],
+                "context": result.get("context", ""),
+                "cache_hit": result.get("cache_hit", False),
+                "coalesced": result["coalesced"],
+                "usage": result.get("usage", {}),
+                "latency": result["latency"]
+            })
+
+    return Handler
+
+
+def create_server(agent: QAAgent, host: Optional[str] = None, port: Optional[int] = None,
+                  concurrency: Optional[int] = None, queue_size: Optional[int] = None) -> ThreadingHTTPServer:
+    """
+    创建 HTTP 服务（未启动）
+
+    agent: 预热好的问答代理
+    host, port: 监听地址，默认使用 Config.SERVER_HOST / Config.SERVER_PORT
+    concurrency: 同时处理的问题数
+    queue_size: 排队等待的问题数上限
+
+    returns: ThreadingHTTPServer 实例，service 属性为 QAService
+    """
+    service = QAService(agent, concurrency=concurrency, queue_size=queue_size)
+    server = _HTTPServer(
+        (host or Config.SERVER_HOST, Config.SERVER_PORT if port is None else port),
+        _handler_class(service)
+    )
+    server.service = service
+    return server
+
+
+def serve(agent: QAAgent, host: Optional[str] = None, port: Optional[int] = None):
+    """
+    预热后启动 HTTP 服务并阻塞运行，Ctrl+C 退出
+
+    agent: 问答代理
+    host, port: 监听地址
+    """
+    # 开始接收请求前创建代理图并预热索引，首批请求不承担这部分开销
+    start = time.perf_counter()
+    agent.agent
+    if agent.use_rag:
+        agent.rag_chain.retriever.warm_up()
+    print(f"预热完成，耗时 {time.perf_counter() - start:.2f}s")
+
+    server = create_server(agent, host, port)
+    address, bound_port = server.server_address[:2]
+    print(f"问答服务已启动: http://{address}:{bound_port} "
+          f"(并发 {server.service.concurrency}, 排队上限 {server.service.queue_size})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n服务已停止")
+    finally:
+        server.server_close()
@@ -1,41 +1,226 @@
 # 简单的计算器工具，用于执行基本数学计算
+# 表达式解析为语法树后按白名单编译为闭包（不使用 eval），并限制表达式长度、嵌套深度、幂的大小与结果的量级，
+# 每次工具调用有总的时间预算；一次调用可以计算多个表达式（换行或分号分隔），编译结果按表达式文本缓存
 
+import ast
+import math
+import operator
 import re
+import time
+from functools import lru_cache
+from typing import Callable, List, Union
 
 from langchain_core.tools import BaseTool
 from pydantic import BaseModel, Field
 
+from config import Config
+
+Number = Union[int, float]
+
+# 单个表达式的字符数、嵌套深度（括号与一元运算）与语法树节点数上限
+_MAX_LENGTH = 500
+_MAX_DEPTH = 32
+_MAX_NODES = 200
+# 整数结果的最大位数（二进制），约 1200 位十进制数
+_MAX_INT_BITS = 4096
+# 多个表达式之间的分隔符
+_SEPARATOR = re.compile(r"[;\n；]")
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow
+}
+_UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg
+}
+
+
+class CalculationError(ValueError):
+    """表达式不合法或超出计算限制"""
+
+
+def _check(value: Number) -> Number:
+    """检查结果的类型与量级"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise CalculationError("结果不是实数")
+    if isinstance(value, int):
+        if value.bit_length() > _MAX_INT_BITS:
+            raise CalculationError("结果过大")
+    elif not math.isfinite(value):
+        raise CalculationError("结果溢出")
+    return value
+
+
+def _power(base: Number, exponent: Number) -> Number:
+    """幂运算：先估算整数结果的位数，超出上限时不计算"""
+    if isinstance(base, int) and isinstance(exponent, int) and exponent > 0 and abs(base) > 1:
+        if (abs(base).bit_length() - 1) * exponent > _MAX_INT_BITS:
+            raise CalculationError("幂运算结果过大")
+    try:
+        return base ** exponent
+    except OverflowError:
+        raise CalculationError("幂运算结果溢出")
+
+
+def _compile(node: ast.AST, depth: int = 0) -> Callable[[float], Number]:
+    """
+    把语法树节点编译为以截止时间为参数的闭包，只接受数字常量与白名单中的运算
+    
+    depth: 一元运算的嵌套层数；括号深度在解析前检查，"1 + 2 + ... + 40" 这类不带括号的运算链不计入，
+    递归层数由节点数上限约束
+    """
+    if depth > _MAX_DEPTH:
+        raise CalculationError("表达式嵌套过深")
+    
+    if isinstance(node, ast.Constant):
+        value = node.value
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise CalculationError(f"不支持的常量: {value!r}")
+        _check(value)
+        return lambda deadline: value
+    
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+        function = _UNARY_OPERATORS[type(node.op)]
+        operand = _compile(node.operand, depth + 1)
+        return lambda deadline: function(operand(deadline))
+    
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        function = _power if isinstance(node.op, ast.Pow) else _BINARY_OPERATORS[type(node.op)]
+        left = _compile(node.left, depth)
+        right = _compile(node.right, depth)
+        
+        def binary(deadline: float) -> Number:
+            a, b = left(deadline), right(deadline)
+            if time.perf_counter() > deadline:
+                raise CalculationError("超出计算时间预算")
+            return _check(function(a, b))
+        return binary
+    
+    raise CalculationError(f"不支持的运算: {type(getattr(node, 'op', node)).__name__}")
+
+
+@lru_cache(maxsize=1024)
+def compile_expression(expression: str) -> Callable[[float], Number]:
+    """
+    检查并编译单个表达式，结果按表达式文本缓存
+    
+    expression: 数学表达式，支持 + - * / // % ** 与括号
+    
+    returns: 以截止时间（time.perf_counter() 的值）为参数、返回计算结果的函数
+    """
+    expression = expression.strip()
+    if not expression:
+        raise CalculationError("表达式为空")
+    if len(expression) > _MAX_LENGTH:
+        raise CalculationError(f"表达式过长（超过 {_MAX_LENGTH} 个字符）")
+    
+    # 解析前先检查括号深度，避免解析器本身在深度嵌套的输入上递归过深
+    depth = 0
+    for char in expression:
+        depth += (char == "(") - (char == ")")
+        if depth > _MAX_DEPTH:
+            raise CalculationError("表达式嵌套过深")
+    
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError:
+        raise CalculationError(f"表达式语法错误: {expression}")
+    if sum(1 for _ in ast.walk(tree)) > _MAX_NODES:
+        raise CalculationError("表达式过于复杂")
+    return _compile(tree.body)
+
+
+def evaluate(expression: str, deadline: float = None) -> Number:
+    """
+    计算单个表达式
+    
+    expression: 数学表达式
+    deadline: 截止时间（time.perf_counter() 的值），默认按 Config.CALCULATOR_TIME_BUDGET 计算
+    
+    returns: 计算结果
+    """
+    if deadline is None:
+        deadline = time.perf_counter() + Config.CALCULATOR_TIME_BUDGET
+    try:
+        return compile_expression(expression)(deadline)
+    except ZeroDivisionError:
+        raise CalculationError("除数不能为零")
+    except OverflowError:
+        raise CalculationError("结果溢出")
+    except RecursionError:
+        raise CalculationError("表达式嵌套过深")
+
+
+def evaluate_many(expressions: List[str], time_budget: float = None) -> List[Union[Number, CalculationError]]:
+    """
+    在同一个时间预算内依次计算多个表达式，单个表达式出错不影响其他表达式
+    
+    expressions: 表达式列表
+    time_budget: 总时间预算（秒），默认使用 Config.CALCULATOR_TIME_BUDGET
+    
+    returns: 与 expressions 一一对应的计算结果或 CalculationError
+    """
+    budget = Config.CALCULATOR_TIME_BUDGET if time_budget is None else time_budget
+    deadline = time.perf_counter() + budget
+    results = []
+    for expression in expressions:
+        try:
+            results.append(evaluate(expression, deadline))
+        except CalculationError as e:
+            results.append(e)
+    return results
+
+
+def split_expressions(text: str) -> List[str]:
+    """按换行或分号拆分多个表达式"""
+    return [part.strip() for part in _SEPARATOR.split(text) if part.strip()]
+
+
 class CalculatorInput(BaseModel):
     """计算器输入模型"""
-    expression: str = Field(description="要计算的数学表达式，例如: 2 + 3 * 4")
+    expression: str = Field(description="要计算的数学表达式，例如: 2 + 3 * 4；多个表达式用换行或分号分隔")
 
 
 class CalculatorTool(BaseTool):
     name: str = "calculator"
-    description: str = "用于执行基本数学计算的工具"
+    description: str = "用于执行基本数学计算的工具，支持 + - * / // % ** 和括号，一次可计算多个用分号分隔的表达式"
     args_schema: type[BaseModel] = CalculatorInput
     
     def _run(self, expression: str) -> str:
         """
         执行计算
         
-        expression: 数学表达式
-            
+        expression: 数学表达式，多个表达式用换行或分号分隔
+        
         returns: 计算结果
         """
-        try:
-            # 安全性检查：只允许数字、基本运算符和空格
-            if not re.match(r'^[\d\s\.\+\-\*\/\(\)]+$', expression):
-                return f"错误：表达式包含不安全字符: {expression}"
-            
-            # 计算表达式
-            result = eval(expression)
-            
+        expressions = split_expressions(expression)
+        if not expressions:
+            return "计算错误: 表达式为空"
+        if len(expressions) > Config.CALCULATOR_MAX_EXPRESSIONS:
+            return f"计算错误: 一次最多计算 {Config.CALCULATOR_MAX_EXPRESSIONS} 个表达式"
+        
+        results = evaluate_many(expressions)
+        if len(expressions) == 1:
+            result = results[0]
+            if isinstance(result, CalculationError):
+                print(f"计算错误: {str(result)}")
+                return f"计算错误: {str(result)}"
             return f"计算结果: {result}"
-            
-        except Exception as e:
-            print(f"计算错误: {str(e)}")
-            return f"计算错误: {str(e)}"
+        
+        lines = []
+        for text, result in zip(expressions, results):
+            if isinstance(result, CalculationError):
+                lines.append(f"{text}: 计算错误: {str(result)}")
+            else:
+                lines.append(f"{text} = {result}")
+        return "\n".join(lines)
     
     async def _arun(self, expression: str) -> str:
         """异步执行计算"""
@@ -44,4 +229,4 @@ class CalculatorTool(BaseTool):
     @property
     def tool(self):
         """返回工具对象，用于代理集成"""
-        return self
\ No newline at end of file
+        return self
@@ -0,0 +1,406 @@
+# 请求追踪
+# 每个问题记录一条追踪（trace），其中包含各阶段的耗时片段（span）及词元数、缓存命中等属性；
+# 追踪可逐行导出为 JSON，并按阶段汇总成耗时表。未启用时所有接口均为空操作。
+
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from config import Config
+
+_enabled = Config.TRACE_ENABLED
+_export_path: Optional[str] = Config.TRACE_EXPORT_PATH if Config.TRACE_ENABLED else None
+_lock = threading.Lock()
+
+# 阶段名 -> 各次记录的 {"ms", "tokens", "cache_hit"}
+_aggregate: Dict[str, List[Dict[str, Any]]] = {}
+_trace_totals: List[float] = []
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def enable(export_path: Optional[str] = None):
+    """
+    启用追踪
+
+    export_path: JSONL 导出路径，None 表示只在内存中汇总
+    """
+    global _enabled, _export_path
+    _enabled = True
+    _export_path = export_path
+    if export_path:
+        directory = os.path.dirname(export_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+
+def disable():
+    """关闭追踪"""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """清空汇总数据"""
+    with _lock:
+        _aggregate.clear()
+        _trace_totals.clear()
+
+
+class Span:
+    """一个阶段的耗时片段，通过 with 语句计时"""
+
+    def __init__(self, trace: "Trace", name: str, attrs: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.parent = None
+        self.start = 0.0
+        self.duration = 0.0
+        self._token = None
+
+    def set(self, **attrs):
+        """设置属性（如 tokens、cache_hit）"""
+        self.attrs.update(attrs)
+
+    def set_tokens(self, text: str):
+        """按文本计算并记录词元数"""
+        from app.rag.tokens import count_tokens
+        self.attrs["tokens"] = self.attrs.get("tokens", 0) + count_tokens(text)
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.parent = parent.name if parent is not None else None
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = str(exc)
+        self.trace.add(self.name, self.start, self.duration, self.attrs, parent=self.parent)
+        return False
+
+
+class _NullSpan:
+    """未启用追踪或不在追踪中时使用的空片段"""
+
+    def set(self, **attrs):
+        pass
+
+    def set_tokens(self, text: str):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """一个问题的完整追踪"""
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.spans: List[Dict[str, Any]] = []
+        self.start = 0.0
+        self.total = 0.0
+        self._lock = threading.Lock()
+        self._token = None
+
+    def add(self, name: str, start: float, duration: float, attrs: Dict[str, Any], parent: Optional[str] = None):
+        """记录一个片段（可在任意线程中调用）"""
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "parent": parent,
+                "offset_ms": round((start - self.start) * 1000, 3),
+                "ms": round(duration * 1000, 3),
+                **attrs
+            })
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    @contextlib.contextmanager
+    def activate(self):
+        """在 with 块内把本追踪设为当前追踪，块内的片段记录到本追踪；块内不能 yield"""
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    def finish(self, error: Optional[BaseException] = None):
+        """结束追踪并汇总导出（由 start_trace 开始的追踪调用）"""
+        self.total = time.perf_counter() - self.start
+        if error is not None:
+            self.attrs["error"] = str(error)
+        _finish_trace(self)
+
+    def __enter__(self):
+        self._token = _current_trace.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_trace.reset(self._token)
+        self.finish(exc)
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda item: item["offset_ms"])
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "total_ms": round(self.total * 1000, 3),
+            **self.attrs,
+            "spans": spans
+        }
+
+
+class _NullTrace(_NullSpan):
+    trace_id = None
+    spans: List[Dict[str, Any]] = []
+
+    def activate(self):
+        return self
+
+    def finish(self, error: Optional[BaseException] = None):
+        pass
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {}
+
+
+_NULL_TRACE = _NullTrace()
+
+
+def trace(name: str, **attrs):
+    """
+    开始一条追踪；已在追踪中时复用外层追踪，未启用时返回空追踪
+
+    name: 追踪名称，如 qa
+    attrs: 附加属性，如 question
+
+    returns: 可用于 with 语句的追踪对象
+    """
+    if not _enabled:
+        return _NULL_TRACE
+    current = _current_trace.get()
+    if current is not None:
+        return _NULL_TRACE
+    return Trace(name, attrs)
+
+
+def start_trace(name: str, **attrs):
+    """
+    开始一条不绑定当前上下文的追踪，用于生成器：上下文变量不能跨 yield 持有，
+    否则调用方在两次迭代之间记录的片段会挂到本追踪上，提前关闭时还会在另一个上下文中重置。
+    各个不 yield 的阶段用 activate() 包住，结束时调用 finish()
+
+    name: 追踪名称
+    attrs: 附加属性
+
+    returns: 追踪对象；已在追踪中或未启用时返回空追踪
+    """
+    started = trace(name, **attrs)
+    if isinstance(started, Trace):
+        started.start = time.perf_counter()
+    return started
+
+
+def current_trace() -> Optional[Trace]:
+    """当前上下文中的追踪"""
+    return _current_trace.get() if _enabled else None
+
+
+def span(name: str, **attrs):
+    """
+    记录一个阶段片段，不在追踪中时为空操作
+
+    name: 阶段名称，如 embed_query、vector_search
+    attrs: 附加属性
+
+    returns: 可用于 with 语句的片段对象，可调用 set() 补充属性
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    current = _current_trace.get()
+    if current is None:
+        return _NULL_SPAN
+    return Span(current, name, attrs)
+
+
+def annotate(**attrs):
+    """给当前片段补充属性（如嵌入缓存是否命中），不在片段中时忽略"""
+    if not _enabled:
+        return
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attrs)
+
+
+def _finish_trace(finished: Trace):
+    """汇总并导出一条完成的追踪"""
+    record = finished.to_dict()
+    with _lock:
+        _trace_totals.append(record["total_ms"])
+        for item in record["spans"]:
+            _aggregate.setdefault(item["name"], []).append({
+                "ms": item["ms"],
+                "tokens": item.get("tokens", 0) or 0,
+                "cache_hit": item.get("cache_hit")
+            })
+        if _export_path:
+            with open(_export_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+class _TraceCallbacks:
+    """把代理内部的大模型调用和工具调用记录为片段；与 BaseCallbackHandler 组合后作为 LangChain 回调使用"""
+
+    def __init__(self, target: Trace):
+        self.target = target
+        self._runs: Dict[Any, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _begin(self, run_id, name: str, **attrs):
+        with self._lock:
+            self._runs[run_id] = {"name": name, "start": time.perf_counter(), "attrs": attrs}
+
+    def _end(self, run_id, **attrs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        run["attrs"].update(attrs)
+        self.target.add(run["name"], run["start"], time.perf_counter() - run["start"], run["attrs"])
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._begin(run_id, "llm")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._begin(run_id, "llm")
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is not None and "ttft_ms" not in run["attrs"]:
+                run["attrs"]["ttft_ms"] = round((time.perf_counter() - run["start"]) * 1000, 3)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = {}
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                for key, value in (getattr(message, "usage_metadata", None) or {}).items():
+                    if key in ("input_tokens", "output_tokens", "total_tokens"):
+                        usage[key] = usage.get(key, 0) + value
+        self._end(run_id, tokens=usage.get("total_tokens", 0), **usage)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=str(error))
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        self._begin(run_id, f"tool:{name}")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=str(error))
+
+
+_handler_class = None
+
+
+def _callback_handler(target: Trace):
+    """创建回调处理器；langchain_core 在首次使用时才导入，导入本模块不增加启动开销"""
+    global _handler_class
+    if _handler_class is None:
+        from langchain_core.callbacks import BaseCallbackHandler
+        _handler_class = type("TraceCallbackHandler", (_TraceCallbacks, BaseCallbackHandler), {})
+    return _handler_class(target)
+
+
+def run_config() -> Dict[str, Any]:
+    """
+    当前追踪对应的 LangChain 运行配置，用于记录代理内部的大模型与工具调用
+
+    returns: {"callbacks": [...]}，不在追踪中时为空字典
+    """
+    current = current_trace()
+    if current is None:
+        return {}
+    return {"callbacks": [_callback_handler(current)]}
+
+
+def summary() -> List[Dict[str, Any]]:
+    """
+    按阶段汇总所有已完成的追踪
+
+    returns: 每个阶段一行：调用次数、总耗时、平均/p50/p95 耗时（毫秒）、占总耗时比例、词元数与缓存命中率
+    """
+    with _lock:
+        aggregate = {name: list(items) for name, items in _aggregate.items()}
+        total_ms = sum(_trace_totals)
+
+    rows = []
+    for name, items in aggregate.items():
+        durations = sorted(item["ms"] for item in items)
+        flagged = [item["cache_hit"] for item in items if item["cache_hit"] is not None]
+        rows.append({
+            "stage": name,
+            "calls": len(items),
+            "total_ms": sum(durations),
+            "avg_ms": sum(durations) / len(durations),
+            "p50_ms": durations[len(durations) // 2],
+            "p95_ms": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+            "share": sum(durations) / total_ms if total_ms else 0.0,
+            "tokens": sum(item["tokens"] for item in items),
+            "cache_hit_rate": sum(1 for flag in flagged if flag) / len(flagged) if flagged else None
+        })
+    rows.sort(key=lambda row: -row["total_ms"])
+    return rows
+
+
+def print_summary():
+    """打印按阶段汇总的耗时表"""
+    with _lock:
+        traces = len(_trace_totals)
+        total_ms = sum(_trace_totals)
+    if not traces:
+        print("暂无追踪数据")
+        return
+
+    print(f"\n======= 性能分析（{traces} 个问题，平均 {total_ms / traces:.1f} ms） =======")
+    print(f"{'阶段':<20} {'次数':>6} {'总耗时ms':>10} {'平均ms':>9} {'p50ms':>9} {'p95ms':>9} "
+          f"{'占比':>7} {'词元':>8} {'缓存命中':>8}")
+    for row in summary():
+        hit_rate = "-" if row["cache_hit_rate"] is None else f"{row['cache_hit_rate']:.0%}"
+        print(f"{row['stage']:<20} {row['calls']:>6} {row['total_ms']:>10.1f} {row['avg_ms']:>9.1f} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['share']:>7.1%} {row['tokens']:>8} {hit_rate:>8}")
+    if _export_path:
+        print(f"追踪明细已写入: {_export_path}")
+    print("=" * 60 + "\n")
@@ -0,0 +1,122 @@
+"""
+异步问答基准：对本地伪服务（注入嵌入与对话延迟）比较线程池同步调用与 asyncio 并发调用的吞吐和延迟
+
+同步方式每个问题占用一个线程；异步方式在单个事件循环上用 asyncio.gather 并发 ainvoke。
+延迟从整批问题提交时开始计算，包含排队等待的时间。伪服务在独立进程中运行，避免与被测代码争用 GIL。
+向量库、索引和缓存都写入临时目录，答案缓存与嵌入缓存关闭以保证每个问题都完整走一遍流程。
+
+用法: python -m benchmarks.bench_async [--levels 1,10,50,100] [--chat-latency 0.2] [--threads 16]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _report(mode, level, latencies, elapsed):
+    print(f"{mode:>6} {level:>6} {level / elapsed:>8.1f} {statistics.median(latencies) * 1000:>9.0f} "
+          f"{_percentile(latencies, 0.99) * 1000:>9.0f}")
+
+
+def _start_server(latency: float, chat_latency: float):
+    """在子进程中启动伪服务，返回 (进程, base_url)"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_openai_server", "--port", str(port),
+         "--latency", str(latency), "--chat-latency", str(chat_latency)],
+        stdout=subprocess.DEVNULL
+    )
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return process, f"http://127.0.0.1:{port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="异步问答基准")
+    parser.add_argument("--levels", default="1,10,50,100", help="并发问题数，逗号分隔")
+    parser.add_argument("--latency", type=float, default=0.05, help="伪服务嵌入请求延迟（秒）")
+    parser.add_argument("--chat-latency", type=float, default=0.2, help="伪服务对话请求延迟（秒）")
+    parser.add_argument("--threads", type=int, default=16, help="同步方式的线程池大小")
+    parser.add_argument("--docs", type=int, default=200, help="预先写入向量库的文本块数")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.levels.split(",")]
+
+    server, base_url = _start_server(args.latency, args.chat_latency)
+    workdir = tempfile.TemporaryDirectory()
+
+    # 配置在导入时读取环境变量，必须先设置再导入应用模块
+    os.environ.update({
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_BASE_URL": base_url,
+        "VECTOR_DB_PATH": workdir.name,
+        "HYBRID_SEARCH": "True",
+        "EMBEDDING_CACHE_ENABLED": "False",
+        "ANSWER_CACHE_ENABLED": "False"
+    })
+    from langchain_core.documents import Document
+    from app.agents.qa_agent import QAAgent
+    from app.rag.retriever import VectorRetriever
+
+    try:
+        retriever = VectorRetriever()
+        retriever.add_documents([
+            Document(page_content=f"{i}路公交从站点{i % 37}开往站点{i % 53}，首班车{5 + i % 3}点发车。",
+                     metadata={"source": f"routes_{i // 20}.txt"})
+            for i in range(args.docs)
+        ])
+        agent = QAAgent(retriever=retriever)
+
+        print(f"{'方式':>6} {'并发':>6} {'问题/秒':>8} {'p50(ms)':>9} {'p99(ms)':>9}")
+        for level in levels:
+            questions = [f"{i}路公交的首班车是几点" for i in range(level)]
+
+            start = time.perf_counter()
+
+            def timed_invoke(question):
+                result = agent.invoke(question)
+                assert result["success"], result["answer"]
+                return time.perf_counter() - start
+
+            with ThreadPoolExecutor(max_workers=min(args.threads, level)) as pool:
+                latencies = list(pool.map(timed_invoke, questions))
+            _report("sync", level, latencies, time.perf_counter() - start)
+
+            start = time.perf_counter()
+
+            async def timed_ainvoke(question):
+                result = await agent.ainvoke(question)
+                assert result["success"], result["answer"]
+                return time.perf_counter() - start
+
+            async def run_all():
+                return await asyncio.gather(*[timed_ainvoke(question) for question in questions])
+
+            latencies = asyncio.run(run_all())
+            _report("async", level, latencies, time.perf_counter() - start)
+    finally:
+        server.terminate()
+        server.wait()
+        workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+计算器基准：比较原来的正则检查 + eval 与语法树编译求值器的吞吐量，并测量恶意输入的处理耗时
+
+- eval: 原实现（正则检查后直接 eval）
+- safe-cold: 每次都重新解析编译（清空编译缓存）
+- safe-cached: 表达式重复出现时命中编译缓存
+- safe-batch: 每次工具调用计算多个表达式（分号分隔）
+- adversarial: 会让 eval 挂起或耗尽内存的输入，只在新求值器上运行
+- 开始前检查不带括号的长运算链等合法输入能正常计算（不应被当作嵌套过深拒绝）
+
+用法: python -m benchmarks.bench_calculator [--count 20000] [--distinct 500] [--batch 20]
+"""
+
+import argparse
+import random
+import re
+import time
+
+from app.tools.calculator import CalculatorTool, compile_expression, evaluate
+
+ADVERSARIAL = [
+    "9**9**9**9",
+    "2**100000000",
+    "(" * 100000 + "1" + ")" * 100000,
+    "-" * 100000 + "1",
+    "1" * 100000,
+    "10**4000 * 10**4000",
+    "1e308 * 1e308",
+    "__import__('os').system('true')",
+    "(lambda: 1)()",
+    "[1] * 10**9"
+]
+
+# 合法但较长的表达式及其结果
+LEGITIMATE = [
+    ("+".join(["1"] * 40), 40),
+    ("-".join(["100"] + ["1"] * 39), 61),
+    ("*".join(["2"] * 40), 2 ** 40),
+    (" + ".join(f"({i} * 2)" for i in range(30)), 870),
+    ("-" * 20 + "5", 5)
+]
+
+
+def _legacy_eval(expression: str) -> str:
+    """原实现：只允许数字、基本运算符和空格，然后 eval"""
+    if not re.match(r'^[\d\s\.\+\-\*\/\(\)]+$', expression):
+        return f"错误：表达式包含不安全字符: {expression}"
+    return f"计算结果: {eval(expression)}"
+
+
+def generate_expressions(count: int, distinct: int, seed: int = 0):
+    """生成 count 个表达式，其中不同的表达式有 distinct 个"""
+    rng = random.Random(seed)
+    pool = []
+    for _ in range(distinct):
+        terms = [str(rng.choice([rng.randint(1, 1000), round(rng.uniform(0.1, 100), 2)]))
+                 for _ in range(rng.randint(2, 6))]
+        expression = terms[0]
+        for term in terms[1:]:
+            expression += f" {rng.choice('+-*/')} {term}"
+        if rng.random() < 0.3:
+            expression = f"({expression}) * {rng.randint(2, 9)}"
+        pool.append(expression)
+    return [rng.choice(pool) for _ in range(count)]
+
+
+def _throughput(function, items) -> float:
+    start = time.perf_counter()
+    for item in items:
+        function(item)
+    return len(items) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="计算器吞吐量基准")
+    parser.add_argument("--count", type=int, default=20000, help="表达式总数")
+    parser.add_argument("--distinct", type=int, default=500, help="不同表达式的个数")
+    parser.add_argument("--batch", type=int, default=20, help="safe-batch 每次调用的表达式数")
+    args = parser.parse_args()
+
+    expressions = generate_expressions(args.count, args.distinct)
+    tool = CalculatorTool()
+    for expression, expected in LEGITIMATE:
+        assert evaluate(expression) == expected, (expression, tool._run(expression))
+    for expression in expressions[:100]:
+        assert _legacy_eval(expression) == tool._run(expression) or "/ 0" in expression, expression
+
+    def cold(expression):
+        compile_expression.cache_clear()
+        return evaluate(expression)
+
+    batches = ["; ".join(expressions[i:i + args.batch]) for i in range(0, len(expressions), args.batch)]
+    results = {
+        "eval": _throughput(_legacy_eval, expressions),
+        "safe-cold": _throughput(cold, expressions),
+        "safe-cached": _throughput(tool._run, expressions),
+        "safe-batch": _throughput(tool._run, batches) * args.batch
+    }
+    print(f"{args.count} 个表达式（{args.distinct} 个不同），每秒计算的表达式数:")
+    for name, value in results.items():
+        print(f"  {name:<12} {value:>10.0f}/s  ({value / results['eval']:.2f}x)")
+
+    print("\n恶意输入（新求值器）:")
+    for expression in ADVERSARIAL:
+        start = time.perf_counter()
+        result = tool._run(expression)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"  {expression[:32]:<34} {elapsed:7.2f}ms  {result[:40]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+分块方式基准：比较按字符递归分割与结构感知分割（子块检索、父段落作为上下文）的索引大小、上下文词元数与答案覆盖率
+
+语料为合成的线路说明：Markdown 文件每条线路一节，节内是说明段落和时刻表表格；txt 文件每条线路一段。
+每个问题对应一条唯一事实（表格行或句子），答案覆盖率 = 上下文中包含完整事实的问题比例。
+各模式分别走一遍入库流水线（本地向量库 + BM25 关键词索引 + 父段落存储，嵌入使用离线的哈希嵌入）与检索后处理；
+候选只取自 BM25 检索，哈希嵌入的稠密检索噪声较大，会掩盖分块方式本身的差异。
+
+- recursive: 按 CHUNK_SIZE/CHUNK_OVERLAP 字符递归分割，检索结果直接作为上下文
+- structured-child: 结构感知分割，子块直接作为上下文
+- structured-parent: 结构感知分割，子块检索、父段落作为上下文（默认配置）
+
+用法: python -m benchmarks.bench_chunking [--files 30] [--questions 200] [--ks 2,4]
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from config import Config
+from benchmarks import fakes
+
+_FILLER = "本线路沿途设有多个站点，乘客可在枢纽站换乘地铁，高峰时段发车间隔较短，请注意安全文明乘车。"
+_STATIONS = ["火车站", "体育中心", "人民广场", "大学城", "科技园", "市民中心", "机场", "港口", "老城区", "会展中心"]
+
+# 估算向量大小时使用的嵌入维度（text-embedding-3-small）
+EMBEDDING_DIM = 1536
+
+MODES = {
+    "recursive": {"CHUNK_STRATEGY": "recursive", "PARENT_RETRIEVAL": False},
+    "structured-child": {"CHUNK_STRATEGY": "structured", "PARENT_RETRIEVAL": False},
+    "structured-parent": {"CHUNK_STRATEGY": "structured", "PARENT_RETRIEVAL": True}
+}
+
+
+def build_corpus(directory: str, files: int, routes_per_file: int = 10, seed: int = 0):
+    """生成语料与评测集，返回 (问题, 事实) 列表"""
+    rng = random.Random(seed)
+    questions = []
+    route = 0
+    for i in range(files):
+        markdown = i % 2 == 0
+        parts = [f"# 第{i + 1}片区公交线路\n\n" if markdown else ""]
+        for _ in range(routes_per_file):
+            route += 1
+            start, end = rng.sample(_STATIONS, 2)
+            first_bus = f"{rng.randint(5, 7):02d}:{rng.choice([0, 15, 30, 45]):02d}"
+            fare = rng.randint(1, 4)
+            intro = _FILLER * rng.randint(3, 6)
+            if markdown:
+                fact = f"| R{route:04d} | {start} | {end} | {first_bus} | {fare}元 |"
+                parts.append(f"## R{route:04d} 线路\n\n{intro}\n\n| 线路 | 起点 | 终点 | 首班车 | 票价 |\n"
+                             f"| --- | --- | --- | --- | --- |\n{fact}\n\n{_FILLER * rng.randint(1, 3)}\n\n")
+            else:
+                fact = f"R{route:04d} 线路从{start}开往{end}，首班车时间是{first_bus}，票价{fare}元"
+                parts.append(f"{intro}{fact}。{_FILLER * rng.randint(1, 3)}\n\n")
+            questions.append((f"R{route:04d} 线路的首班车是几点，票价多少", fact))
+        extension = "md" if markdown else "txt"
+        with open(os.path.join(directory, f"routes_{i:03d}.{extension}"), "w", encoding="utf-8") as f:
+            f.write("".join(parts))
+    return questions
+
+
+def run_mode(name: str, docs_dir: str, workdir: str, questions, ks):
+    """在独立目录中入库并评测一种分块方式"""
+    from app import resources
+    from app.data import loader as loader_module
+    from app.data.loader import DocumentLoader
+    from app.data.manifest import IngestManifest
+    from app.data.pipeline import IngestPipeline
+    from app.rag.chain import RAGChain
+    from app.rag.retriever import VectorRetriever
+    from app.rag.tokens import count_tokens
+
+    for key, value in MODES[name].items():
+        setattr(Config, key, value)
+    if Config.CHUNK_STRATEGY == "recursive" and importlib.util.find_spec("unstructured") is None:
+        # 未安装 unstructured 时按纯文本加载 Markdown，否则基线中 Markdown 文件全部加载失败
+        from langchain_community.document_loaders import TextLoader
+        loader_module.UnstructuredMarkdownLoader = TextLoader
+    db_path = os.path.join(workdir, name)
+    Config.VECTOR_DB_PATH = db_path
+    Config.SPARSE_INDEX_PATH = os.path.join(db_path, "sparse_index.sqlite3")
+    Config.DOCSTORE_PATH = os.path.join(db_path, "docstore.sqlite3")
+    Config.INGEST_MANIFEST_PATH = os.path.join(db_path, "ingest_manifest.json")
+    resources.clear()
+
+    loader = DocumentLoader()
+    retriever = VectorRetriever()
+    pipeline = IngestPipeline(loader, retriever, IngestManifest(Config.INGEST_MANIFEST_PATH), docs_dir)
+    stats = pipeline.run(loader.list_files(docs_dir))
+    # 索引大小按逻辑大小统计（文件有预分配与 WAL，实际占用波动较大）：向量按 text-embedding-3-small 的 1536 维 float32 计，
+    # 文本为写入向量库的文本块 UTF-8 字节数，倒排条目为 BM25 索引的 (词项, 文本块) 数
+    sparse = retriever.sparse_index._conn
+    text_bytes = sparse.execute("SELECT TOTAL(LENGTH(CAST(content AS BLOB))) FROM docs").fetchone()[0]
+    postings = sparse.execute("SELECT COUNT(*) FROM postings").fetchone()[0]
+    parent_bytes = retriever.docstore._conn.execute(
+        "SELECT TOTAL(LENGTH(CAST(content AS BLOB))) FROM parents").fetchone()[0]
+    chain = RAGChain(retriever)
+
+    rows = []
+    for k in ks:
+        Config.RETRIEVAL_K = k
+        tokens, covered, latencies = [], 0, []
+        for question, fact in questions:
+            start = time.perf_counter()
+            candidates = [doc for doc, _ in retriever.sparse_index.search(question, chain._search_k())]
+            result = chain._build_retrieval(question, candidates)
+            latencies.append(time.perf_counter() - start)
+            tokens.append(count_tokens(result["context"]))
+            covered += fact in result["context"]
+        rows.append({
+            "mode": name,
+            "k": k,
+            "vectors": stats["chunks"],
+            "parents": stats["parents"],
+            "vector_bytes": stats["chunks"] * EMBEDDING_DIM * 4,
+            "text_bytes": text_bytes,
+            "postings": postings,
+            "parent_bytes": parent_bytes,
+            "context_tokens": statistics.mean(tokens),
+            "coverage": covered / len(questions),
+            "retrieve_ms": statistics.median(latencies) * 1000
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分块方式基准")
+    parser.add_argument("--files", type=int, default=30, help="文件数，Markdown 与 txt 各半")
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--ks", type=str, default="2,4", help="RETRIEVAL_K，逗号分隔")
+    parser.add_argument("--budget", type=int, default=Config.CONTEXT_TOKEN_BUDGET, help="上下文词元预算")
+    args = parser.parse_args()
+
+    os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+    fakes.install(fakes.HashEmbeddings(dim=256))
+    Config.VECTOR_DB_TYPE = "local"
+    Config.EMBEDDING_CACHE_ENABLED = False
+    Config.HYBRID_SEARCH = True
+    Config.RERANK_ENABLED = True
+    Config.LOADER_WORKERS = 1
+    Config.CONTEXT_TOKEN_BUDGET = args.budget
+    ks = [int(k) for k in args.ks.split(",")]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        docs_dir = os.path.join(workdir, "docs")
+        os.makedirs(docs_dir)
+        questions = build_corpus(docs_dir, args.files)
+        questions = random.Random(1).sample(questions, min(args.questions, len(questions)))
+
+        rows = []
+        for name in MODES:
+            rows.extend(run_mode(name, docs_dir, workdir, questions, ks))
+
+    print(f"\n文件 {args.files} 个, 问题 {len(questions)} 个, 上下文预算 {Config.CONTEXT_TOKEN_BUDGET} 词元")
+    print(f"{'模式':<18} {'k':>3} {'向量数':>6} {'向量KB':>7} {'文本KB':>7} {'倒排条目':>8} {'父段落KB':>8} "
+          f"{'上下文词元':>10} {'覆盖率':>7} {'检索ms':>7}")
+    for row in rows:
+        print(f"{row['mode']:<18} {row['k']:>3} {row['vectors']:>6} {row['vector_bytes'] / 1024:>7.0f} "
+              f"{row['text_bytes'] / 1024:>7.0f} {row['postings']:>8} {row['parent_bytes'] / 1024:>8.0f} "
+              f"{row['context_tokens']:>10.1f} {row['coverage']:>7.1%} {row['retrieve_ms']:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+并发嵌入基准：对本地伪服务（注入延迟与 429 限流）比较不同并发上限下的吞吐
+
+用法: python -m benchmarks.bench_embeddings [--chunks 2000] [--latency 0.05] [--max-in-flight 6]
+"""
+
+import argparse
+
+from langchain_openai import OpenAIEmbeddings
+
+from app.rag.embedding_executor import ConcurrentEmbeddings
+from benchmarks.fake_openai_server import FakeOpenAIServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发嵌入基准")
+    parser.add_argument("--chunks", type=int, default=2000, help="文本块数量")
+    parser.add_argument("--latency", type=float, default=0.05, help="伪服务每个请求的延迟（秒）")
+    parser.add_argument("--per-item-latency", type=float, default=0.001, help="伪服务每条文本的额外延迟（秒）")
+    parser.add_argument("--max-in-flight", type=int, default=6, help="伪服务在途请求上限，超出返回429")
+    parser.add_argument("--batch-tokens", type=int, default=4000, help="每个请求的词元预算")
+    args = parser.parse_args()
+    
+    texts = [f"第{i}个文本块: 公交{i % 300}路 途经 站点{i % 97} 换乘 地铁{i % 13}号线。" * 8 for i in range(args.chunks)]
+    
+    server = FakeOpenAIServer(latency=args.latency, per_item_latency=args.per_item_latency,
+                              max_in_flight=args.max_in_flight).start()
+    try:
+        print(f"{'并发上限':>8} {'块/秒':>10} {'请求':>6} {'重试':>6} {'限流':>6} {'最终并发':>8}")
+        for concurrency in [1, 2, 4, 8, 16]:
+            upstream = OpenAIEmbeddings(
+                model="fake-embedding",
+                api_key="fake",
+                base_url=server.base_url,
+                max_retries=0,
+                check_embedding_ctx_length=False
+            )
+            embeddings = ConcurrentEmbeddings(upstream, max_concurrency=concurrency,
+                                              batch_tokens=args.batch_tokens, base_delay=0.05)
+            vectors = embeddings.embed_documents(texts)
+            assert len(vectors) == len(texts)
+            
+            stats = embeddings.get_stats()
+            print(f"{concurrency:>8} {stats['chunks_per_second']:>10.1f} {stats['requests']:>6} "
+                  f"{stats['retries']:>6} {stats['throttled']:>6} {stats['concurrency']:>8}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+文档加载并行度基准：在合成的混合格式语料上比较 1..N 个工作进程的加载与分割耗时
+
+用法: python -m benchmarks.bench_loader [--files 120] [--max-workers 8]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from app.data.loader import DocumentLoader
+from benchmarks.corpus import generate_corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文档加载并行度基准")
+    parser.add_argument("--files", type=int, default=120, help="语料文件数")
+    parser.add_argument("--paragraphs", type=int, default=60, help="每个文件的段落数")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1, help="最大工作进程数")
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        generate_corpus(corpus_dir, files=args.files, paragraphs=args.paragraphs)
+        loader = DocumentLoader()
+        file_paths = loader.list_files(corpus_dir)
+        
+        worker_counts = sorted({1, 2, 4, 8, args.max_workers} & set(range(1, args.max_workers + 1)))
+        baseline = None
+        reference = None
+        
+        print(f"{'workers':>8} {'秒':>8} {'加速比':>8} {'文本块':>8}")
+        for workers in worker_counts:
+            start = time.perf_counter()
+            chunks = [chunk for _, file_chunks in loader.iter_files(file_paths, workers=workers)
+                      for chunk in file_chunks]
+            elapsed = time.perf_counter() - start
+            
+            # 并行结果必须与串行完全一致
+            contents = [chunk.page_content for chunk in chunks]
+            if reference is None:
+                reference = contents
+            elif contents != reference:
+                print(f"警告: workers={workers} 的输出与串行结果不一致")
+            
+            baseline = baseline or elapsed
+            print(f"{workers:>8} {elapsed:>8.2f} {baseline / elapsed:>8.2f} {len(chunks):>8}")
+
+
+if __name__ == "__main__":
+    main()
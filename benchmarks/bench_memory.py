@@ -0,0 +1,63 @@
+"""
+对话记忆基准：模拟 100 轮脚本对话，比较完整历史与 ConversationMemory 每轮发送的历史词元数
+
+摘要模型用本地规则代替（保留已有摘要并追加每个问题的前 30 个字），不访问 API。
+
+用法: python -m benchmarks.bench_memory [--turns 100] [--budget 1200]
+"""
+
+import argparse
+import random
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from app.agents.memory import ConversationMemory, trim_history
+from app.rag.tokens import count_tokens
+
+
+def _fake_summarizer(prompt) -> AIMessage:
+    """从摘要提示中取出已有摘要和新问题，拼成新的摘要"""
+    text = prompt if isinstance(prompt, str) else str(prompt)
+    summary = text.split("已有摘要：\n", 1)[1].split("\n\n新对话：", 1)[0]
+    dialogue = text.split("新对话：\n", 1)[1].split("\n\n更新后的摘要：", 1)[0]
+    questions = [line[3:33] for line in dialogue.splitlines() if line.startswith("用户：")]
+    parts = [] if summary == "（无）" else [summary]
+    return AIMessage(content="；".join(parts + questions))
+
+
+def _history_tokens(messages) -> int:
+    return sum(count_tokens(message.content) + 4 for message in messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对话记忆基准")
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--budget", type=int, default=1200, help="历史消息词元预算")
+    parser.add_argument("--recent", type=int, default=4, help="保留原文的最近轮数")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    memory = ConversationMemory(llm=RunnableLambda(_fake_summarizer), token_budget=args.budget,
+                                recent_turns=args.recent)
+    full_history = []
+
+    print(f"{'轮次':>6} {'完整历史':>10} {'记忆':>8}")
+    for turn in range(1, args.turns + 1):
+        question = f"第{turn}个问题：{rng.randint(1, 500)}路公交从哪个站发车，末班车几点，途经哪些换乘站？"
+        answer = f"第{turn}个回答：" + "该线路从枢纽站发车，末班车22:30，途经多个地铁换乘站。" * rng.randint(2, 6)
+
+        full_tokens = _history_tokens(trim_history(full_history, token_budget=0))
+        memory_tokens = _history_tokens(memory.messages())
+        if turn in (1, 2, 5, 10, 25, 50, 75, 100) or turn == args.turns:
+            print(f"{turn:>6} {full_tokens:>10} {memory_tokens:>8}")
+
+        full_history.extend([("user", question), ("assistant", answer)])
+        memory.add_turn(question, answer)
+
+    memory.wait()
+    print(f"摘要次数 {memory.stats['summaries']}, 最终摘要 {count_tokens(memory.summary)} 个词元")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+交互模式预取基准：按交互模式的会话流程（QASystem.ask + 对话记忆）连续提问，比较开启与关闭预取时各轮的检索耗时
+
+语料为合成的线路说明，每条线路一段。会话依次询问若干条线路，每条线路先问一个带编号的问题，
+再追问几个不带编号（或重复编号）的问题；检索耗时从提问到检索完成（含等待预取），不含回答生成。
+嵌入与聊天模型使用带延迟的离线替身，模拟嵌入请求的网络往返与逐字生成；关闭嵌入缓存，使每个问题都实际嵌入。
+答案覆盖率 = 上下文中包含所问线路事实的轮次比例（新话题与追问分别统计），用于确认预取结果没有降低检索质量。
+
+用法: python -m benchmarks.bench_prefetch [--topics 20] [--embed-latency 0.15] [--backend chromadb]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from config import Config
+from benchmarks import fakes
+
+_STATIONS = ["火车站", "体育中心", "人民广场", "大学城", "科技园", "市民中心", "机场", "港口", "老城区", "会展中心"]
+FOLLOW_UPS = ["它的票价是多少？", "首班车几点发车？", "{route} 线路的终点是哪一站？"]
+
+
+def build_corpus(directory: str, files: int, routes_per_file: int = 10, seed: int = 0):
+    """生成语料，返回 (线路编号, 事实) 列表"""
+    rng = random.Random(seed)
+    routes = []
+    for i in range(files):
+        paragraphs = []
+        for j in range(routes_per_file):
+            route = f"R{i * routes_per_file + j + 1:04d}"
+            start, end = rng.sample(_STATIONS, 2)
+            fact = (f"{route} 线路从{start}开往{end}，首班车时间是{rng.randint(5, 7):02d}:{rng.choice([0, 15, 30, 45]):02d}，"
+                    f"票价{rng.randint(1, 4)}元")
+            paragraphs.append(f"{fact}。{route} 线路高峰时段每 {rng.randint(5, 15)} 分钟一班。")
+            routes.append((route, fact))
+        with open(os.path.join(directory, f"routes_{i:03d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(paragraphs))
+    return routes
+
+
+def _ingest(docs_dir: str, db_path: str):
+    from app import resources
+    from app.data.loader import DocumentLoader
+    from app.data.manifest import IngestManifest
+    from app.data.pipeline import IngestPipeline
+    from app.rag.retriever import VectorRetriever
+
+    Config.VECTOR_DB_PATH = db_path
+    Config.SPARSE_INDEX_PATH = os.path.join(db_path, "sparse_index.sqlite3")
+    Config.DOCSTORE_PATH = os.path.join(db_path, "docstore.sqlite3")
+    Config.INGEST_MANIFEST_PATH = os.path.join(db_path, "ingest_manifest.json")
+    resources.clear()
+    loader = DocumentLoader()
+    pipeline = IngestPipeline(loader, VectorRetriever(), IngestManifest(Config.INGEST_MANIFEST_PATH), docs_dir)
+    pipeline.run(loader.list_files(docs_dir))
+    # 丢弃入库时打开的句柄，问答从冷启动开始
+    resources.clear()
+
+
+def run_session(prefetch: bool, session, think: float, startup_wait: float) -> dict:
+    """按会话流程提问，返回各轮检索耗时与覆盖情况"""
+    from app import resources
+    from main import QASystem
+
+    resources.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        qa_system = QASystem(streaming=True, prefetch=prefetch)
+        if prefetch:
+            qa_system.start_prefetch()
+    # 启动后到输入第一个问题之间的时间，预取模式在此期间预热
+    time.sleep(startup_wait)
+
+    first, follow_ups = [], []
+    covered = {False: [], True: []}
+    hits = 0
+    start = time.perf_counter()
+    for turn, (question, fact, is_follow_up) in enumerate(session):
+        time.sleep(think)
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = qa_system.ask(question, qa_system.memory)
+        qa_system.memory.add_turn(question, result["answer"])
+        elapsed = qa_system.last_retrieval["elapsed"]
+        (follow_ups if is_follow_up else first).append(elapsed)
+        covered[is_follow_up].append(fact in result.get("context", ""))
+        hits += qa_system.last_retrieval["prefetched"]
+    total = time.perf_counter() - start
+    qa_system.memory.wait()
+
+    follow_ups.sort()
+    return {
+        "mode": "prefetch" if prefetch else "sequential",
+        "first_ms": statistics.median(first) * 1000,
+        "cold_ms": first[0] * 1000,
+        "follow_p50_ms": statistics.median(follow_ups) * 1000,
+        "follow_p95_ms": follow_ups[int(len(follow_ups) * 0.95)] * 1000,
+        "hits": hits,
+        "follow_ups": len(follow_ups),
+        "first_coverage": statistics.mean(covered[False]),
+        "follow_coverage": statistics.mean(covered[True]),
+        "session_s": total
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="交互模式预取基准")
+    parser.add_argument("--topics", type=int, default=20, help="会话中询问的线路数，每条线路追问 3 次")
+    parser.add_argument("--files", type=int, default=20, help="语料文件数")
+    parser.add_argument("--embed-latency", type=float, default=0.15, help="每次嵌入请求的延迟（秒）")
+    parser.add_argument("--chat-latency", type=float, default=0.3, help="生成回答的首字延迟（秒）")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="每个流式块的延迟（秒）")
+    parser.add_argument("--think", type=float, default=0.0, help="两轮提问之间的间隔（秒）")
+    parser.add_argument("--startup-wait", type=float, default=1.0, help="启动后到第一个问题的间隔（秒）")
+    parser.add_argument("--backend", type=str, default="chromadb", help="chromadb 或 local")
+    args = parser.parse_args()
+
+    os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+    fakes.install(fakes.HashEmbeddings(dim=256, latency=args.embed_latency),
+                  fakes.ScriptedChatModel(latency=args.chat_latency, token_latency=args.token_latency))
+    Config.VECTOR_DB_TYPE = args.backend
+    Config.EMBEDDING_CACHE_ENABLED = False
+    Config.HYBRID_SEARCH = True
+    Config.RERANK_ENABLED = True
+    Config.LOADER_WORKERS = 1
+
+    with tempfile.TemporaryDirectory() as workdir:
+        docs_dir = os.path.join(workdir, "docs")
+        os.makedirs(docs_dir)
+        routes = build_corpus(docs_dir, args.files)
+        session = []
+        for route, fact in random.Random(2).sample(routes, min(args.topics, len(routes))):
+            session.append((f"{route} 线路从哪里开往哪里？", fact, False))
+            session.extend((follow_up.format(route=route), fact, True) for follow_up in FOLLOW_UPS)
+        with contextlib.redirect_stdout(io.StringIO()):
+            _ingest(docs_dir, os.path.join(workdir, "db"))
+
+        rows = [run_session(prefetch, session, args.think, args.startup_wait) for prefetch in (False, True)]
+
+    print(f"\n后端 {args.backend}, 话题 {len(session) // (len(FOLLOW_UPS) + 1)} 个, 共 {len(session)} 轮, "
+          f"嵌入延迟 {args.embed_latency * 1000:.0f}ms, 首字延迟 {args.chat_latency * 1000:.0f}ms")
+    print(f"{'模式':<12} {'首轮ms':>7} {'新话题ms':>9} {'追问p50ms':>10} {'追问p95ms':>10} {'预取命中':>9} "
+          f"{'新话题覆盖':>10} {'追问覆盖':>9} {'会话s':>7}")
+    for row in rows:
+        print(f"{row['mode']:<12} {row['cold_ms']:>7.1f} {row['first_ms']:>9.1f} {row['follow_p50_ms']:>10.1f} "
+              f"{row['follow_p95_ms']:>10.1f} {row['hits']:>4}/{row['follow_ups']:<4} {row['first_coverage']:>10.1%} "
+              f"{row['follow_coverage']:>9.1%} {row['session_s']:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+HTTP 服务负载生成器：多个客户端线程通过长连接并发请求 POST /ask，统计吞吐、延迟分位数与 503 次数
+
+默认在子进程中启动伪 OpenAI 服务（桩模型）和问答服务，也可用 --url 指向已运行的服务。
+问题从 --distinct 个不同问题中随机抽取，数量越少，请求合并与答案缓存的效果越明显。
+
+用法: python -m benchmarks.bench_server [--clients 32] [--requests 500] [--distinct 20]
+     python -m benchmarks.bench_server --url http://127.0.0.1:8000
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+from app.server import percentile
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(port: int, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"端口 {port} 未在 {timeout} 秒内就绪")
+
+
+def _start_stack(args, workdir: str):
+    """启动伪 OpenAI 服务与问答服务子进程，返回 (进程列表, 问答服务地址)"""
+    fake_port, app_port = _free_port(), _free_port()
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_openai_server", "--port", str(fake_port),
+         "--latency", str(args.latency), "--chat-latency", str(args.chat_latency)],
+        stdout=subprocess.DEVNULL
+    )
+    _wait_for(fake_port)
+
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{fake_port}/v1",
+        "VECTOR_DB_PATH": workdir,
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+        "EMBEDDING_CACHE_ENABLED": "True",
+        "ANSWER_CACHE_ENABLED": "True",
+        "SERVER_CONCURRENCY": str(args.concurrency),
+        "SERVER_QUEUE_SIZE": str(args.queue_size)
+    })
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    app = subprocess.Popen(
+        [sys.executable, os.path.join(root, "main.py"), "--serve", "--port", str(app_port)],
+        env=env, cwd=root, stdout=subprocess.DEVNULL
+    )
+    _wait_for(app_port)
+    return [app, fake], f"http://127.0.0.1:{app_port}"
+
+
+def _client(url, questions, count, results, lock, seed):
+    """单个客户端：复用一条长连接发送 count 个请求"""
+    parsed = urlparse(url)
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=300)
+    for _ in range(count):
+        body = json.dumps({"question": rng.choice(questions)}, ensure_ascii=False).encode("utf-8")
+        start = time.perf_counter()
+        try:
+            conn.request("POST", "/ask", body=body, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            payload = json.loads(response.read() or b"{}")
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=300)
+            status, payload = "conn_error", {}
+        latency = time.perf_counter() - start
+        with lock:
+            results.append((status, latency, payload.get("coalesced", False), payload.get("cache_hit", False)))
+    conn.close()
+
+
+def _get_json(url: str, path: str) -> dict:
+    parsed = urlparse(url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=30)
+    conn.request("GET", path)
+    payload = json.loads(conn.getresponse().read())
+    conn.close()
+    return payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP 服务负载生成器")
+    parser.add_argument("--url", type=str, help="已运行的问答服务地址，不指定时自动启动桩服务")
+    parser.add_argument("--clients", type=int, default=32, help="并发客户端数")
+    parser.add_argument("--requests", type=int, default=500, help="总请求数")
+    parser.add_argument("--distinct", type=int, default=20, help="不同问题的数量")
+    parser.add_argument("--latency", type=float, default=0.05, help="桩服务嵌入延迟（秒）")
+    parser.add_argument("--chat-latency", type=float, default=0.3, help="桩服务对话延迟（秒）")
+    parser.add_argument("--concurrency", type=int, default=8, help="问答服务同时处理的问题数")
+    parser.add_argument("--queue-size", type=int, default=32, help="问答服务排队上限")
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory()
+    processes = []
+    url = args.url
+    try:
+        if url is None:
+            processes, url = _start_stack(args, workdir.name)
+            print(f"问答服务已启动: {url}")
+
+        questions = [f"{i}路公交的首班车是几点" for i in range(args.distinct)]
+        per_client = [args.requests // args.clients + (1 if i < args.requests % args.clients else 0)
+                      for i in range(args.clients)]
+        results, lock = [], threading.Lock()
+        threads = [
+            threading.Thread(target=_client, args=(url, questions, count, results, lock, i))
+            for i, count in enumerate(per_client) if count
+        ]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        statuses = Counter(status for status, _, _, _ in results)
+        ok = [latency for status, latency, _, _ in results if status == 200]
+        print(f"请求 {len(results)} 个, 耗时 {elapsed:.2f} 秒, 吞吐 {len(results) / elapsed:.1f} 请求/秒")
+        print(f"状态码分布: {dict(statuses)}")
+        print(f"成功请求延迟: p50 {percentile(ok, 0.5) * 1000:.0f} ms, p99 {percentile(ok, 0.99) * 1000:.0f} ms")
+        print(f"合并请求 {sum(1 for r in results if r[2])} 个, 答案缓存命中 {sum(1 for r in results if r[3])} 个")
+        print(f"服务端指标: {json.dumps(_get_json(url, '/metrics'), ensure_ascii=False)}")
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+快照基准：比较新节点的两种启动方式——从文档重新入库（加载、分割、嵌入、写入）与导入快照（校验、直接写入），
+并记录导出耗时、快照大小（float32 与 int8，其中附带的 BM25 关键词索引单列）以及导入后检索结果与原库的一致程度
+
+语料为合成文本，每段约一个文本块；嵌入使用带延迟的离线替身（每次请求的往返延迟加每条文本的延迟），
+模拟嵌入 API 的吞吐，实际 API 还受限流与费用约束。导入时统计嵌入调用次数，应为 0。
+一致率 = 导入后与原库对同一组查询返回的前 k 个文本块的重合比例。
+
+用法: python -m benchmarks.bench_snapshot [--sizes 2000,20000] [--dim 1536] [--backend chromadb]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from config import Config
+from benchmarks import fakes
+
+_WORDS = ["检索", "向量", "索引", "文档", "模型", "缓存", "延迟", "吞吐", "分块", "嵌入", "查询", "节点",
+          "快照", "副本", "磁盘", "内存", "网络", "请求", "批量", "并发", "校验", "压缩", "日志", "配置"]
+
+
+def build_corpus(directory: str, chunks: int, per_file: int = 50, seed: int = 0):
+    """生成语料，每段约 CHUNK_SIZE 个字符，返回用于检索的查询列表"""
+    rng = random.Random(seed)
+    queries = []
+    for i in range(0, chunks, per_file):
+        paragraphs = []
+        for j in range(min(per_file, chunks - i)):
+            words = [rng.choice(_WORDS) + str(rng.randint(0, 999)) for _ in range(Config.CHUNK_SIZE // 8)]
+            paragraphs.append(" ".join(words))
+            if rng.random() < 0.01:
+                queries.append(" ".join(words[:6]))
+        with open(os.path.join(directory, f"doc_{i // per_file:05d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(paragraphs))
+    return queries
+
+
+def _use(db_path: str):
+    """切换到指定目录下的向量库、BM25 索引、父段落存储与入库清单"""
+    from app import resources
+
+    Config.VECTOR_DB_PATH = db_path
+    Config.SPARSE_INDEX_PATH = os.path.join(db_path, "sparse_index.sqlite3")
+    Config.DOCSTORE_PATH = os.path.join(db_path, "docstore.sqlite3")
+    Config.INGEST_MANIFEST_PATH = os.path.join(db_path, "ingest_manifest.json")
+    resources.clear()
+
+
+def _top_ids(retriever, queries, k: int):
+    return [{doc.page_content for doc in retriever.search(query, k=k)} for query in queries]
+
+
+def run(size: int, workdir: str, embeddings, k: int) -> dict:
+    from app.data.loader import DocumentLoader
+    from app.data.manifest import IngestManifest
+    from app.data.pipeline import IngestPipeline
+    from app.data.snapshot import SnapshotReader, export_snapshot, import_snapshot
+    from app.rag.retriever import VectorRetriever
+
+    docs_dir = os.path.join(workdir, f"docs_{size}")
+    os.makedirs(docs_dir)
+    queries = build_corpus(docs_dir, size)[:20]
+
+    # 重新入库：从文档加载、分割、嵌入并写入
+    source = os.path.join(workdir, f"source_{size}")
+    _use(source)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        loader = DocumentLoader()
+        retriever = VectorRetriever()
+        pipeline = IngestPipeline(loader, retriever, IngestManifest(Config.INGEST_MANIFEST_PATH), docs_dir)
+        pipeline.run(loader.list_files(docs_dir))
+    row = {"size": size, "chunks": retriever.get_collection_info()["count"], "ingest_s": time.perf_counter() - start}
+    expected = _top_ids(retriever, queries, k)
+
+    for dtype in ("float32", "int8"):
+        path = os.path.join(workdir, f"{size}_{dtype}.snap")
+        _use(source)
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = export_snapshot(VectorRetriever(), path, dtype=dtype)
+        row[f"{dtype}_export_s"] = stats["seconds"]
+        row[f"{dtype}_mb"] = stats["bytes"] / 1024 / 1024
+        reader = SnapshotReader(path)
+        row[f"{dtype}_sparse_mb"] = reader.footer["sections"].get("sparse_index", {"length": 0})["length"] / 1024 / 1024
+        reader.close()
+
+        # 导入到新节点：从打开空库开始计时，含校验
+        _use(os.path.join(workdir, f"target_{size}_{dtype}"))
+        calls = embeddings.stats["texts"]
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            target = VectorRetriever()
+            import_snapshot(target, path)
+        row[f"{dtype}_import_s"] = time.perf_counter() - start
+        row[f"{dtype}_embedded"] = embeddings.stats["texts"] - calls
+        actual = _top_ids(target, queries, k)
+        row[f"{dtype}_agreement"] = (sum(len(a & b) for a, b in zip(expected, actual))
+                                     / max(1, sum(len(a) for a in expected)))
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="快照导入与重新入库的启动耗时对比")
+    parser.add_argument("--sizes", type=str, default="2000,20000", help="文本块数，逗号分隔")
+    parser.add_argument("--dim", type=int, default=1536, help="向量维度")
+    parser.add_argument("--embed-latency", type=float, default=0.2, help="每次嵌入请求的往返延迟（秒）")
+    parser.add_argument("--embed-item-latency", type=float, default=0.001, help="每条文本的嵌入延迟（秒）")
+    parser.add_argument("--backend", type=str, default="chromadb", help="chromadb 或 local")
+    parser.add_argument("--k", type=int, default=5, help="一致率统计的前 k 个结果")
+    args = parser.parse_args()
+
+    os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+    embeddings = fakes.HashEmbeddings(dim=args.dim, latency=args.embed_latency,
+                                      per_item_latency=args.embed_item_latency)
+    fakes.install(embeddings, fakes.ScriptedChatModel())
+    Config.VECTOR_DB_TYPE = args.backend
+    Config.EMBEDDING_CACHE_ENABLED = False
+    Config.HYBRID_SEARCH = True
+    Config.CHUNK_STRATEGY = "recursive"
+    Config.CHUNK_OVERLAP = 0
+    Config.LOADER_WORKERS = 1
+
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in [int(size) for size in args.sizes.split(",")]:
+            rows.append(run(size, workdir, embeddings, args.k))
+
+    print(f"\n后端 {args.backend}, {args.dim} 维, 嵌入延迟 {args.embed_latency * 1000:.0f}ms/请求 + "
+          f"{args.embed_item_latency * 1000:.1f}ms/条")
+    print(f"{'文本块':>7} {'重新入库s':>9} | {'编码':<7} {'导出s':>6} {'大小MB':>7} {'关键词索引MB':>12} {'导入s':>6} "
+          f"{'加速':>6} {'导入嵌入':>8} {'一致率':>7}")
+    for row in rows:
+        for dtype in ("float32", "int8"):
+            print(f"{row['chunks']:>7} {row['ingest_s']:>9.1f} | {dtype:<7} {row[f'{dtype}_export_s']:>6.1f} "
+                  f"{row[f'{dtype}_mb']:>7.1f} {row[f'{dtype}_sparse_mb']:>12.1f} {row[f'{dtype}_import_s']:>6.1f} "
+                  f"{row['ingest_s'] / row[f'{dtype}_import_s']:>5.1f}x {row[f'{dtype}_embedded']:>8} "
+                  f"{row[f'{dtype}_agreement']:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+启动开销基准：在独立子进程中测量启动各阶段的耗时与常驻内存峰值
+
+- import: 导入 main 的耗时，并用 -X importtime 列出累计耗时最多的模块
+- prompt: 交互模式从进程内开始导入到显示提示符的耗时，以及 history 命令的响应耗时
+- query: python main.py --query 的完整耗时（嵌入与聊天模型使用 benchmarks.fakes 中的离线替身）
+
+用法: python -m benchmarks.bench_startup [--runs 5] [--top 10] [--output startup.json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子进程中执行的测量脚本：交互模式下依次输入 history 和 exit，记录每次等待输入的时间点
+_PROMPT_PROBE = r"""
+import builtins, json, sys, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+prompts = []
+commands = iter(["history", "exit"])
+def fake_input(prompt=""):
+    prompts.append(time.perf_counter())
+    return next(commands)
+builtins.input = fake_input
+sys.argv = ["main.py"]
+main.main()
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为KB，macOS 为字节
+    rss_mb = rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+except ImportError:
+    rss_mb = None
+print(json.dumps({"import_s": t1 - t0, "prompt_s": prompts[0] - t0, "history_s": prompts[1] - prompts[0],
+                  "rss_mb": rss_mb}))
+"""
+
+# 先导入 main 再安装替身，替身依赖的 LangChain 模块与真实调用路径一样在首次提问时才加载
+_QUERY_PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import main
+from benchmarks import fakes
+fakes.install()
+sys.argv = ["main.py", "--query", "1路公交的首班车是几点？"]
+main.main()
+print(json.dumps({"query_s": time.perf_counter() - t0}))
+"""
+
+
+def _run_probe(probe: str, workdir: str) -> dict:
+    """在干净的子进程中运行测量脚本"""
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "fake"),
+        "VECTOR_DB_PATH": workdir,
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3")
+    })
+    output = subprocess.run(
+        [sys.executable, "-c", probe],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_profile(top: int):
+    """
+    用 -X importtime 统计导入 main 时各模块的累计耗时
+
+    top: 返回的模块数
+
+    returns: (导入 main 的总耗时秒数, main 直接导入的 [(模块名, 累计秒数), ...])
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    ).stderr
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name[1:].rstrip()
+        entries.append((len(name) - len(name.lstrip()), name.strip(), int(cumulative) / 1e6))
+
+    # importtime 先输出子模块再输出父模块：main 之前、上一个顶层条目之后的第二层条目即 main 直接导入的模块
+    index = next(i for i, (depth, name, _) in enumerate(entries) if depth == 0 and name == "main")
+    children = []
+    for depth, name, seconds in reversed(entries[:index]):
+        if depth == 0:
+            break
+        if depth == 2:
+            children.append((name, seconds))
+    return entries[index][2], sorted(children, key=lambda item: -item[1])[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时与内存基准")
+    parser.add_argument("--runs", type=int, default=5, help="重复次数")
+    parser.add_argument("--top", type=int, default=10, help="列出导入耗时最多的模块数")
+    parser.add_argument("--output", type=str, help="结果 JSON 文件路径")
+    args = parser.parse_args()
+
+    results = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as workdir:
+            result = _run_probe(_PROMPT_PROBE, workdir)
+            result.update(_run_probe(_QUERY_PROBE, workdir))
+            results.append(result)
+
+    summary = {}
+    for key in ["import_s", "prompt_s", "history_s", "query_s", "rss_mb"]:
+        values = [r[key] for r in results if r.get(key) is not None]
+        if values:
+            summary[key] = statistics.median(values)
+            print(f"{key:>10}: 中位数 {statistics.median(values):.3f}  最小 {min(values):.3f}  最大 {max(values):.3f}")
+
+    total, modules = import_profile(args.top)
+    print(f"\n-X importtime: 导入 main 共 {total:.3f} 秒，其中耗时最多的模块:")
+    for name, seconds in modules:
+        print(f"  {name:<40} {seconds:.3f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"runs": results, "median": summary, "imports": modules}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""
+可复现的基准套件：使用离线替身模型（benchmarks.fakes）运行各场景，结果写成 JSON，便于跨提交比较
+
+- ingestion: 不同语料规模下的写入吞吐（嵌入 + 向量库 + 关键词索引）
+- query: 不同语料规模与 RETRIEVAL_K 下的检索延迟、端到端问答延迟、命中率和各阶段耗时
+- concurrency: 多线程并发问答的吞吐与延迟（延迟从整批问题提交时开始计算）
+- startup: 启动耗时（导入 main、构建 QASystem）与首个回答的耗时
+
+每个场景的每组参数都在独立子进程和临时目录中运行；嵌入缓存与答案缓存关闭，保证每次都完整走一遍流程。
+语料、问题和替身模型的输出都是确定的，耗时差异只来自代码本身和注入的模拟延迟。
+
+用法: python -m benchmarks.bench_suite [--scenarios ingestion,query,concurrency,startup]
+                                      [--sizes 500,2000] [--ks 2,4,8] [--output results.json]
+     python -m benchmarks.bench_suite --compare benchmarks/results/baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["ingestion", "query", "concurrency", "startup"]
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _latency_metrics(prefix: str, seconds):
+    return {
+        f"{prefix}_p50_ms": round(_percentile(seconds, 0.5) * 1000, 3),
+        f"{prefix}_p95_ms": round(_percentile(seconds, 0.95) * 1000, 3),
+        f"{prefix}_mean_ms": round(statistics.mean(seconds) * 1000, 3)
+    }
+
+
+# ---------- 子进程中执行的场景 ----------
+
+def _install_fakes(params):
+    from benchmarks import fakes
+    return fakes.install(
+        fakes.HashEmbeddings(dim=params["dim"], latency=params["embed_latency"]),
+        fakes.ScriptedChatModel(latency=params["chat_latency"])
+    )
+
+
+def _ingest(retriever, size: int, seed: int, batch_size: int) -> float:
+    """写入合成语料，返回耗时（秒）"""
+    from benchmarks.corpus import generate_documents
+
+    documents = generate_documents(size, seed=seed)
+    start = time.perf_counter()
+    for i in range(0, len(documents), batch_size):
+        batch = documents[i:i + batch_size]
+        result = retriever.add_documents(batch, ids=[f"doc-{i + j}" for j in range(len(batch))])
+        if not result["success"]:
+            raise RuntimeError(result.get("error"))
+    return time.perf_counter() - start
+
+
+def run_ingestion(params):
+    _install_fakes(params)
+    from app.rag.retriever import VectorRetriever
+
+    seconds = _ingest(VectorRetriever(), params["size"], params["seed"], params["batch_size"])
+    return {
+        "chunks": params["size"],
+        "seconds": round(seconds, 4),
+        "chunks_per_second": round(params["size"] / seconds, 2)
+    }
+
+
+def run_query(params):
+    _install_fakes(params)
+    from config import Config
+    from app import tracing
+    from app.agents.qa_agent import QAAgent
+    from app.rag.retriever import VectorRetriever
+    from benchmarks.corpus import generate_questions
+
+    retriever = VectorRetriever()
+    _ingest(retriever, params["size"], params["seed"], params["batch_size"])
+    agent = QAAgent(use_rag=True, retriever=retriever)
+    Config.RETRIEVAL_K = params["k"]
+    questions = generate_questions(params["questions"], params["size"], seed=params["seed"], calculator_ratio=0.0)
+
+    # 预热：首次查询会初始化索引与连接
+    for question in questions[:3]:
+        agent.rag_chain.retrieve(question)
+
+    retrieval, hits = [], 0
+    for question in questions:
+        start = time.perf_counter()
+        result = agent.rag_chain.retrieve(question)
+        retrieval.append(time.perf_counter() - start)
+        route = int(re.match(r"\D*(\d+)", question).group(1))
+        hits += any(doc.metadata.get("route") == route for doc in result["source_documents"])
+
+    tracing.enable(None)
+    tracing.reset()
+    end_to_end, tokens = [], []
+    for question in questions:
+        start = time.perf_counter()
+        result = agent.invoke(question)
+        end_to_end.append(time.perf_counter() - start)
+        tokens.append((result.get("usage") or {}).get("total_tokens", 0))
+
+    return {
+        **_latency_metrics("retrieval", retrieval),
+        **_latency_metrics("answer", end_to_end),
+        "hit_rate": round(hits / len(questions), 4),
+        "mean_total_tokens": round(statistics.mean(tokens), 1),
+        "stages": {row["stage"]: {"p50_ms": round(row["p50_ms"], 3), "share": round(row["share"], 4)}
+                   for row in tracing.summary()}
+    }
+
+
+def run_concurrency(params):
+    _install_fakes(params)
+    from app.agents.qa_agent import QAAgent
+    from app.rag.retriever import VectorRetriever
+    from benchmarks.corpus import generate_questions
+
+    retriever = VectorRetriever()
+    _ingest(retriever, params["size"], params["seed"], params["batch_size"])
+    agent = QAAgent(use_rag=True, retriever=retriever)
+    level = params["level"]
+    questions = generate_questions(max(params["questions"], level * 4), params["size"], seed=params["seed"])
+    agent.invoke(questions[0])
+
+    def timed(question, submitted):
+        result = agent.invoke(question)
+        return time.perf_counter() - submitted, result["success"]
+
+    with ThreadPoolExecutor(max_workers=level) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(lambda question: timed(question, start), questions))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "questions": len(questions),
+        "failed": sum(1 for _, success in results if not success),
+        "questions_per_second": round(len(questions) / elapsed, 2),
+        **_latency_metrics("latency", [latency for latency, _ in results])
+    }
+
+
+def run_startup(params):
+    # 先导入 main 再安装替身，避免替身模块提前导入的依赖计入导入耗时
+    start = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+    _install_fakes(params)
+    qa_system = main.QASystem()
+    initialized = time.perf_counter()
+    # 检索器与代理在首次提问时才创建，首个回答的耗时包含这部分开销
+    qa_system.agent.invoke("1路公交的首班车是几点？")
+    answered = time.perf_counter()
+    return {
+        "import_seconds": round(imported - start, 4),
+        "init_seconds": round(initialized - imported, 4),
+        "first_answer_seconds": round(answered - initialized, 4)
+    }
+
+
+_RUNNERS = {
+    "ingestion": run_ingestion,
+    "query": run_query,
+    "concurrency": run_concurrency,
+    "startup": run_startup
+}
+
+
+# ---------- 主进程：生成参数组合、启动子进程、汇总与比较结果 ----------
+
+def _cases(args):
+    base = {
+        "seed": args.seed,
+        "dim": args.dim,
+        "embed_latency": args.embed_latency,
+        "chat_latency": args.chat_latency,
+        "batch_size": args.batch_size
+    }
+    sizes = [int(size) for size in args.sizes.split(",")]
+    for scenario in args.scenarios.split(","):
+        if scenario == "ingestion":
+            for size in sizes:
+                yield scenario, {**base, "size": size}
+        elif scenario == "query":
+            for size in sizes:
+                for k in (int(k) for k in args.ks.split(",")):
+                    yield scenario, {**base, "size": size, "k": k, "questions": args.questions}
+        elif scenario == "concurrency":
+            for level in (int(level) for level in args.levels.split(",")):
+                yield scenario, {**base, "size": sizes[0], "level": level, "questions": args.questions}
+        elif scenario == "startup":
+            for run in range(args.startup_runs):
+                yield scenario, {**base, "run": run}
+        else:
+            raise ValueError(f"未知场景: {scenario}，可选: {', '.join(SCENARIOS)}")
+
+
+def _run_case(scenario: str, params) -> dict:
+    """在独立子进程和临时目录中运行一组参数"""
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ)
+        env.update({
+            "OPENAI_API_KEY": "fake",
+            "VECTOR_DB_PATH": workdir,
+            "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+            "HYBRID_SEARCH": "True",
+            "RERANK_ENABLED": "True",
+            "EMBEDDING_CACHE_ENABLED": "False",
+            "ANSWER_CACHE_ENABLED": "False",
+            "TRACE_ENABLED": "False"
+        })
+        process = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_suite", "--worker", scenario, "--params", json.dumps(params)],
+            cwd=ROOT, env=env, capture_output=True, text=True
+        )
+    if process.returncode != 0:
+        raise RuntimeError(f"场景 {scenario} {params} 运行失败:\n{process.stderr[-2000:]}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def _git(*command) -> str:
+    try:
+        return subprocess.run(["git", *command], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def _meta(args) -> dict:
+    return {
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": {key: value for key, value in vars(args).items() if key not in ("worker", "params", "compare")}
+    }
+
+
+def _case_key(result) -> str:
+    return json.dumps([result["scenario"], result["params"]], sort_keys=True)
+
+
+def _higher_is_better(metric: str) -> bool:
+    return "per_second" in metric or metric == "hit_rate"
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> int:
+    """
+    按场景与参数对比两份结果，打印变化并标记超过阈值的回归
+
+    returns: 回归的指标数
+    """
+    previous = {_case_key(result): result["metrics"] for result in baseline["results"]}
+    regressions = 0
+    print(f"\n与基线 {baseline['meta'].get('commit')} 对比（阈值 {threshold:.0%}）:")
+    for result in current["results"]:
+        before = previous.get(_case_key(result))
+        if before is None:
+            continue
+        for metric, value in result["metrics"].items():
+            old = before.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            change = (value - old) / old
+            worse = -change if _higher_is_better(metric) else change
+            flag = ""
+            if worse > threshold:
+                flag = "  <- 回归"
+                regressions += 1
+            label = f"{result['scenario']} {result['label']} {metric}"
+            print(f"  {label:<52} {old:>12.3f} -> {value:>12.3f} ({change:+.1%}){flag}")
+    return regressions
+
+
+def _label(scenario: str, params) -> str:
+    keys = {"ingestion": ["size"], "query": ["size", "k"], "concurrency": ["level"], "startup": ["run"]}[scenario]
+    return " ".join(f"{key}={params[key]}" for key in keys)
+
+
+def _summary(metrics) -> str:
+    return ", ".join(f"{key}={value}" for key, value in metrics.items() if not isinstance(value, dict))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="可复现的离线基准套件")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="要运行的场景，逗号分隔")
+    parser.add_argument("--sizes", default="500,2000", help="语料规模（文本块数），逗号分隔")
+    parser.add_argument("--ks", default="2,4,8", help="query 场景的 RETRIEVAL_K，逗号分隔")
+    parser.add_argument("--levels", default="1,4,16", help="concurrency 场景的并发线程数，逗号分隔")
+    parser.add_argument("--questions", type=int, default=50, help="每组参数的问题数")
+    parser.add_argument("--startup-runs", type=int, default=3, help="startup 场景的重复次数")
+    parser.add_argument("--dim", type=int, default=256, help="替身嵌入向量维度")
+    parser.add_argument("--embed-latency", type=float, default=0.01, help="替身嵌入模型每次调用的延迟（秒）")
+    parser.add_argument("--chat-latency", type=float, default=0.05, help="替身聊天模型每次调用的延迟（秒）")
+    parser.add_argument("--batch-size", type=int, default=256, help="写入语料时每批的文本块数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, help="结果文件路径，默认 benchmarks/results/<时间>_<提交>.json")
+    parser.add_argument("--compare", type=str, help="基线结果文件，对比并在出现回归时以非零状态退出")
+    parser.add_argument("--threshold", type=float, default=0.1, help="判定回归的相对变化阈值")
+    parser.add_argument("--worker", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--params", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(_RUNNERS[args.worker](json.loads(args.params))))
+        return
+
+    report = {"meta": _meta(args), "results": []}
+    for scenario, params in _cases(args):
+        label = _label(scenario, params)
+        metrics = _run_case(scenario, params)
+        report["results"].append({"scenario": scenario, "label": label, "params": params, "metrics": metrics})
+        print(f"{scenario:<12} {label:<16} {_summary(metrics)}")
+
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results",
+        f"{datetime.now():%Y%m%d_%H%M%S}_{report['meta']['commit'] or 'nogit'}.json"
+    )
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入: {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+向量库后端基准：比较 Chroma 与内置本地向量库（float32/int8/PQ 编码、维度截断、全精度重排，精确/IVF 检索）
+在不同规模下的写入耗时、加载耗时、常驻内存、每行编码字节数与查询延迟，并以本地 float32 精确检索的结果为基准计算召回率
+
+向量由带簇结构的随机分布生成（不经过嵌入模型），每个用例在独立子进程中先写入、再在新进程中打开并查询，
+加载耗时为打开向量库并完成第一次查询的时间。--decay 大于 0 时各维的尺度按 exp(-decay × 维度序号 / 维度) 递减，
+模拟 Matryoshka 嵌入把主要信息集中在前面若干维的特点，用于评估维度截断。
+
+用法: python -m benchmarks.bench_vector_store [--sizes 10000,100000,1000000] [--dim 128] [--decay 0]
+      [--backends chromadb,local-float32,local-int8,...] [--chroma-max 100000]
+      压缩对比: python -m benchmarks.bench_vector_store --sizes 100000 --decay 3 --backends compression
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# 后端名称 -> 环境变量
+BACKENDS = {
+    "chromadb": {"VECTOR_DB_TYPE": "chromadb"},
+    "local-float32": {"VECTOR_DB_TYPE": "local", "LOCAL_INDEX_DTYPE": "float32", "LOCAL_INDEX_TYPE": "exact"},
+    "local-int8": {"VECTOR_DB_TYPE": "local", "LOCAL_INDEX_DTYPE": "int8", "LOCAL_INDEX_TYPE": "exact"},
+    "local-ivf": {"VECTOR_DB_TYPE": "local", "LOCAL_INDEX_DTYPE": "float32", "LOCAL_INDEX_TYPE": "ivf"},
+    "local-int8-ivf": {"VECTOR_DB_TYPE": "local", "LOCAL_INDEX_DTYPE": "int8", "LOCAL_INDEX_TYPE": "ivf"},
+    "local-int8-rescore": {"VECTOR_DB_TYPE": "local", "LOCAL_INDEX_DTYPE": "int8", "LOCAL_INDEX_TYPE": "exact",
+                           "LOCAL_INDEX_RESCORE": "4"},
+    "local-pq": {"VECTOR_DB_TYPE": "local", "LOCAL_INDEX_DTYPE": "pq", "LOCAL_INDEX_TYPE": "exact"},
+    "local-pq-rescore": {"VECTOR_DB_TYPE": "local", "LOCAL_INDEX_DTYPE": "pq", "LOCAL_INDEX_TYPE": "exact",
+                         "LOCAL_INDEX_RESCORE": "10"},
+    "local-pq-ivf-rescore": {"VECTOR_DB_TYPE": "local", "LOCAL_INDEX_DTYPE": "pq", "LOCAL_INDEX_TYPE": "ivf",
+                             "LOCAL_INDEX_RESCORE": "10"},
+    "local-half-dims": {"VECTOR_DB_TYPE": "local", "LOCAL_INDEX_TYPE": "exact", "LOCAL_INDEX_DIMS": "half"},
+    "local-half-dims-rescore": {"VECTOR_DB_TYPE": "local", "LOCAL_INDEX_TYPE": "exact", "LOCAL_INDEX_DIMS": "half",
+                                "LOCAL_INDEX_RESCORE": "4"}
+}
+# --backends 可使用的分组
+GROUPS = {
+    "default": ["chromadb", "local-float32", "local-int8", "local-ivf", "local-int8-ivf"],
+    "compression": ["local-float32", "local-int8", "local-int8-rescore", "local-pq", "local-pq-rescore",
+                    "local-pq-ivf-rescore", "local-half-dims", "local-half-dims-rescore"]
+}
+BASELINE = "local-float32"
+BATCH_SIZE = 5000
+CLUSTERS = 256
+
+
+class ClusteredEmbeddings:
+    """
+    按文本中的序号生成带簇结构的确定性向量：文本形如 "chunk <序号>"，
+    同一批次的向量由批次首个序号作种子一次生成，写入时批次划分固定，因此各后端得到相同的向量
+    """
+
+    def __init__(self, dim: int, seed: int = 0, decay: float = 0.0):
+        self.dim = dim
+        self.centers = np.random.default_rng(seed).standard_normal((CLUSTERS, dim)).astype(np.float32)
+        self.scale = np.exp(-decay * np.arange(dim) / dim).astype(np.float32)
+
+    def _sample(self, rng: np.random.Generator, count: int) -> np.ndarray:
+        labels = rng.integers(0, CLUSTERS, count)
+        noise = rng.standard_normal((count, self.dim)).astype(np.float32)
+        return (self.centers[labels] + 0.6 * noise) * self.scale
+
+    def vectors(self, start: int, count: int) -> np.ndarray:
+        return self._sample(np.random.default_rng(start + 1), count)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.vectors(int(texts[0].split()[1]), len(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def queries(self, count: int, seed: int = 12345) -> np.ndarray:
+        return self._sample(np.random.default_rng(seed), count)
+
+
+def _rss_mb():
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+    except ImportError:
+        return None
+
+
+def _disk_mb(path: str) -> float:
+    total = 0
+    for directory, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+    return total / (1024 * 1024)
+
+
+def _install(params: dict) -> ClusteredEmbeddings:
+    from langchain_core.embeddings import Embeddings
+    from benchmarks import fakes
+
+    embeddings = type("ClusteredEmbeddings", (ClusteredEmbeddings, Embeddings), {})(params["dim"],
+                                                                                     decay=params.get("decay", 0.0))
+    fakes.install(embeddings=embeddings)
+    return embeddings
+
+
+def worker_build(params: dict) -> dict:
+    """写入 size 条向量，返回写入耗时"""
+    from app import resources
+
+    _install(params)
+    db = resources.get_vector_store()
+    size = params["size"]
+    start_time = time.perf_counter()
+    for start in range(0, size, BATCH_SIZE):
+        count = min(BATCH_SIZE, size - start)
+        texts = [f"chunk {start + i}" for i in range(count)]
+        db.add_texts(texts, metadatas=[{"source": f"doc_{(start + i) // 10}.txt"} for i in range(count)],
+                     ids=[str(start + i) for i in range(count)])
+    if hasattr(db, "build_ivf") and db.index_type == "ivf":
+        # 写入过程中按规模增长重建过 IVF，最后再按全部数据重建一次，使各规模的索引状态一致
+        db.build_ivf()
+    return {"ingest_seconds": time.perf_counter() - start_time, "ingest_rss_mb": _rss_mb()}
+
+
+def worker_query(params: dict) -> dict:
+    """在新进程中打开向量库，返回加载耗时（含后端模块导入，不含公共依赖）、查询延迟、内存与前 k 个结果的编号"""
+    from app import resources
+
+    embeddings = _install(params)
+    start_time = time.perf_counter()
+    db = resources.get_vector_store()
+    queries = embeddings.queries(params["queries"]).tolist()
+    db.similarity_search_by_vector(queries[0], k=params["k"])
+    load_seconds = time.perf_counter() - start_time
+
+    latencies, results = [], []
+    for query in queries:
+        t0 = time.perf_counter()
+        documents = db.similarity_search_by_vector(query, k=params["k"])
+        latencies.append(time.perf_counter() - t0)
+        results.append([document.id for document in documents])
+    latencies.sort()
+    stats = db.get_stats() if hasattr(db, "get_stats") else {}
+    return {
+        "load_seconds": load_seconds,
+        "bytes_per_row": stats.get("bytes_per_row"),
+        "query_p50_ms": statistics.median(latencies) * 1000,
+        "query_p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+        "query_rss_mb": _rss_mb(),
+        "ids": results
+    }
+
+
+def _run_worker(mode: str, backend: str, params: dict, workdir: str) -> dict:
+    env = dict(os.environ)
+    env.update({key: str(params["dim"] // 2) if value == "half" else value for key, value in BACKENDS[backend].items()})
+    env.update({
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "fake"),
+        "VECTOR_DB_PATH": workdir,
+        "EMBEDDING_CACHE_ENABLED": "False",
+        "ANONYMIZED_TELEMETRY": "False"
+    })
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_vector_store", "--worker", mode, "--params", json.dumps(params)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_case(backend: str, size: int, args) -> dict:
+    params = {"size": size, "dim": args.dim, "k": args.k, "queries": args.queries, "decay": args.decay}
+    workdir = tempfile.mkdtemp(prefix="bench_vs_")
+    try:
+        result = {"backend": backend, "size": size}
+        result.update(_run_worker("build", backend, params, workdir))
+        result["disk_mb"] = _disk_mb(workdir)
+        result.update(_run_worker("query", backend, params, workdir))
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _recall(results: List[List[str]], truth: List[List[str]]) -> float:
+    return statistics.mean(len(set(r) & set(t)) / max(len(t), 1) for r, t in zip(results, truth))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量库后端基准")
+    parser.add_argument("--sizes", type=str, default="10000,100000,1000000", help="向量条数，逗号分隔")
+    parser.add_argument("--backends", type=str, default="default",
+                        help=f"后端或分组（{', '.join(GROUPS)}），逗号分隔，可选后端: {', '.join(BACKENDS)}")
+    parser.add_argument("--dim", type=int, default=128, help="向量维度")
+    parser.add_argument("--decay", type=float, default=0.0, help="各维尺度的衰减系数，0 表示各维同分布")
+    parser.add_argument("--k", type=int, default=10, help="每次查询返回的条数")
+    parser.add_argument("--queries", type=int, default=200, help="查询次数")
+    parser.add_argument("--chroma-max", type=int, default=100000, help="Chroma 参与的最大规模（写入较慢）")
+    parser.add_argument("--output", type=str, help="结果 JSON 文件路径")
+    parser.add_argument("--worker", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--params", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker = worker_build if args.worker == "build" else worker_query
+        print(json.dumps(worker(json.loads(args.params))))
+        return
+
+    backends = []
+    for name in args.backends.split(","):
+        backends.extend(GROUPS.get(name, [name]))
+    backends = list(dict.fromkeys(backends))
+    rows = []
+    for size in [int(s) for s in args.sizes.split(",")]:
+        truth = None
+        # 先跑基准后端，其余后端的召回率以它的结果为准
+        for backend in sorted(backends, key=lambda name: name != BASELINE):
+            if backend == "chromadb" and size > args.chroma_max:
+                print(f"跳过 {backend} @ {size}（超过 --chroma-max）")
+                continue
+            result = run_case(backend, size, args)
+            if backend == BASELINE:
+                truth = result["ids"]
+            result["recall"] = _recall(result.pop("ids"), truth) if truth else None
+            rows.append(result)
+            print(f"{backend:<24} {size:>8}  写入 {result['ingest_seconds']:7.1f}s  "
+                  f"磁盘 {result['disk_mb']:7.1f}MB  每行 {result['bytes_per_row'] or '-':>4}B  "
+                  f"加载 {result['load_seconds']:6.2f}s  "
+                  f"内存 {result['query_rss_mb']:7.1f}MB  p50 {result['query_p50_ms']:7.2f}ms  "
+                  f"p95 {result['query_p95_ms']:7.2f}ms  召回 {result['recall'] if result['recall'] is not None else '-'}",
+                  flush=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"dim": args.dim, "k": args.k, "decay": args.decay, "results": rows}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
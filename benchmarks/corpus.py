@@ -0,0 +1,157 @@
+"""
+合成语料生成器：生成 txt / md / pdf 混合格式的测试文档，以及直接写入向量库的文本块和对应的测试问题
+"""
+
+import os
+import random
+
+_STATIONS = ["火车站", "体育中心", "人民广场", "大学城", "科技园", "市民中心", "机场", "港口",
+             "老城区", "新区政府", "湿地公园", "会展中心", "汽车站", "医院", "图书馆", "动物园"]
+
+_WORDS = (
+    "bus route station transfer metro line ticket schedule policy school "
+    "homework training reform district office report service passenger "
+    "公交 地铁 线路 站点 换乘 票价 时刻表 政策 学校 作业 培训 改革 区县 报告 服务 乘客"
+).split()
+
+
+def _paragraphs(rng: random.Random, count: int, ascii_only: bool = False):
+    """生成随机段落"""
+    words = [w for w in _WORDS if w.isascii()] if ascii_only else _WORDS
+    for i in range(count):
+        sentence = " ".join(rng.choice(words) for _ in range(rng.randint(40, 90)))
+        yield f"{sentence} No.{rng.randint(1, 999)}."
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages):
+    """
+    手工写出只含 Helvetica 文本的最小 PDF，不依赖第三方库
+
+    path: 输出路径
+    pages: 每页文本行列表的列表
+    """
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        stream = "BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(
+            f"({_pdf_escape(line)}) '" for line in lines
+        ) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        content_id = len(objects)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        )
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def generate_corpus(directory: str, files: int = 60, paragraphs: int = 40, seed: int = 0):
+    """
+    生成混合格式语料
+
+    directory: 输出目录
+    files: 文件数量，按 txt / md / pdf 轮流生成
+    paragraphs: 每个文件的段落数
+    seed: 随机种子，相同参数生成相同语料
+
+    returns: 生成的文件路径列表
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+
+    for i in range(files):
+        kind = ("txt", "md", "pdf")[i % 3]
+        path = os.path.join(directory, f"doc_{i:05d}.{kind}")
+
+        if kind == "pdf":
+            # 每页约 60 行短文本
+            lines = []
+            for paragraph in _paragraphs(rng, paragraphs, ascii_only=True):
+                lines.extend(paragraph[j:j + 100] for j in range(0, len(paragraph), 100))
+            write_pdf(path, [lines[j:j + 60] for j in range(0, len(lines), 60)])
+        elif kind == "md":
+            with open(path, "w", encoding="utf-8") as f:
+                for j, paragraph in enumerate(_paragraphs(rng, paragraphs)):
+                    if j % 5 == 0:
+                        f.write(f"\n## 第{j // 5 + 1}节\n\n")
+                    f.write(paragraph + "\n\n")
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n\n".join(_paragraphs(rng, paragraphs)))
+
+        paths.append(path)
+
+    return paths
+
+
+def generate_documents(count: int, seed: int = 0):
+    """
+    生成可直接写入向量库的文本块，每块描述一条公交线路，并带有随机填充词
+
+    count: 文本块数量
+    seed: 随机种子，相同参数生成相同文本块
+
+    returns: Document 列表，metadata 中包含 source 与 route
+    """
+    from langchain_core.documents import Document
+
+    rng = random.Random(seed)
+    documents = []
+    for i in range(count):
+        route = i + 1
+        start, end, transfer = rng.sample(_STATIONS, 3)
+        text = (
+            f"{route}路公交从{start}发车，终点站为{end}，途经{transfer}可换乘地铁{rng.randint(1, 12)}号线。"
+            f"{route}路首班车{rng.randint(5, 7)}:{rng.choice(['00', '30'])}，"
+            f"末班车{rng.randint(21, 23)}:{rng.choice(['00', '30'])}，票价{rng.randint(1, 3)}元。"
+            + " ".join(rng.choice(_WORDS) for _ in range(rng.randint(8, 20)))
+        )
+        documents.append(Document(page_content=text, metadata={
+            "source": f"synthetic/routes_{i // 100:04d}.txt",
+            "route": route
+        }))
+    return documents
+
+
+def generate_questions(count: int, documents: int, seed: int = 0, calculator_ratio: float = 0.1):
+    """
+    生成针对 generate_documents 语料的测试问题
+
+    count: 问题数量
+    documents: 语料中的文本块数量，问题只涉及已存在的线路
+    seed: 随机种子
+    calculator_ratio: 需要调用计算器工具的问题比例
+
+    returns: 问题字符串列表
+    """
+    rng = random.Random(seed + 1)
+    templates = ["{route}路公交的首班车是几点？", "{route}路从哪里发车，终点站是哪里？",
+                 "坐{route}路可以换乘哪条地铁线？", "{route}路的票价是多少？"]
+    questions = []
+    for _ in range(count):
+        if rng.random() < calculator_ratio:
+            questions.append(f"计算 {rng.randint(2, 99)} * {rng.randint(2, 99)} + {rng.randint(1, 999)}")
+        else:
+            questions.append(rng.choice(templates).format(route=rng.randint(1, max(1, documents))))
+    return questions
@@ -0,0 +1,240 @@
+"""
+本地伪 OpenAI 兼容服务：用于在不访问真实 API 的情况下测试并发、限流与重试
+
+- POST /v1/embeddings: 返回基于文本哈希的确定性向量
+- POST /v1/chat/completions: 返回固定模板的回答，支持 stream=true 的 SSE 流式输出
+- 可注入固定延迟、每条文本的额外延迟、在途请求数上限（超出返回 429）和随机 429
+
+用法: python -m benchmarks.fake_openai_server --port 8900 --latency 0.05 --max-in-flight 4
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def hash_vector(text: str, dim: int):
+    """根据文本哈希生成单位向量"""
+    values = []
+    counter = 0
+    while len(values) < dim:
+        digest = hashlib.sha256(f"{counter}\0{text}".encode("utf-8")).digest()
+        values.extend((b - 127.5) / 127.5 for b in digest)
+        counter += 1
+    values = values[:dim]
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return [v / norm for v in values]
+
+
+class FakeOpenAIServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, dim: int = 256, latency: float = 0.0,
+                 per_item_latency: float = 0.0, max_in_flight: int = 0, error_rate: float = 0.0, seed: int = 0,
+                 chat_latency: float = 0.0):
+        """
+        host, port: 监听地址，port 为 0 时自动分配
+        dim: 嵌入向量维度
+        latency: 每个请求的固定延迟（秒）
+        per_item_latency: 每条输入的额外延迟（秒）
+        max_in_flight: 同时处理的请求数上限，超出时返回 429；0 表示不限制
+        error_rate: 随机返回 429 的概率
+        seed: 随机种子
+        chat_latency: 每个对话请求的延迟（秒），流式输出时平均分摊到各个增量块
+        """
+        self.dim = dim
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.max_in_flight = max_in_flight
+        self.error_rate = error_rate
+        self.chat_latency = chat_latency
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+        self.stats = {
+            "requests": 0,
+            "rate_limited": 0,
+            "items": 0,
+            "chat_requests": 0,
+            "peak_in_flight": 0
+        }
+
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止服务"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _admit(self) -> bool:
+        """登记一个在途请求，超出上限或命中随机错误时拒绝"""
+        with self._lock:
+            self.stats["requests"] += 1
+            overloaded = self.max_in_flight and self._in_flight >= self.max_in_flight
+            if overloaded or (self.error_rate and self._random.random() < self.error_rate):
+                self.stats["rate_limited"] += 1
+                return False
+            self._in_flight += 1
+            self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self._in_flight)
+            return True
+
+    def _leave(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def embeddings(self, body: dict) -> dict:
+        """处理嵌入请求"""
+        inputs = body.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        with self._lock:
+            self.stats["items"] += len(inputs)
+
+        time.sleep(self.latency + self.per_item_latency * len(inputs))
+        data = [
+            {"object": "embedding", "index": i, "embedding": hash_vector(json.dumps(item, ensure_ascii=False), self.dim)}
+            for i, item in enumerate(inputs)
+        ]
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "fake-embedding"),
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)}
+        }
+
+    def chat_answer(self, body: dict) -> str:
+        """根据最后一条用户消息生成确定性的回答"""
+        question = ""
+        for message in reversed(body.get("messages", [])):
+            if message.get("role") == "user":
+                content = message.get("content")
+                question = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+                break
+        with self._lock:
+            self.stats["chat_requests"] += 1
+        digest = hashlib.sha256(question.encode("utf-8")).hexdigest()[:8]
+        return f"这是针对问题（{len(question)} 字）的模拟回答，编号 {digest}。"
+
+    def chat_completion(self, body: dict) -> dict:
+        """处理非流式对话请求"""
+        answer = self.chat_answer(body)
+        time.sleep(self.chat_latency)
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake-chat"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 1, "completion_tokens": len(answer), "total_tokens": len(answer) + 1}
+        }
+
+    def chat_chunks(self, body: dict):
+        """处理流式对话请求，逐块产出 chat.completion.chunk"""
+        answer = self.chat_answer(body)
+        pieces = [answer[i:i + 4] for i in range(0, len(answer), 4)]
+        delay = self.chat_latency / (len(pieces) or 1)
+        base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model", "fake-chat")}
+        for i, piece in enumerate(pieces):
+            time.sleep(delay)
+            delta = {"content": piece} if i else {"role": "assistant", "content": piece}
+            yield dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}])
+        yield dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, chunks):
+                # 不使用分块编码，写完后关闭连接表示响应结束
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for chunk in chunks:
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+
+                if not server._admit():
+                    self._send(429, {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error"}})
+                    return
+                try:
+                    if self.path.endswith("/embeddings"):
+                        self._send(200, server.embeddings(body))
+                    elif self.path.endswith("/chat/completions"):
+                        if body.get("stream"):
+                            self._send_stream(server.chat_chunks(body))
+                        else:
+                            self._send(200, server.chat_completion(body))
+                    else:
+                        self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+                finally:
+                    server._leave()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地伪 OpenAI 兼容服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--per-item-latency", type=float, default=0.0)
+    parser.add_argument("--max-in-flight", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--chat-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(args.host, args.port, dim=args.dim, latency=args.latency,
+                              per_item_latency=args.per_item_latency, max_in_flight=args.max_in_flight,
+                              error_rate=args.error_rate, chat_latency=args.chat_latency)
+    print(f"伪 OpenAI 服务已启动: {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
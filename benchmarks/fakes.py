@@ -0,0 +1,196 @@
+"""
+离线替身模型：确定性的哈希嵌入模型与脚本化聊天模型，用于在不访问 API 的情况下对检索、RAG 链和代理做基准测试
+
+- HashEmbeddings: 按词（中文按单字）做特征哈希，相同文本得到相同向量，词重叠越多的文本向量越相近
+- ScriptedChatModel: 按脚本或默认规则回答，支持工具调用、流式输出，可配置首字延迟和逐块延迟
+- install(): 替换 langchain_openai 中的 OpenAIEmbeddings 与 ChatOpenAI，应用代码无需修改即可使用替身，
+  同时保留应用自身的并发、缓存等包装层
+"""
+
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field
+
+from app.rag.tokens import count_tokens
+
+_TOKEN_PATTERN = re.compile(r"[a-zA-Z0-9_.]+|[^\sa-zA-Z0-9_.]")
+_EXPRESSION_PATTERN = re.compile(r"[\d\.\s]*\d[\d\.\s]*(?:[\+\-\*/][\s\(\)]*[\d\.]+[\s\)]*)+")
+
+
+@lru_cache(maxsize=65536)
+def _feature(token: str, dim: int):
+    """词的哈希特征：(维度下标, 符号)"""
+    digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+    value = int.from_bytes(digest, "little")
+    return value % dim, 1.0 if (value >> 63) & 1 else -1.0
+
+
+class HashEmbeddings(Embeddings):
+    def __init__(self, dim: int = 256, latency: float = 0.0, per_item_latency: float = 0.0):
+        """
+        dim: 向量维度
+        latency: 每次调用的固定延迟（秒），模拟网络往返
+        per_item_latency: 每条文本的额外延迟（秒）
+        """
+        self.dim = dim
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self._lock = threading.Lock()
+        self.stats = {
+            "calls": 0,
+            "texts": 0
+        }
+
+    def _vector(self, text: str) -> List[float]:
+        values = [0.0] * self.dim
+        for token in _TOKEN_PATTERN.findall(text.lower()):
+            index, sign = _feature(token, self.dim)
+            values[index] += sign
+        norm = math.sqrt(sum(v * v for v in values))
+        if not norm:
+            # 空文本也返回确定性的单位向量
+            values[0], norm = 1.0, 1.0
+        return [v / norm for v in values]
+
+    def _wait(self, count: int):
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["texts"] += count
+        delay = self.latency + self.per_item_latency * count
+        if delay:
+            time.sleep(delay)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._wait(len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self._wait(1)
+        return self._vector(text)
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    脚本化聊天模型
+
+    script 为空时使用默认规则：绑定了 calculator 工具且问题中含算式时先调用工具，
+    收到工具结果后给出最终回答；其他问题直接给出引用问题原文的固定格式回答。
+    script 不为空时按顺序循环返回其中的回答。
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+    script: List[str] = Field(default_factory=list)
+    tool_names: List[str] = Field(default_factory=list)
+    stats: Dict[str, int] = Field(default_factory=lambda: {"calls": 0, "tool_calls": 0})
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        names = [getattr(tool, "name", None) or getattr(tool, "__name__", str(tool)) for tool in tools]
+        # 浅拷贝，副本与原模型共享 stats
+        return self.model_copy(update={"tool_names": names})
+
+    @staticmethod
+    def _question(messages: List[BaseMessage]) -> str:
+        """取最后一条用户消息中的问题（去掉检索上下文）"""
+        for message in reversed(messages):
+            if isinstance(message, HumanMessage):
+                content = message.content if isinstance(message.content, str) else str(message.content)
+                return content.rsplit("问题：", 1)[-1].strip()
+        return ""
+
+    def _respond(self, messages: List[BaseMessage]) -> AIMessage:
+        self.stats["calls"] += 1
+        if self.script:
+            return AIMessage(content=self.script[(self.stats["calls"] - 1) % len(self.script)])
+
+        last = messages[-1] if messages else None
+        if isinstance(last, ToolMessage):
+            return AIMessage(content=f"计算结果是 {last.content}。")
+
+        question = self._question(messages)
+        match = _EXPRESSION_PATTERN.search(question)
+        if "calculator" in self.tool_names and match:
+            self.stats["tool_calls"] += 1
+            return AIMessage(content="", tool_calls=[{
+                "name": "calculator",
+                "args": {"expression": match.group(0).strip()},
+                "id": f"call_{self.stats['calls']}",
+                "type": "tool_call"
+            }])
+        return AIMessage(content=f"根据资料，关于“{question[:40]}”的回答是：请参考上下文中的相关内容。")
+
+    def _usage(self, messages: List[BaseMessage], content: str) -> Dict[str, int]:
+        input_tokens = sum(count_tokens(m.content if isinstance(m.content, str) else str(m.content)) + 4
+                           for m in messages)
+        output_tokens = count_tokens(content)
+        return {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens
+        }
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        message = self._respond(messages)
+        message.usage_metadata = self._usage(messages, message.content)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        if self.latency:
+            time.sleep(self.latency)
+        message = self._respond(messages)
+        if message.tool_calls:
+            chunk = AIMessageChunk(content="", tool_call_chunks=[{
+                "name": call["name"],
+                "args": json.dumps(call["args"], ensure_ascii=False),
+                "id": call["id"],
+                "index": 0
+            } for call in message.tool_calls], usage_metadata=self._usage(messages, ""))
+            yield ChatGenerationChunk(message=chunk)
+            return
+
+        content = message.content
+        for start in range(0, len(content), 4):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            piece = AIMessageChunk(content=content[start:start + 4])
+            yield ChatGenerationChunk(message=piece)
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, content)))
+
+
+def install(embeddings: Optional[Embeddings] = None, chat_model: Optional[BaseChatModel] = None):
+    """
+    用替身替换 langchain_openai 中的嵌入模型和聊天模型，并清空共享资源注册表
+
+    embeddings: 嵌入模型，默认使用 HashEmbeddings()
+    chat_model: 聊天模型，默认使用 ScriptedChatModel()
+
+    returns: (嵌入模型, 聊天模型)
+    """
+    import langchain_openai
+    from app import resources
+
+    embeddings = embeddings or HashEmbeddings()
+    chat_model = chat_model or ScriptedChatModel()
+    langchain_openai.OpenAIEmbeddings = lambda **kwargs: embeddings
+    langchain_openai.ChatOpenAI = lambda **kwargs: chat_model
+    resources.clear()
+    return embeddings, chat_model
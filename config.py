@@ -18,13 +18,94 @@ class Config:
     TEMPERATURE = 0.5
     
     # 向量数据库配置
-    VECTOR_DB_TYPE = os.getenv("VECTOR_DB_TYPE", "chromadb")
+    VECTOR_DB_TYPE = os.getenv("VECTOR_DB_TYPE", "chromadb")  # chromadb 或 local（内置的内存映射向量库）
     VECTOR_DB_PATH = os.getenv("VECTOR_DB_PATH", "./data/vector_db")
+    LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float32")  # 本地向量库检索用的向量编码：float32、int8 或 pq（乘积量化）
+    LOCAL_INDEX_DIMS = int(os.getenv("LOCAL_INDEX_DIMS", "0"))  # 检索时只用向量的前 N 维（Matryoshka 截断），0表示不截断
+    LOCAL_PQ_SUBVECTORS = int(os.getenv("LOCAL_PQ_SUBVECTORS", "0"))  # PQ 子向量个数（每行字节数），0表示每8维一个
+    LOCAL_INDEX_RESCORE = int(os.getenv("LOCAL_INDEX_RESCORE", "0"))  # 大于0时保存全精度向量，对前 k×N 个候选按全精度重排
+    LOCAL_INDEX_TYPE = os.getenv("LOCAL_INDEX_TYPE", "auto")  # exact、ivf 或 auto（行数达到 LOCAL_IVF_MIN_ROWS 后使用 IVF）
+    LOCAL_IVF_MIN_ROWS = int(os.getenv("LOCAL_IVF_MIN_ROWS", "50000"))
+    LOCAL_IVF_NPROBE = int(os.getenv("LOCAL_IVF_NPROBE", "16"))  # IVF 每次查询扫描的簇数
+    LOCAL_IVF_NLIST = int(os.getenv("LOCAL_IVF_NLIST", "0"))  # IVF 簇数，0表示按行数的平方根自动确定
+    LOCAL_INDEX_FIELDS = [field.strip() for field in os.getenv("LOCAL_INDEX_FIELDS", "source,file_type,ingested_at,tags").split(",") if field.strip()]  # 本地向量库建立元数据索引的字段，用于过滤检索
+    INGEST_MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH", os.path.join(VECTOR_DB_PATH, "ingest_manifest.json"))
     
     # RAG配置
     CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))  # 自定义文档存储时的分块大小
     CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))  # 自定义文档存储时的分块重叠大小（一般为块大小的1/5）
+    CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "recursive")  # recursive（按 CHUNK_SIZE 字符递归分割）或 structured（按标题、页与段落分割，按词元计长；切换后需 --rebuild 重新入库）
+    PARENT_CHUNK_TOKENS = int(os.getenv("PARENT_CHUNK_TOKENS", "512"))  # 父段落（检索命中后作为上下文）的词元上限
+    CHILD_CHUNK_TOKENS = int(os.getenv("CHILD_CHUNK_TOKENS", "256"))  # 子块（写入向量库用于检索）的词元上限
+    CHILD_CHUNK_OVERLAP = int(os.getenv("CHILD_CHUNK_OVERLAP", "0"))  # 相邻子块重叠的词元数
+    PARENT_RETRIEVAL = os.getenv("PARENT_RETRIEVAL", str(CHUNK_STRATEGY == "structured")).lower() == "true"  # 检索命中子块后以父段落作为上下文，同一父段落只出现一次；默认随 structured 开启
+    DOCSTORE_PATH = os.getenv("DOCSTORE_PATH", os.path.join(VECTOR_DB_PATH, "docstore.sqlite3"))  # 父段落存储
     RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "4"))
+    HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "False").lower() == "true"  # 稠密向量与BM25关键词混合检索，开启后首次启动从向量库补建关键词索引
+    HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))  # 混合检索时每路召回的候选数
+    RERANK_ENABLED = os.getenv("RERANK_ENABLED", "False").lower() == "true"  # 检索后合并重叠块、MMR去冗余并按预算打包
+    RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", "12"))  # 检索后处理前过量召回的候选数
+    MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))  # MMR相关度权重，越小越强调多样性
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))  # 上下文词元预算，0表示不限制
+    RRF_K = int(os.getenv("RRF_K", "60"))  # 倒数排名融合的平滑常数
+    HYBRID_SPARSE_WEIGHT = float(os.getenv("HYBRID_SPARSE_WEIGHT", "1.0"))  # 融合时BM25关键词一路的权重（向量一路为1）
+    HYBRID_EXACT_MATCH = os.getenv("HYBRID_EXACT_MATCH", "True").lower() == "true"  # 查询中的编号（线路号、型号等）只在少数文档中全部出现时，这些文档排在最前
+    SPARSE_INDEX_PATH = os.getenv("SPARSE_INDEX_PATH", os.path.join(VECTOR_DB_PATH, "sparse_index.sqlite3"))
+    LOADER_WORKERS = int(os.getenv("LOADER_WORKERS", "1"))  # 文档加载与分割的并行进程数，0表示使用全部CPU核心
+    INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))  # 每批嵌入并写入向量数据库的文本块数
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "8"))  # 加载与写入之间最多缓存的文件数
+    
+    # 嵌入请求配置
+    EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))  # 同时在途的嵌入请求数，被限流时自动降低
+    EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "8000"))  # 每个嵌入请求的词元预算
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))  # 每个嵌入请求的最大文本数
+    EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+    
+    # 嵌入缓存配置
+    EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "False").lower() == "true"
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./data/embedding_cache.sqlite3")
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))  # 超出后按最近访问时间淘汰
+    
+    # 语义答案缓存配置
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "False").lower() == "true"
+    ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # 命中所需的最低余弦相似度
+    ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))  # 缓存有效期（秒），0表示不过期
+    ANSWER_CACHE_CAPACITY = int(os.getenv("ANSWER_CACHE_CAPACITY", "1000"))
+    
+    # 对话记忆配置
+    MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1200"))  # 历史消息（摘要+最近轮次）的词元预算，0表示不限制
+    MEMORY_RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", "4"))  # 保留原文的最近轮数，更早的轮次合并为摘要
+    MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))  # 摘要的词元上限
+    
+    # 交互模式预取配置
+    PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "False").lower() == "true"  # 启动时预热索引，生成回答期间预取追问的检索结果，也可用 main.py --prefetch 开启
+    PREFETCH_K = int(os.getenv("PREFETCH_K", "20"))  # 每次预取的候选数，应不小于 RERANK_FETCH_K
+    PREFETCH_MATCH_RATIO = float(os.getenv("PREFETCH_MATCH_RATIO", "0.5"))  # 追问的内容词项（按 idf 加权）在预取候选中出现的最低比例，低于此值时重新检索
+    
+    # 批量问答配置
+    BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "64"))  # 每轮一起嵌入和检索的问题数
+    BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))  # 同时进行的回答生成数
+    
+    # 出站HTTP连接池配置（嵌入与聊天请求共享）
+    HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "32"))
+    HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "16"))  # 保持的空闲长连接数
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))  # 空闲长连接保留秒数
+    HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "120"))  # 单个请求的超时秒数
+    
+    # HTTP服务配置
+    SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+    SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+    SERVER_CONCURRENCY = int(os.getenv("SERVER_CONCURRENCY", "8"))  # 同时处理的问题数
+    SERVER_QUEUE_SIZE = int(os.getenv("SERVER_QUEUE_SIZE", "32"))  # 排队等待的问题数上限，超出返回503
+    SERVER_MAX_BODY_BYTES = int(os.getenv("SERVER_MAX_BODY_BYTES", "1048576"))  # 请求体字节数上限，超出返回413
+    
+    # 计算器工具配置
+    CALCULATOR_TIME_BUDGET = float(os.getenv("CALCULATOR_TIME_BUDGET", "0.05"))  # 每次工具调用的计算时间预算（秒）
+    CALCULATOR_MAX_EXPRESSIONS = int(os.getenv("CALCULATOR_MAX_EXPRESSIONS", "100"))  # 每次工具调用最多计算的表达式数
+    
+    # 追踪配置
+    TRACE_ENABLED = os.getenv("TRACE_ENABLED", "False").lower() == "true"  # 记录各阶段耗时与词元数，也可用 main.py --profile 开启
+    TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "./data/traces.jsonl")
     
     # 应用配置
     DEBUG = os.getenv("DEBUG", "False").lower() == "true"
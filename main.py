@@ -3,29 +3,80 @@
 专注于提供交互式问答功能，不包含文档加载功能
 """
 
-import os
+import atexit
 import argparse
+import json
+import time
 
 from config import Config
-from app.rag.retriever import VectorRetriever
-from app.agents.qa_agent import QAAgent
+from app import resources, tracing
 
 class QASystem:
     """问答系统主类 - 专注于问答功能"""
     
-    def __init__(self):
-        """初始化问答系统"""
-        self.retriever = VectorRetriever()
-        self.agent = QAAgent(use_rag=True)
-        self.chat_history = []
+    def __init__(self, streaming: bool = True, scope=None, prefetch: bool = False):
+        """
+        初始化问答系统
+        
+        streaming: 是否流式输出回答
+        scope: 检索范围（元数据过滤条件，见 app/rag/filters.py），None 表示检索全部文档
+        prefetch: 交互模式下是否预热索引并预取追问的检索结果（见 app/agents/prefetch.py）
+        """
+        self.streaming = streaming
+        self.scope = scope
+        self.prefetch = prefetch
+        # 检索器、代理和对话记忆在首次使用时创建（同时才导入 LangChain、Chroma 等重量级依赖），
+        # 启动后可立即显示提示符，history 等命令也无需加载模型与向量数据库
+        self._retriever = None
+        self._agent = None
+        self._memory = None
+        self._prefetcher = None
+        
+        # 最近一次提问的检索耗时（秒，含等待预取的时间）与是否使用了预取结果；retrieval_log 与聊天历史逐轮对应
+        self.last_retrieval = None
+        self.retrieval_log = []
         
         # 检查向量数据库是否存在
         self._check_database_status()
     
+    @property
+    def retriever(self):
+        if self._retriever is None:
+            from app.rag.retriever import VectorRetriever
+            self._retriever = VectorRetriever()
+            self._retriever.scope = self.scope
+        return self._retriever
+    
+    @property
+    def agent(self):
+        if self._agent is None:
+            from app.agents.qa_agent import QAAgent
+            self._agent = QAAgent(use_rag=True, retriever=self.retriever)
+        return self._agent
+    
+    @property
+    def memory(self):
+        """对话记忆：最近几轮保留原文，更早的轮次在后台合并为摘要"""
+        if self._memory is None:
+            from app.agents.memory import ConversationMemory
+            self._memory = ConversationMemory()
+        return self._memory
+    
+    def _load_agent(self):
+        """创建代理与代理图（在预取器的后台线程中执行），返回代理的 RAG 链"""
+        self.agent.agent  # 首次访问时创建代理图
+        return self.agent.rag_chain
+    
+    def start_prefetch(self):
+        """启用流水线模式：后台创建代理并预热索引，之后每轮在生成回答期间预取追问的检索结果"""
+        from app.agents.prefetch import RetrievalPrefetcher
+        self._prefetcher = RetrievalPrefetcher()
+        self._prefetcher.warm_up(self._load_agent)
+    
     def _check_database_status(self):
         """检查向量数据库状态"""
         db_path = Config.VECTOR_DB_PATH
-        db_exists = os.path.exists(os.path.join(db_path, "chroma.sqlite3"))
+        db_exists = resources.vector_store_exists()
         
         if not db_exists:
             print("\n向量数据库不存在!")
@@ -39,8 +90,13 @@ class QASystem:
         print("输入 'history' 查看聊天历史")
         print("输入 'clear' 清空聊天历史")
         print("输入 'status' 查看数据库状态")
+        if tracing.is_enabled():
+            print("输入 'profile' 查看性能分析汇总")
         print("========================\n")
         
+        if self.prefetch:
+            self.start_prefetch()
+        
         while True:
             try:
                 user_input = input("您的问题: ").strip()
@@ -54,7 +110,8 @@ class QASystem:
                     continue
                 
                 if user_input.lower() == 'clear':
-                    self.chat_history = []
+                    self.memory.clear()
+                    self.retrieval_log.clear()
                     print("聊天历史已清空")
                     continue
                 
@@ -62,23 +119,26 @@ class QASystem:
                     self._show_database_status()
                     continue
                 
+                if user_input.lower() == 'profile':
+                    tracing.print_summary()
+                    continue
+                
                 # 处理问题
                 print("\n思考中...")
-                result = self.agent.invoke(user_input, self.chat_history)
+                result = self.ask(user_input, self.memory)
                 
                 if result['success']:
                     answer = result['answer']
-                    print(f"\n回答: {answer}")
                     
-                    # 更新聊天历史
-                    self.chat_history.append(("user", user_input))
-                    self.chat_history.append(("assistant", answer))
+                    # 更新聊天历史：只记录原始问题和回答，不记录检索上下文
+                    self.memory.add_turn(user_input, answer)
+                    self.retrieval_log.append(self.last_retrieval)
                     
                     # 显示中间步骤（如果有）
                     if Config.DEBUG and result.get('intermediate_steps'):
                         print("\n[调试信息] 中间步骤:")
                         for step in result['intermediate_steps']:
-                            print(f"  - {step}")
+                            print(f"  - {step['tool']}({step['tool_input']}) -> {step['observation']}")
                 else:
                     print(f"错误: {result['answer']}")
                 
@@ -90,26 +150,99 @@ class QASystem:
             except Exception as e:
                 print(f"\n发生错误: {str(e)}")
     
+    def ask(self, question: str, chat_history=None):
+        """
+        回答问题并输出到终端，流式模式下边生成边输出，并报告首字延迟与总耗时
+        
+        question: 问题
+        chat_history: 聊天历史
+        returns: 代理返回的结果字典
+        """
+        # 流水线模式：追问直接使用上一轮生成回答期间预取的检索结果
+        start = time.perf_counter()
+        retrieval = self._prefetcher.take(question) if self._prefetcher is not None else None
+        prefetched = retrieval is not None
+        
+        if not self.streaming:
+            if self._prefetcher is not None:
+                # 先完成检索，再在生成回答的同时预取下一轮
+                retrieval = retrieval or self.agent.rag_chain.retrieve(question)
+                self._record_retrieval(question, time.perf_counter() - start, prefetched)
+            result = self.agent.invoke(question, chat_history, retrieval=retrieval)
+            if result['success']:
+                print(f"\n回答: {result['answer']}")
+            return result
+        
+        result = None
+        printed = False
+        for event in self.agent.stream(question, chat_history, retrieval=retrieval):
+            if event["type"] == "retrieval":
+                elapsed = time.perf_counter() - start
+                self._record_retrieval(question, elapsed, prefetched)
+                if Config.DEBUG:
+                    print(f"[调试信息] 检索完成, 耗时 {elapsed:.2f} 秒, 命中缓存: {event['cache_hit']}, "
+                          f"使用预取结果: {prefetched}")
+            elif event["type"] == "tool_call":
+                print(f"\n[调用工具] {event['name']}: {event['args']}")
+            elif event["type"] == "tool_result" and Config.DEBUG:
+                print(f"[工具结果] {event['content']}")
+            elif event["type"] == "token":
+                if not printed:
+                    print("\n回答: ", end="", flush=True)
+                    printed = True
+                print(event["content"], end="", flush=True)
+            elif event["type"] == "final":
+                result = event["result"]
+                if printed:
+                    print()
+                print(f"\n(首字延迟 {event['ttft']:.2f} 秒, 总耗时 {event['total']:.2f} 秒)")
+        
+        return result
+    
+    def _record_retrieval(self, question: str, elapsed: float, prefetched: bool):
+        """记录本轮检索耗时，并在生成回答期间为下一轮追问预取"""
+        self.last_retrieval = {"elapsed": elapsed, "prefetched": prefetched}
+        if self._prefetcher is not None:
+            self._prefetcher.speculate(question, followed=prefetched)
+    
     def _show_history(self):
         """显示聊天历史"""
-        if not self.chat_history:
+        if self._memory is None or not self._memory.transcript:
             print("暂无聊天历史")
             return
         
         print("\n======= 聊天历史 =======")
-        for i, (role, message) in enumerate(self.chat_history):
-            role_name = "用户" if role == "user" else "助手"
-            print(f"{i+1}. [{role_name}]: {message}")
+        for i, (question, answer) in enumerate(self.memory.transcript):
+            retrieval = self.retrieval_log[i] if i < len(self.retrieval_log) else None
+            timing = ""
+            if retrieval:
+                timing = f" (检索 {retrieval['elapsed']:.2f} 秒{', 使用预取结果' if retrieval['prefetched'] else ''})"
+            print(f"{2*i+1}. [用户]: {question}{timing}")
+            print(f"{2*i+2}. [助手]: {answer}")
+        if self.memory.summary:
+            print(f"\n[较早对话摘要]: {self.memory.summary}")
+        print(f"(本轮发送的历史约 {self.memory.token_count()} 个词元)")
+        follow_ups = [retrieval["elapsed"] for retrieval in self.retrieval_log[1:] if retrieval]
+        if follow_ups:
+            print(f"(第 2 轮起平均检索耗时 {sum(follow_ups) / len(follow_ups):.2f} 秒)")
         print("=========================\n")
     
     def _show_database_status(self):
         """显示数据库状态"""
         db_path = Config.VECTOR_DB_PATH
-        db_exists = os.path.exists(os.path.join(db_path, "chroma.sqlite3"))
+        db_exists = resources.vector_store_exists()
         
         print("\n======= 数据库状态 =======")
-        print(f"数据库路径: {db_path}")
+        print(f"数据库路径: {db_path} ({Config.VECTOR_DB_TYPE})")
         print(f"状态: {'已初始化' if db_exists else '未初始化'}")
+        if self.scope:
+            print(f"检索范围: {json.dumps(self.scope, ensure_ascii=False)}")
+        if self._prefetcher is not None:
+            # 等待后台预热完成，避免与其同时创建检索器
+            self._prefetcher.wait_warm_up()
+            stats = self._prefetcher.get_stats()
+            print(f"预取检索: 预取 {stats['speculations']} 次, 追问命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, "
+                  f"过期 {stats['stale']} 次, 命中率 {stats['hit_rate']:.1%}")
         
         if db_exists:
             try:
@@ -119,6 +252,33 @@ class QASystem:
                     print("向量检索器: 可用")
                 else:
                     print("向量检索器: 不可用")
+                
+                # 本地向量库的存储与索引统计
+                if hasattr(self.retriever.db, "get_stats"):
+                    stats = self.retriever.db.get_stats()
+                    index = f"IVF {stats['ivf_lists']} 个簇" if stats["ivf_lists"] else "精确检索"
+                    dims = f"{stats['dim']}/{stats['source_dim']}" if stats["dim"] != stats["source_dim"] else stats["dim"]
+                    print(f"本地向量库: {stats['count']} 条 / {stats['rows']} 行, "
+                          f"{dims} 维 {stats['dtype']} (每行 {stats['bytes_per_row']} 字节), {index}"
+                          f"{', 另存全精度向量' if stats['full_vectors'] else ''}")
+                
+                # 嵌入缓存与嵌入请求统计（逐层查看包装的嵌入模型）
+                embeddings = self.retriever.embeddings
+                while embeddings is not None:
+                    stats = embeddings.get_stats() if hasattr(embeddings, "get_stats") else {}
+                    if "hit_rate" in stats:
+                        print(f"嵌入缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, "
+                              f"命中率 {stats['hit_rate']:.1%}")
+                    if "chunks_per_second" in stats:
+                        print(f"嵌入请求: {stats['requests']} 次, 重试 {stats['retries']} 次, "
+                              f"限流 {stats['throttled']} 次, 当前并发 {stats['concurrency']}")
+                    embeddings = getattr(embeddings, "embeddings", None)
+                
+                # 语义答案缓存统计（代理尚未创建时没有统计）
+                if self._agent is not None and self._agent.answer_cache is not None:
+                    stats = self._agent.answer_cache.get_stats()
+                    print(f"答案缓存: {stats['size']} 条, 命中 {stats['hits']}/{stats['lookups']} 次, "
+                          f"命中率 {stats['hit_rate']:.1%}")
             except Exception as e:
                 print(f"获取详细信息时出错: {str(e)}")
         
@@ -129,14 +289,72 @@ def main():
     """主函数"""
     parser = argparse.ArgumentParser(description="基于RAG的LangChain问答系统")
     parser.add_argument("--query", type=str, help="单次查询模式")
+    parser.add_argument("--no-stream", action="store_true", help="关闭流式输出，等待完整回答后再显示")
+    parser.add_argument("--batch", type=str, help="批量问答模式：输入 JSONL 文件，每行包含 question 字段")
+    parser.add_argument("--output", type=str, help="批量问答结果文件（JSONL），已存在时跳过其中已完成的问题")
+    parser.add_argument("--concurrency", type=int, default=Config.BATCH_CONCURRENCY, help="批量模式下同时生成的回答数")
+    parser.add_argument("--serve", action="store_true", help="HTTP服务模式：常驻进程，通过 POST /ask 提问")
+    parser.add_argument("--host", type=str, default=Config.SERVER_HOST, help="HTTP服务监听地址")
+    parser.add_argument("--port", type=int, default=Config.SERVER_PORT, help="HTTP服务监听端口")
+    parser.add_argument("--prefetch", action="store_true", default=Config.PREFETCH_ENABLED,
+                        help="交互模式下预热索引，并在生成回答期间预取追问的检索结果")
+    parser.add_argument("--profile", action="store_true", help="记录各阶段耗时与词元数，退出时打印汇总表并导出追踪明细")
+    parser.add_argument("--profile-output", type=str, default=Config.TRACE_EXPORT_PATH, help="追踪明细（JSONL）导出路径")
+    parser.add_argument("--source", action="append", default=[], help="只检索这些文件（相对于文档目录的路径），可重复指定")
+    parser.add_argument("--file-type", action="append", default=[], help="只检索这些类型的文件（如 pdf、md），可重复指定")
+    parser.add_argument("--tag", action="append", default=[], help="只检索带有这些标签的文档（入库时用 insert_data.py --tag 添加），可重复指定")
+    parser.add_argument("--since", type=str, help="只检索此时间之后入库的文档，如 2024-05-01 或 7d（7天内）")
+    parser.add_argument("--until", type=str, help="只检索此时间之前入库的文档")
     
     args = parser.parse_args()
+    if args.batch and not args.output:
+        parser.error("--batch 需要同时指定 --output")
+    
+    # 检索范围：按来源、文件类型、标签与入库时间过滤
+    from app.rag.filters import build_filter, parse_time
+    try:
+        scope = build_filter(
+            sources=args.source,
+            file_types=args.file_type,
+            tags=args.tag,
+            since=parse_time(args.since) if args.since else None,
+            until=parse_time(args.until) if args.until else None
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    
+    # 性能分析：启用追踪，退出时打印按阶段汇总的耗时表
+    if args.profile or tracing.is_enabled():
+        tracing.enable(args.profile_output)
+        atexit.register(tracing.print_summary)
     
     # 创建问答系统
-    qa_system = QASystem()
+    qa_system = QASystem(streaming=not args.no_stream, scope=scope, prefetch=args.prefetch)
+    
+    # HTTP服务模式
+    if args.serve:
+        from app.server import serve
+        serve(qa_system.agent, args.host, args.port)
+        return
+    
+    # 批量问答模式
+    if args.batch:
+        from app.agents.batch_runner import BatchRunner
+        runner = BatchRunner(qa_system.agent, concurrency=args.concurrency)
+        result = runner.run(args.batch, args.output)
+        print(f"\n批量问答完成: 回答 {result['questions']} 个, 跳过 {result['skipped']} 个, "
+              f"失败 {result['failed']} 个, 缓存命中 {result['cache_hits']} 个")
+        print(f"总词元 {result['total_tokens']}, 耗时 {result['seconds']:.1f} 秒, 结果已写入 {result['output_path']}")
+        return
     
     # 单次查询模式
     if args.query:
+        if qa_system.streaming:
+            result = qa_system.ask(args.query)
+            if not result['success']:
+                print(f"错误: {result['answer']}")
+            return
+        
         result = qa_system.agent.invoke(args.query)
         if result['success']:
             print(result['answer'])